@@ -0,0 +1,467 @@
+# =====================================================
+# 💾 ALMACENAMIENTO DE ARCHIVOS MULTIMEDIA
+# =====================================================
+# Guarda en disco los videos subidos sin cargarlos
+# completos en memoria: el formulario multipart se analiza
+# a medida que llega y el contenido del archivo se escribe
+# por bloques a un temporal dentro del directorio de
+# destino, se calcula su SHA-256 sobre la marcha y al
+# terminar se renombra de forma atómica al nombre derivado
+# del hash (almacenamiento por contenido).
+#
+# También gestiona las subidas reanudables por partes.
+# =====================================================
+
+from typing import NamedTuple
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Tamaño de cada bloque leído del origen (1 MiB)
+TAMANO_BLOQUE = 1024 * 1024
+
+
+class ArchivoDemasiadoGrande(Exception):
+    """El contenido supera el tamaño máximo permitido."""
+
+
+class FormularioInvalido(Exception):
+    """El cuerpo no es un formulario de subida válido; el mensaje explica por qué."""
+
+
+class ArchivoGuardado(NamedTuple):
+    """Resultado de guardar un archivo en disco."""
+    ruta: str
+    tamano: int
+    sha256: str
+
+
+def nombre_seguro(nombre: str) -> str:
+    """Descarta cualquier componente de ruta del nombre enviado por el cliente."""
+    nombre = os.path.basename((nombre or "").replace("\\", "/"))
+    if nombre in ("", ".", ".."):
+        raise ValueError("Nombre de archivo inválido")
+    return nombre
+
+
+class EscrituraTemporal:
+    """
+    Temporal oculto de `directorio` que se escribe por bloques calculando
+    su SHA-256 sobre la marcha; se publica después con `publicar_objeto`.
+
+    Si `max_bytes` es mayor que 0 y se supera, se borra el temporal y se
+    lanza `ArchivoDemasiadoGrande`.
+    """
+
+    def __init__(self, directorio: str, max_bytes: int = 0):
+        fd, self.ruta = tempfile.mkstemp(dir=directorio, prefix=".subida-", suffix=".part")
+        self._archivo = os.fdopen(fd, "wb")
+        # mkstemp crea el archivo con permisos 0600; se deja legible como un archivo normal
+        os.fchmod(fd, 0o644)
+        self._hasher = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.tamano = 0
+
+    def escribir(self, datos: bytes):
+        self.tamano += len(datos)
+        if self.max_bytes and self.tamano > self.max_bytes:
+            self.descartar()
+            raise ArchivoDemasiadoGrande(f"El archivo supera {self.max_bytes} bytes")
+        self._hasher.update(datos)
+        self._archivo.write(datos)
+
+    def terminar(self) -> ArchivoGuardado:
+        """Cierra el temporal y retorna su ruta, tamaño y SHA-256."""
+        self._archivo.close()
+        return ArchivoGuardado(self.ruta, self.tamano, self._hasher.hexdigest())
+
+    def descartar(self):
+        """Cierra y borra el temporal (se puede llamar más de una vez)."""
+        self._archivo.close()
+        if os.path.exists(self.ruta):
+            os.unlink(self.ruta)
+
+
+class FormularioSubida:
+    """
+    Analiza un cuerpo multipart/form-data a medida que llega, con el parser
+    incremental de python-multipart: los bloques recibidos se pasan a
+    `alimentar` y el contenido del campo `campo_archivo` va directo a una
+    `EscrituraTemporal` de `directorio`, sin copia intermedia en disco ni
+    en memoria. Los demás campos (texto) quedan en `campos`.
+
+    Los errores de formato lanzan `FormularioInvalido`; superar `max_bytes`
+    lanza `ArchivoDemasiadoGrande` en cuanto ocurre.
+    """
+
+    def __init__(self, tipo_contenido: str, directorio: str, campo_archivo: str = "file",
+                 max_bytes: int = 0, max_campo: int = 64 * 1024):
+        tipo, opciones = parse_options_header(tipo_contenido)
+        if tipo != b"multipart/form-data" or not opciones.get(b"boundary"):
+            raise FormularioInvalido("Se esperaba un formulario multipart/form-data")
+        self.directorio = directorio
+        self.campo_archivo = campo_archivo
+        self.max_bytes = max_bytes
+        self.max_campo = max_campo
+        self.campos = {}
+        self.nombre_archivo = None
+        self.escritura = None
+        self._cabeceras, self._cabecera, self._valor = {}, bytearray(), bytearray()
+        self._parte = None  # nombre del campo en curso
+        self._contenido = bytearray()
+        self._parser = MultipartParser(opciones[b"boundary"], callbacks={
+            "on_part_begin": self._al_iniciar_parte,
+            "on_header_field": lambda datos, inicio, fin: self._cabecera.extend(datos[inicio:fin]),
+            "on_header_value": lambda datos, inicio, fin: self._valor.extend(datos[inicio:fin]),
+            "on_header_end": self._al_terminar_cabecera,
+            "on_headers_finished": self._al_terminar_cabeceras,
+            "on_part_data": self._al_recibir_datos,
+            "on_part_end": self._al_terminar_parte,
+        })
+
+    def alimentar(self, datos: bytes):
+        """Procesa el siguiente bloque del cuerpo."""
+        try:
+            self._parser.write(datos)
+        except FormParserError as exc:
+            raise FormularioInvalido("Formulario mal formado") from exc
+
+    def terminar(self) -> ArchivoGuardado:
+        """Verifica que el cuerpo llegó completo y retorna el archivo guardado."""
+        try:
+            self._parser.finalize()
+        except FormParserError as exc:
+            raise FormularioInvalido("Formulario mal formado") from exc
+        if self._parte is not None:
+            raise FormularioInvalido("Formulario incompleto")
+        if self.escritura is None:
+            raise FormularioInvalido("Falta el archivo")
+        return self.escritura.terminar()
+
+    def descartar(self):
+        """Borra el temporal del archivo, si se llegó a crear."""
+        if self.escritura is not None:
+            self.escritura.descartar()
+
+    def _al_iniciar_parte(self):
+        self._cabeceras = {}
+        self._contenido.clear()
+
+    def _al_terminar_cabecera(self):
+        self._cabeceras[bytes(self._cabecera).lower()] = bytes(self._valor)
+        self._cabecera.clear()
+        self._valor.clear()
+
+    def _al_terminar_cabeceras(self):
+        _, opciones = parse_options_header(self._cabeceras.get(b"content-disposition", b""))
+        nombre = opciones.get(b"name", b"").decode("utf-8", "replace")
+        if not nombre:
+            raise FormularioInvalido("Parte del formulario sin nombre")
+        self._parte = nombre
+        if nombre == self.campo_archivo:
+            if self.escritura is not None:
+                raise FormularioInvalido("Se envió más de un archivo")
+            try:
+                self.nombre_archivo = nombre_seguro(opciones.get(b"filename", b"").decode("utf-8", "replace"))
+            except ValueError as exc:
+                raise FormularioInvalido(str(exc)) from exc
+            self.escritura = EscrituraTemporal(self.directorio, self.max_bytes)
+
+    def _al_recibir_datos(self, datos: bytes, inicio: int, fin: int):
+        if self._parte == self.campo_archivo:
+            self.escritura.escribir(datos[inicio:fin])
+        else:
+            self._contenido.extend(datos[inicio:fin])
+            if len(self._contenido) > self.max_campo:
+                raise FormularioInvalido(f"El campo {self._parte} es demasiado grande")
+
+    def _al_terminar_parte(self):
+        if self._parte != self.campo_archivo:
+            self.campos[self._parte] = self._contenido.decode("utf-8", "replace")
+        self._parte = None
+
+
+def calcular_sha256(ruta: str) -> str:
+    """SHA-256 de un archivo ya escrito, leído por bloques."""
+    hasher = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b""):
+            hasher.update(bloque)
+    return hasher.hexdigest()
+
+
+# =====================================================
+# 🔑 ALMACENAMIENTO POR CONTENIDO
+# =====================================================
+# Los originales se guardan en `<objetos>/<sha256><ext>` y
+# sus derivados (HLS, miniaturas) en `<objetos>/<sha256>/`.
+# El mismo contenido subido varias veces ocupa un solo
+# archivo y el nombre nunca cambia de contenido, por lo que
+# se puede servir con caché inmutable. Las referencias
+# desde `video` se cuentan en la tabla `objeto_media`.
+# =====================================================
+
+_EXTENSION_VALIDA = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+
+def nombre_objeto(sha256: str, nombre_archivo: str) -> str:
+    """Nombre del objeto: el hash más la extensión original si es razonable."""
+    extension = os.path.splitext(nombre_archivo or "")[1].lower()
+    return sha256 + (extension if _EXTENSION_VALIDA.match(extension) else "")
+
+
+def publicar_objeto(temporal: str, destino: str) -> bool:
+    """
+    Mueve el temporal a `destino`. Si el objeto ya existía (mismo contenido)
+    se descarta el temporal. Retorna True si el archivo es nuevo.
+    """
+    if os.path.exists(destino):
+        os.unlink(temporal)
+        return False
+    os.replace(temporal, destino)
+    return True
+
+
+def eliminar_objeto(ruta_archivo: str, carpeta_derivados: str):
+    """Borra el original de un objeto y todos sus derivados."""
+    try:
+        os.unlink(ruta_archivo)
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(carpeta_derivados, ignore_errors=True)
+
+
+# =====================================================
+# 🧩 SUBIDAS REANUDABLES POR PARTES
+# =====================================================
+# Cada subida vive en `<directorio>/<id_subida>/`:
+#   - meta.json: metadatos del video y tamaños
+#   - datos.part: archivo final, preasignado al tamaño total
+#   - partes/<indice>: marca de cada parte recibida
+#   - bloqueo: cerrojo (flock) compartido por las partes en
+#     curso y exclusivo al completar
+# Cada parte se escribe directamente en su posición dentro
+# de datos.part (os.pwrite), de modo que las partes pueden
+# llegar en cualquier orden y en paralelo, y al completar
+# basta con renombrar el archivo: no se vuelve a leer.
+# El cerrojo impide completar mientras una parte sigue
+# escribiendo, así ninguna escritura llega al archivo ya
+# publicado.
+# =====================================================
+
+
+class SubidaNoEncontrada(Exception):
+    """La subida no existe, ya se completó o expiró."""
+
+
+class SubidaIncompleta(Exception):
+    """Faltan partes por recibir."""
+
+
+class SubidaOcupada(Exception):
+    """Hay partes escribiéndose todavía; no se puede completar."""
+
+
+def _carpeta_subida(directorio: str, id_subida: str) -> str:
+    # El id siempre es un UUID en hexadecimal; se valida para no salir del directorio
+    return os.path.join(directorio, uuid.UUID(hex=id_subida).hex)
+
+
+def _bloquear(carpeta: str, modo: int) -> int:
+    """
+    Toma el cerrojo de la subida (fcntl.LOCK_SH o LOCK_EX, con LOCK_NB si
+    no se quiere esperar) y retorna su descriptor; cerrarlo lo libera.
+    Lanza SubidaNoEncontrada si la carpeta ya no está en su sitio.
+    """
+    try:
+        fd = os.open(os.path.join(carpeta, "bloqueo"), os.O_RDONLY | os.O_CREAT, 0o644)
+    except FileNotFoundError:
+        raise SubidaNoEncontrada()
+    try:
+        fcntl.flock(fd, modo)
+        # Un cierre concurrente pudo renombrar la carpeta antes del flock
+        if not os.path.exists(os.path.join(carpeta, "meta.json")):
+            raise SubidaNoEncontrada()
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _leer_meta(carpeta: str) -> dict:
+    try:
+        with open(os.path.join(carpeta, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise SubidaNoEncontrada()
+
+
+def iniciar_subida(directorio: str, metadatos: dict, tamano_total: int, tamano_parte: int) -> dict:
+    """
+    Crea una subida reanudable y preasigna su archivo de datos.
+    Retorna el estado inicial (ver `estado_subida`).
+    """
+    id_subida = uuid.uuid4().hex
+    carpeta = os.path.join(directorio, id_subida)
+    os.makedirs(os.path.join(carpeta, "partes"))
+    with open(os.path.join(carpeta, "datos.part"), "wb") as datos:
+        datos.truncate(tamano_total)
+    meta = dict(
+        metadatos,
+        id_subida=id_subida,
+        tamano_total=tamano_total,
+        tamano_parte=tamano_parte,
+        total_partes=max(1, -(-tamano_total // tamano_parte)),
+    )
+    with open(os.path.join(carpeta, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return estado_subida(directorio, id_subida)
+
+
+def estado_subida(directorio: str, id_subida: str) -> dict:
+    """Devuelve los metadatos de la subida junto con las partes ya recibidas."""
+    carpeta = _carpeta_subida(directorio, id_subida)
+    meta = _leer_meta(carpeta)
+    recibidas = sorted(int(nombre) for nombre in os.listdir(os.path.join(carpeta, "partes")))
+    return dict(meta, recibidas=recibidas, completa=len(recibidas) == meta["total_partes"])
+
+
+class EscrituraParte:
+    """
+    Escribe una parte de una subida en su posición dentro de datos.part.
+    Los datos se acumulan en bloques de `TAMANO_BLOQUE` antes de escribirse.
+    Mantiene el cerrojo compartido de la subida hasta `cerrar`.
+    """
+
+    def __init__(self, directorio: str, id_subida: str, indice: int):
+        self.carpeta = _carpeta_subida(directorio, id_subida)
+        self._bloqueo = _bloquear(self.carpeta, fcntl.LOCK_SH)
+        try:
+            meta = _leer_meta(self.carpeta)
+            if not 0 <= indice < meta["total_partes"]:
+                raise ValueError("Índice de parte fuera de rango")
+            self._fd = os.open(os.path.join(self.carpeta, "datos.part"), os.O_WRONLY)
+        except BaseException:
+            os.close(self._bloqueo)
+            raise
+        self.indice = indice
+        self.inicio = indice * meta["tamano_parte"]
+        self.esperado = min(meta["tamano_parte"], meta["tamano_total"] - self.inicio)
+        self.escritos = 0
+        self._pendiente = bytearray()
+
+    def escribir(self, datos: bytes):
+        """Agrega datos a la parte; lanza ValueError si exceden su tamaño."""
+        if self.escritos + len(self._pendiente) + len(datos) > self.esperado:
+            raise ValueError("La parte excede su tamaño esperado")
+        self._pendiente += datos
+        if len(self._pendiente) >= TAMANO_BLOQUE:
+            self._volcar()
+
+    def confirmar(self):
+        """Vuelca lo pendiente a disco y marca la parte como recibida."""
+        self._volcar()
+        if self.escritos != self.esperado:
+            raise ValueError("La parte está incompleta")
+        os.fsync(self._fd)
+        open(os.path.join(self.carpeta, "partes", str(self.indice)), "w").close()
+
+    def cerrar(self):
+        os.close(self._fd)
+        os.close(self._bloqueo)
+
+    def _volcar(self):
+        if self._pendiente:
+            os.pwrite(self._fd, bytes(self._pendiente), self.inicio + self.escritos)
+            self.escritos += len(self._pendiente)
+            self._pendiente.clear()
+
+
+def completar_subida(directorio: str, id_subida: str, destino: str):
+    """
+    Verifica que estén todas las partes y mueve el archivo ensamblado a
+    `destino` sin volver a leerlo. Retorna los metadatos de la subida.
+    Lanza SubidaOcupada si alguna parte se está escribiendo todavía.
+    """
+    carpeta = _carpeta_subida(directorio, id_subida)
+    try:
+        bloqueo = _bloquear(carpeta, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise SubidaOcupada()
+    try:
+        estado = estado_subida(directorio, id_subida)
+        if not estado["completa"]:
+            raise SubidaIncompleta()
+        # Renombrar la carpeta reserva la subida: una segunda petición
+        # concurrente de completar, o una parte que llegue después, ya no
+        # la encuentra
+        cerrando = carpeta + ".cerrando"
+        try:
+            os.rename(carpeta, cerrando)
+        except FileNotFoundError:
+            raise SubidaNoEncontrada()
+        try:
+            os.replace(os.path.join(cerrando, "datos.part"), destino)
+        finally:
+            shutil.rmtree(cerrando, ignore_errors=True)
+    finally:
+        os.close(bloqueo)
+    return estado
+
+
+def limpiar_subidas_abandonadas(directorio: str, max_edad_segundos: float) -> int:
+    """
+    Elimina las subidas sin actividad desde hace más de `max_edad_segundos`,
+    incluidas las carpetas `.cerrando` que dejó un cierre interrumpido.
+    """
+    limite = time.time() - max_edad_segundos
+    eliminadas = 0
+    for nombre in os.listdir(directorio):
+        carpeta = os.path.join(directorio, nombre)
+        if not os.path.isdir(carpeta):
+            continue
+        # Una carpeta `.cerrando` puede haber perdido ya datos.part: se usa
+        # la última modificación de lo que quede, y al menos la de la carpeta
+        ultima_actividad = 0.0
+        for ruta in [carpeta] + [
+            os.path.join(carpeta, nombre_archivo)
+            for nombre_archivo in ("meta.json", "datos.part", "partes")
+        ]:
+            try:
+                ultima_actividad = max(ultima_actividad, os.path.getmtime(ruta))
+            except OSError:
+                pass
+        if ultima_actividad and ultima_actividad < limite:
+            shutil.rmtree(carpeta, ignore_errors=True)
+            eliminadas += 1
+    return eliminadas
+
+
+def limpiar_temporales(directorio: str, max_edad_segundos: float) -> int:
+    """
+    Elimina los temporales `.subida-*.part` de `directorio` sin tocar desde
+    hace más de `max_edad_segundos` (subidas cortadas o procesos caídos
+    antes de publicar el objeto).
+    """
+    limite = time.time() - max_edad_segundos
+    eliminados = 0
+    for nombre in os.listdir(directorio):
+        if not (nombre.startswith(".subida-") and nombre.endswith(".part")):
+            continue
+        ruta = os.path.join(directorio, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.unlink(ruta)
+                eliminados += 1
+        except OSError:
+            continue
+    return eliminados
@@ -0,0 +1,165 @@
+# =====================================================
+# 📈 ANALÍTICAS AGREGADAS
+# =====================================================
+# En lugar de un único promedio de tiempo visto por video,
+# cada evento de reproducción se agrega en memoria en:
+#   - un histograma de retención por video: cubetas fijas
+#     de la fracción vista (segundos_vistos / duracion_total)
+#   - métricas por video y hora (UTC): vistas, likes netos,
+#     eventos de progreso y segundos vistos
+#
+# Un hilo de fondo suma lo acumulado a `retencion_video` y
+# `metrica_horaria` cada `intervalo` segundos con una sola
+# transacción (ver `crud.aplicar_analiticas`), así varios
+# procesos suman sin pisarse. `GET /videos/{id}/analiticas`
+# lee esas filas agregadas, sin recorrer eventos.
+# =====================================================
+
+from datetime import datetime
+import logging
+import threading
+
+import crud
+import models
+from tareas import TareaPeriodica
+
+logger = logging.getLogger(__name__)
+
+
+def cubeta_retencion(segundos_vistos: float, duracion_total: float):
+    """Cubeta del histograma de la fracción vista, o None sin duración válida."""
+    if not duracion_total or duracion_total <= 0:
+        return None
+    fraccion = min(max(segundos_vistos / duracion_total, 0.0), 1.0)
+    return min(int(fraccion * models.CUBETAS_RETENCION), models.CUBETAS_RETENCION - 1)
+
+
+def curva_retencion(conteos: list) -> list:
+    """
+    Fracción de sesiones que vio al menos el inicio de cada cubeta
+    (la primera siempre vale 1), a partir de los conteos por cubeta.
+    """
+    total = sum(conteos)
+    if not total:
+        return [0.0] * len(conteos)
+    curva, restantes = [], total
+    for conteo in conteos:
+        curva.append(restantes / total)
+        restantes -= conteo
+    return curva
+
+
+class AgregadorAnaliticas:
+    """
+    Agrega en memoria los eventos de reproducción y likes y los persiste
+    periódicamente como histogramas de retención y métricas por hora.
+    Con `intervalo` menor o igual a 0 el agregador queda deshabilitado.
+    """
+
+    def __init__(self, fabrica_sesion, intervalo: float):
+        self.fabrica_sesion = fabrica_sesion
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._lock_persistir = threading.Lock()
+        # (id_video, hora) -> [vistas, likes, progresos, segundos]
+        self._horarias = {}
+        # id_video -> conteos por cubeta
+        self._retencion = {}
+        self._tarea = TareaPeriodica("analiticas", intervalo, self.persistir)
+
+    @property
+    def activo(self) -> bool:
+        return self.intervalo > 0
+
+    # -------------------------------------------------
+    # Registro de eventos
+    # -------------------------------------------------
+    def registrar_vista(self, id_video):
+        self._sumar(id_video, vistas=1)
+
+    def registrar_progreso(self, id_video, segundos_vistos: float, duracion_total: float):
+        """Un evento de progreso cuenta también como vista, igual que en el contador."""
+        self._sumar(id_video, vistas=1, progresos=1, segundos=segundos_vistos,
+                    cubeta=cubeta_retencion(segundos_vistos, duracion_total))
+
+    def registrar_eventos(self, eventos):
+        """Registra eventos de `POST /interacciones` (`schemas.EventoInteraccion`)."""
+        for evento in eventos:
+            if evento.tipo == "vista":
+                self.registrar_vista(evento.id_video)
+            else:
+                self.registrar_progreso(evento.id_video, evento.segundos_vistos, evento.duracion_total)
+
+    def registrar_like(self, id_video, activo: bool):
+        """Suma (o resta, al quitarlo) un like en la hora actual."""
+        self._sumar(id_video, likes=1 if activo else -1)
+
+    def _sumar(self, id_video, vistas: int = 0, likes: int = 0, progresos: int = 0,
+               segundos: float = 0.0, cubeta: int = None):
+        if not self.activo:
+            return
+        hora = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            acumulado = self._horarias.setdefault((id_video, hora), [0, 0, 0, 0.0])
+            acumulado[0] += vistas
+            acumulado[1] += likes
+            acumulado[2] += progresos
+            acumulado[3] += segundos
+            if cubeta is not None:
+                conteos = self._retencion.setdefault(id_video, [0] * models.CUBETAS_RETENCION)
+                conteos[cubeta] += 1
+
+    def al_cambiar(self, evento: str, id_video):
+        """Oyente de `crud.notificar`: olvida los videos eliminados."""
+        if evento == "video_eliminado":
+            with self._lock:
+                self._retencion.pop(id_video, None)
+                for clave in [clave for clave in self._horarias if clave[0] == id_video]:
+                    del self._horarias[clave]
+
+    # -------------------------------------------------
+    # Persistencia
+    # -------------------------------------------------
+    def persistir(self):
+        """Suma lo acumulado a las tablas de analíticas en una transacción."""
+        with self._lock_persistir:
+            with self._lock:
+                horarias, self._horarias = self._horarias, {}
+                retencion, self._retencion = self._retencion, {}
+            if not horarias and not retencion:
+                return
+            db = self.fabrica_sesion()
+            try:
+                crud.aplicar_analiticas(db, horarias, retencion)
+            except Exception:
+                db.rollback()
+                self._reincorporar(horarias, retencion)
+                raise
+            finally:
+                db.close()
+
+    def _reincorporar(self, horarias: dict, retencion: dict):
+        """Devuelve al acumulador un lote que no se pudo persistir."""
+        with self._lock:
+            for clave, valores in horarias.items():
+                acumulado = self._horarias.setdefault(clave, [0, 0, 0, 0.0])
+                for i, valor in enumerate(valores):
+                    acumulado[i] += valor
+            for id_video, conteos in retencion.items():
+                acumulado = self._retencion.setdefault(id_video, [0] * models.CUBETAS_RETENCION)
+                for i, conteo in enumerate(conteos):
+                    acumulado[i] += conteo
+
+    # -------------------------------------------------
+    # Ciclo de vida
+    # -------------------------------------------------
+    def iniciar(self):
+        """Arranca la persistencia periódica."""
+        self._tarea.iniciar()
+
+    def detener(self):
+        """Detiene la persistencia periódica y guarda lo acumulado."""
+        if not self.activo:
+            return
+        self._tarea.detener()
+        self._tarea.ejecutar()
@@ -0,0 +1,265 @@
+# =====================================================
+# 🧮 BUFFER DE INTERACCIONES (write-behind)
+# =====================================================
+# Acumula en memoria las vistas y el progreso de
+# reproducción de cada video y los persiste por lotes,
+# tal como plantea arc42.md para los eventos de vista.
+#
+# Las peticiones sólo suman en memoria; un hilo de fondo
+# aplica todos los incrementos pendientes con un único
+# UPSERT (ver `crud.aplicar_incrementos_interaccion`)
+# cada `intervalo` segundos, o antes si el evento más
+# antiguo supera `retraso_maximo`. Al apagar la API se
+# vacía el buffer.
+#
+# Para estimar los totales que se devuelven se guardan los
+# últimos totales persistidos de hasta `max_videos` videos
+# (los menos usados se olvidan primero). Los que llevan
+# más de un `intervalo` sin actualizarse se vuelven a leer
+# de la base, así también se ven las escrituras de otros
+# procesos; los que tienen incrementos sin persistir no,
+# porque el próximo lote trae sus totales de vuelta.
+# =====================================================
+
+from collections import OrderedDict
+from datetime import timedelta
+import logging
+import threading
+import time
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+
+def descartar_duplicados(eventos) -> tuple:
+    """
+    Omite los eventos con un `id_evento` ya visto en el lote.
+    Retorna (eventos únicos, duplicados).
+    """
+    unicos = []
+    vistos = set()
+    for evento in eventos:
+        if evento.id_evento is not None:
+            if evento.id_evento in vistos:
+                continue
+            vistos.add(evento.id_evento)
+        unicos.append(evento)
+    return unicos, len(eventos) - len(unicos)
+
+
+def agrupar_eventos(eventos) -> dict:
+    """
+    Agrupa eventos de reproducción (`schemas.EventoInteraccion`) por video
+    en el formato de `crud.aplicar_incrementos_interaccion`:
+    id_video -> (vistas, progresos, segundos). Espera eventos ya sin
+    duplicados (ver `descartar_duplicados`).
+    """
+    incrementos = {}
+    for evento in eventos:
+        vistas, progresos, segundos = incrementos.get(evento.id_video, (0, 0, 0.0))
+        if evento.tipo == "vista":
+            vistas += 1
+        else:
+            progresos += 1
+            segundos += evento.segundos_vistos
+        incrementos[evento.id_video] = (vistas, progresos, segundos)
+    return incrementos
+
+
+class BufferInteracciones:
+    """
+    Coalesce por `id_video` los incrementos de vistas, número de eventos
+    de progreso y segundos vistos, y los persiste por lotes.
+    Con `intervalo` menor o igual a 0 el buffer queda deshabilitado.
+    """
+
+    def __init__(self, fabrica_sesion, intervalo: float, retraso_maximo: float,
+                 max_videos: int = 10000):
+        self.fabrica_sesion = fabrica_sesion
+        self.intervalo = intervalo
+        self.retraso_maximo = retraso_maximo
+        self.max_videos = max_videos
+        self._lock = threading.Lock()
+        self._lock_flush = threading.Lock()
+        # id_video -> [vistas, progresos, segundos]
+        self._pendientes = {}
+        # Lote que se está persistiendo ahora mismo (mismo formato)
+        self._en_vuelo = {}
+        # id_video -> (total_vistas, total_progresos, segundos_vistos_total) ya
+        # persistidos, con el momento en que se leyeron; en orden de uso (LRU)
+        self._persistido = OrderedDict()
+        self._primer_evento = None
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @property
+    def activo(self) -> bool:
+        return self.intervalo > 0
+
+    # -------------------------------------------------
+    # Registro de eventos
+    # -------------------------------------------------
+    def conoce(self, id_video) -> bool:
+        """
+        Indica si no hace falta leer el total persistido del video: se leyó
+        hace menos de un `intervalo`, o tiene incrementos sin persistir (el
+        lote que los persista traerá los totales actualizados).
+        """
+        with self._lock:
+            if id_video in self._en_vuelo:
+                return True
+            conocido = self._persistido.get(id_video)
+            if conocido is None:
+                return False
+            return id_video in self._pendientes or time.monotonic() - conocido[1] < self.intervalo
+
+    def sembrar(self, interaccion, leido_desde: float):
+        """
+        Guarda los últimos totales persistidos, usados para estimar las
+        respuestas. `leido_desde` es el `time.monotonic()` de antes de
+        leerlos: se ignoran si un lote de ese video estaba en vuelo o
+        terminó después, porque la lectura pudo no incluirlo.
+        """
+        with self._lock:
+            if interaccion.id_video in self._en_vuelo:
+                return
+            conocido = self._persistido.get(interaccion.id_video)
+            if conocido is not None and conocido[1] >= leido_desde:
+                return
+            self._guardar_persistido(interaccion.id_video, (
+                interaccion.total_vistas or 0,
+                interaccion.total_progresos or 0,
+                interaccion.segundos_vistos_total or 0.0,
+            ))
+
+    def _guardar_persistido(self, id_video, totales):
+        """Guarda los totales del video como los más recientes y olvida los menos usados."""
+        self._persistido[id_video] = (totales, time.monotonic())
+        self._persistido.move_to_end(id_video)
+        while len(self._persistido) > self.max_videos:
+            self._persistido.popitem(last=False)
+
+    def registrar_vista(self, id_video) -> int:
+        """Suma una vista y devuelve el total estimado de vistas."""
+        return self._registrar(id_video, 1, 0, 0.0)[0]
+
+    def registrar_progreso(self, id_video, segundos_vistos: float):
+        """
+        Suma un evento de progreso (que también cuenta como vista)
+        y devuelve (total_vistas, promedio_tiempo_visto) estimados.
+        """
+        return self._registrar(id_video, 0, 1, segundos_vistos)
+
+    def _registrar(self, id_video, vistas: int, progresos: int, segundos: float):
+        with self._lock:
+            pendiente = self._pendientes.setdefault(id_video, [0, 0, 0.0])
+            pendiente[0] += vistas
+            pendiente[1] += progresos
+            pendiente[2] += segundos
+            if self._primer_evento is None:
+                self._primer_evento = time.monotonic()
+            elif time.monotonic() - self._primer_evento >= self.retraso_maximo:
+                self._despertar.set()
+            return self._estimar(id_video, pendiente)
+
+    def _estimar(self, id_video, pendiente):
+        total_vistas, total_progresos, total_segundos = 0, 0, 0.0
+        if id_video in self._persistido:
+            self._persistido.move_to_end(id_video)
+            total_vistas, total_progresos, total_segundos = self._persistido[id_video][0]
+        vistas, progresos, segundos = pendiente
+        # Un lote en vuelo aún no está en los totales persistidos
+        if id_video in self._en_vuelo:
+            en_vuelo = self._en_vuelo[id_video]
+            vistas, progresos, segundos = vistas + en_vuelo[0], progresos + en_vuelo[1], segundos + en_vuelo[2]
+        total_progresos += progresos
+        promedio = timedelta(0)
+        if total_progresos:
+            promedio = timedelta(seconds=(total_segundos + segundos) / total_progresos)
+        return total_vistas + vistas + progresos, promedio
+
+    # -------------------------------------------------
+    # Persistencia
+    # -------------------------------------------------
+    def flush(self) -> int:
+        """
+        Persiste todos los incrementos pendientes en una sola sentencia.
+        Retorna el número de videos actualizados.
+        """
+        with self._lock_flush:
+            with self._lock:
+                lote, self._pendientes = self._pendientes, {}
+                self._en_vuelo = lote
+                self._primer_evento = None
+                self._despertar.clear()
+            if not lote:
+                return 0
+            db = self.fabrica_sesion()
+            try:
+                totales = crud.aplicar_incrementos_interaccion(db, lote)
+            except Exception:
+                db.rollback()
+                self._reincorporar(lote)
+                raise
+            finally:
+                db.close()
+            with self._lock:
+                for id_video in lote:
+                    # Los videos eliminados mientras tanto dejan de seguirse
+                    if id_video in totales:
+                        interaccion = totales[id_video]
+                        self._guardar_persistido(id_video, (
+                            interaccion.total_vistas,
+                            interaccion.total_progresos,
+                            interaccion.segundos_vistos_total,
+                        ))
+                    else:
+                        self._persistido.pop(id_video, None)
+                self._en_vuelo = {}
+            return len(totales)
+
+    def _reincorporar(self, lote):
+        """Devuelve al buffer un lote que no se pudo persistir."""
+        with self._lock:
+            self._en_vuelo = {}
+            for id_video, (vistas, progresos, segundos) in lote.items():
+                pendiente = self._pendientes.setdefault(id_video, [0, 0, 0.0])
+                pendiente[0] += vistas
+                pendiente[1] += progresos
+                pendiente[2] += segundos
+            if self._primer_evento is None:
+                self._primer_evento = time.monotonic()
+
+    # -------------------------------------------------
+    # Ciclo de vida
+    # -------------------------------------------------
+    def iniciar(self):
+        """Arranca el hilo que vacía el buffer periódicamente."""
+        if not self.activo or self._hilo is not None:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="buffer_interacciones", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo y persiste los eventos que sigan en memoria."""
+        if self._hilo is None:
+            return
+        self._detener.set()
+        self._despertar.set()
+        self._hilo.join()
+        self._hilo = None
+        self._flush_seguro()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.wait(self.intervalo)
+            self._flush_seguro()
+
+    def _flush_seguro(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Error al persistir el buffer de interacciones")
@@ -0,0 +1,238 @@
+# =====================================================
+# 🗃️ CACHÉ DEL FEED
+# =====================================================
+# Las primeras páginas del feed son iguales para todos los
+# usuarios, así que se guardan ya hidratadas en una caché
+# con TTL intercambiable:
+#   - CacheMemoria: LRU en el propio proceso
+#   - CacheRedis: cualquier servidor que hable el protocolo
+#     de Redis (Redis, Valkey, KeyDB...), compartida entre
+#     procesos, como plantea arc42.md
+#
+# Una página sólo guarda la lista de ids (más has_more y
+# next_cursor); cada video se guarda aparte como "tarjeta".
+# Así un like invalida una sola tarjeta y no todas las
+# páginas que la contienen. Las páginas se invalidan en
+# bloque subiendo un número de versión que forma parte de
+# su clave. El `liked` de cada usuario nunca se guarda: se
+# superpone al servir la página (ver `main.listar_videos`).
+#
+# La invalidación la disparan los eventos que publica
+# `crud.notificar` después de cada commit relevante.
+#
+# Los métodos de lectura y escritura de CacheFeed son
+# corrutinas: con un backend de red (Redis) cada llamada
+# se ejecuta en el threadpool para no bloquear el bucle de
+# eventos, y las invalidaciones (que pueden llegar desde el
+# propio bucle, dentro de `run_sync`) se envían desde un
+# hilo propio.
+# =====================================================
+
+from collections import OrderedDict
+import json
+import logging
+import queue
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMemoria:
+    """Caché LRU con TTL por entrada, segura entre hilos."""
+
+    # Operaciones en memoria: se pueden llamar desde el bucle de eventos
+    bloqueante = False
+
+    def __init__(self, max_entradas: int = 10000, ttl: float = 60):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave: str):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, expira = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def get_varios(self, claves: list) -> list:
+        return [self.get(clave) for clave in claves]
+
+    def set(self, clave: str, valor, ttl: float = None):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + (ttl or self.ttl))
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def set_varios(self, valores: dict, ttl: float = None):
+        for clave, valor in valores.items():
+            self.set(clave, valor, ttl)
+
+    def delete(self, *claves: str):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def incr(self, clave: str) -> int:
+        """Incrementa un contador que no expira (usado para versiones)."""
+        with self._lock:
+            valor, _ = self._datos.get(clave, (0, None))
+            self._datos[clave] = (valor + 1, float("inf"))
+            return valor + 1
+
+
+class CacheRedis:
+    """
+    Caché sobre un servidor con protocolo Redis. Los valores se guardan
+    como JSON; `prefijo` separa las claves de esta aplicación.
+    """
+
+    # Cada operación espera al servidor (hasta `socket_timeout`)
+    bloqueante = True
+
+    def __init__(self, url: str, ttl: float = 60, prefijo: str = "videos:"):
+        import redis  # dependencia opcional: sólo se necesita con este backend
+
+        self.ttl = ttl
+        self.prefijo = prefijo
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def _clave(self, clave: str) -> str:
+        return self.prefijo + clave
+
+    def get(self, clave: str):
+        valor = self._redis.get(self._clave(clave))
+        return None if valor is None else json.loads(valor)
+
+    def get_varios(self, claves: list) -> list:
+        if not claves:
+            return []
+        valores = self._redis.mget([self._clave(clave) for clave in claves])
+        return [None if valor is None else json.loads(valor) for valor in valores]
+
+    def set(self, clave: str, valor, ttl: float = None):
+        self._redis.set(self._clave(clave), json.dumps(valor, default=str), ex=int(ttl or self.ttl))
+
+    def set_varios(self, valores: dict, ttl: float = None):
+        tuberia = self._redis.pipeline(transaction=False)
+        for clave, valor in valores.items():
+            tuberia.set(self._clave(clave), json.dumps(valor, default=str), ex=int(ttl or self.ttl))
+        tuberia.execute()
+
+    def delete(self, *claves: str):
+        if claves:
+            self._redis.delete(*[self._clave(clave) for clave in claves])
+
+    def incr(self, clave: str) -> int:
+        return self._redis.incr(self._clave(clave))
+
+
+def crear_cache(url: str, ttl: float = 60, max_entradas: int = 10000):
+    """
+    Crea el backend según `url`: vacío o "memoria" para la LRU local y
+    "redis://..." (o "rediss://", "unix://") para un servidor Redis.
+    """
+    if not url or url == "memoria":
+        return CacheMemoria(max_entradas, ttl)
+    return CacheRedis(url, ttl)
+
+
+class CacheFeed:
+    """
+    Páginas del feed cronológico y tarjetas de video sobre un backend.
+    Un error del backend nunca hace fallar la petición: se trata como
+    un fallo de caché y se lee de la base de datos.
+    """
+
+    def __init__(self, backend, ttl_pagina: float = 30, ttl_tarjeta: float = 120):
+        self.backend = backend
+        self.ttl_pagina = ttl_pagina
+        self.ttl_tarjeta = ttl_tarjeta
+        self._invalidaciones = queue.SimpleQueue()
+        self._hilo = None
+        self._lock_hilo = threading.Lock()
+
+    # -------------------------------------------------
+    # Páginas
+    # -------------------------------------------------
+    async def clave_pagina(self, posicion: str, limite: int) -> str:
+        """
+        Clave de la página en la versión actual. Se obtiene antes de leer
+        la base de datos y se reutiliza al guardar: si entre medio se
+        invalida el feed, la página leída queda en la versión anterior.
+        """
+        version = await self._seguro(self.backend.get, "feed:version") or 0
+        return f"feed:v{version}:{limite}:{posicion}"
+
+    async def get_pagina(self, clave: str):
+        """Retorna {"ids", "has_more", "next_cursor"} o None."""
+        return await self._seguro(self.backend.get, clave)
+
+    async def set_pagina(self, clave: str, ids: list, has_more: bool, next_cursor):
+        pagina = {"ids": [str(i) for i in ids], "has_more": has_more, "next_cursor": next_cursor}
+        await self._seguro(self.backend.set, clave, pagina, self.ttl_pagina)
+
+    # -------------------------------------------------
+    # Tarjetas
+    # -------------------------------------------------
+    async def get_tarjetas(self, ids: list) -> dict:
+        """Retorna {id (str): tarjeta} con las tarjetas que estaban en caché."""
+        ids = [str(i) for i in ids]
+        valores = await self._seguro(self.backend.get_varios, [f"tarjeta:{i}" for i in ids]) or []
+        return {i: valor for i, valor in zip(ids, valores) if valor is not None}
+
+    async def set_tarjetas(self, tarjetas: list):
+        valores = {f"tarjeta:{tarjeta['id_video']}": tarjeta for tarjeta in tarjetas}
+        if valores:
+            await self._seguro(self.backend.set_varios, valores, self.ttl_tarjeta)
+
+    # -------------------------------------------------
+    # Invalidación
+    # -------------------------------------------------
+    def invalidar(self, evento: str, id_video):
+        """
+        Oyente de `crud.notificar`. Crear o eliminar un video, o etiquetarlo,
+        cambia qué videos hay en cada página (general o por etiqueta):
+        nueva versión de páginas. Cualquier otro cambio sólo afecta a la
+        tarjeta de ese video. Con un backend bloqueante se encola y la
+        aplica el hilo de invalidación.
+        """
+        if not self.backend.bloqueante:
+            self._aplicar_invalidacion(evento, id_video)
+            return
+        self._invalidaciones.put((evento, id_video))
+        with self._lock_hilo:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle_invalidacion, name="cache_feed", daemon=True)
+                self._hilo.start()
+
+    def _aplicar_invalidacion(self, evento: str, id_video):
+        try:
+            if evento in ("video_creado", "video_eliminado", "etiqueta"):
+                self.backend.incr("feed:version")
+            self.backend.delete(f"tarjeta:{id_video}")
+        except Exception:
+            logger.exception("Error en la caché del feed")
+
+    def _bucle_invalidacion(self):
+        while True:
+            self._aplicar_invalidacion(*self._invalidaciones.get())
+
+    async def _seguro(self, operacion, *args):
+        try:
+            if self.backend.bloqueante:
+                return await run_in_threadpool(operacion, *args)
+            return operacion(*args)
+        except Exception:
+            logger.exception("Error en la caché del feed")
+            return None
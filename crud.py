@@ -10,16 +10,67 @@
 # Funcionalidad cubierta:
 #  - Usuarios: creación y listado
 #  - Videos: creación, lectura, eliminación
+#  - Objetos de almacenamiento: conteo de referencias por contenido
 #  - Etiquetas: creación, listado, obtención por video
-#  - Likes: crear, eliminar, contar, verificar estado
+#  - Likes: crear, eliminar, contar, verificar estado,
+#    contador desnormalizado y su reconciliación
 #  - Interacciones: vistas, promedio de tiempo, etc.
+#  - Trabajos de procesamiento de medios (cola en segundo plano)
+#  - Feed: páginas de videos hidratadas en una sola consulta
+#  - Feed personalizado: ranking precalculado por usuario
+#  - Búsqueda de texto: tsvector + GIN (PostgreSQL) o FTS5 (SQLite)
+#  - Tendencias: puntuaciones persistidas por `tendencias.py`
+#  - Videos similares calculados por `recomendaciones.py`
+#  - Analíticas agregadas: histogramas de retención y métricas por hora
+#  - Migraciones de esquema de bases creadas con versiones anteriores
 # =====================================================
 
+from sqlalchemy import (
+    Column, MetaData, String, Table, and_, bindparam, cast, or_, select, insert, update, exists, func,
+    inspect, literal, literal_column, text, tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from datetime import datetime, timedelta
+from uuid import UUID
+import base64
+import hashlib
+import logging
+import math
+import re
+import struct
+import uuid
 import models
 import schemas
 
+logger = logging.getLogger(__name__)
+
+
+# =====================================================
+# 📣 NOTIFICACIÓN DE CAMBIOS
+# =====================================================
+# Después de confirmar un cambio que afecta a lo que muestra
+# el feed se llama a cada oyente como `oyente(evento, id_video)`
+# (p. ej. para invalidar la caché del feed). Eventos:
+# video_creado, video_eliminado, video_actualizado, etiqueta, like.
+
+OYENTES = []
+
+
+def suscribir(oyente):
+    """Registra un oyente de cambios."""
+    OYENTES.append(oyente)
+    return oyente
+
+
+def notificar(evento: str, id_video):
+    """Avisa a los oyentes; un oyente con errores no afecta a los demás."""
+    for oyente in OYENTES:
+        try:
+            oyente(evento, id_video)
+        except Exception:
+            logger.exception("Error en el oyente de %s", evento)
+
 
 # =====================================================
 # 🧍‍♂️ USUARIOS
@@ -77,42 +128,249 @@ def crear_video(db: Session, nuevo_video: models.Video):
     # Crear registro de interacción base
     interaccion = models.Interaccion(id_video=nuevo_video.id_video)
     db.add(interaccion)
+    # El autor debe ver su video: su feed personalizado se recalcula
+    db.query(models.FeedUsuarioEstado).filter(
+        models.FeedUsuarioEstado.id_usuario == nuevo_video.id_usuario
+    ).delete(synchronize_session=False)
+    indexar_busqueda_video(db, [nuevo_video.id_video])
     db.commit()
 
+    notificar("video_creado", nuevo_video.id_video)
     return nuevo_video
 
 
-def eliminar_video(db: Session, id_video):
-    """Elimina un video (y sus relaciones por cascada)."""
+def eliminar_video(db: Session, id_video, liberar_objeto=None):
+    """
+    Elimina un video (y sus relaciones por cascada) y resta una referencia
+    a su objeto de almacenamiento. Si era la última, se llama a
+    `liberar_objeto(objeto)` antes del commit para borrar los archivos
+    mientras la fila sigue bloqueada (ver `sumar_referencia_objeto`).
+    """
     video = get_video_by_id(db, id_video)
     if video:
+        sha256 = video.sha256
+        _restar_videos_etiquetas(db, id_video)
+        _desindexar_busqueda_video(db, [id_video])
         db.delete(video)
+        db.flush()
+        if sha256:
+            objeto = _restar_referencia_objeto(db, sha256)
+            if objeto is not None and liberar_objeto is not None:
+                liberar_objeto(objeto)
         db.commit()
+        notificar("video_eliminado", id_video)
         return True
     return False
 
 
+def actualizar_video(db: Session, video: models.Video, titulo: str = None, descripcion: str = None):
+    """Cambia el título y/o la descripción de un video y lo vuelve a indexar."""
+    if titulo is not None:
+        video.titulo = titulo
+    if descripcion is not None:
+        video.descripcion = descripcion
+    db.flush()
+    indexar_busqueda_video(db, [video.id_video])
+    db.commit()
+    db.refresh(video)
+    notificar("video_actualizado", video.id_video)
+    return video
+
+
+def get_video_analizado_por_sha(db: Session, sha256: str, excluir=None):
+    """Busca otro video con el mismo contenido cuyo análisis ya terminó."""
+    query = db.query(models.Video).filter(models.Video.sha256 == sha256, models.Video.estado == "listo")
+    if excluir is not None:
+        query = query.filter(models.Video.id_video != excluir)
+    return query.first()
+
+
+# =====================================================
+# 💾 OBJETOS DE ALMACENAMIENTO
+# =====================================================
+
+def sumar_referencia_objeto(db: Session, sha256: str, ruta: str, tamano: int) -> models.ObjetoMedia:
+    """
+    Registra un objeto o suma una referencia si ya existía, con un único
+    INSERT ... ON CONFLICT (sha256) DO UPDATE. No hace commit: la fila
+    queda bloqueada hasta que el llamador coloque el archivo en `ruta`
+    y confirme, así una eliminación concurrente del mismo contenido no
+    puede borrar el archivo entre medio. Retorna el objeto (con la ruta
+    del primero que lo guardó).
+    """
+    objeto = models.ObjetoMedia
+    stmt = _insert_upsert(db, objeto).values(sha256=sha256, ruta=ruta, tamano=tamano, referencias=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[objeto.sha256],
+        set_={"referencias": objeto.referencias + 1},
+    )
+    return db.scalars(stmt.returning(objeto).execution_options(populate_existing=True)).one()
+
+
+def _restar_referencia_objeto(db: Session, sha256: str):
+    """
+    Resta una referencia al objeto. Si ya no quedan, elimina su fila y lo
+    retorna para que se borren sus archivos; en otro caso retorna None.
+    """
+    objeto = models.ObjetoMedia
+    referencias = db.execute(
+        update(objeto)
+        .where(objeto.sha256 == sha256)
+        .values(referencias=objeto.referencias - 1)
+        .returning(objeto.referencias)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    if referencias is None or referencias > 0:
+        return None
+    liberado = db.get(objeto, sha256, populate_existing=True)
+    db.delete(liberado)
+    db.flush()
+    return liberado
+
+
 # =====================================================
 # 🏷️ ETIQUETAS
 # =====================================================
 
-def listar_etiquetas(db: Session):
-    """Devuelve todas las etiquetas existentes."""
-    return db.query(models.Etiqueta).all()
+def normalizar_etiqueta(nombre: str) -> str:
+    """Forma canónica de un nombre de etiqueta: minúsculas y espacios simples."""
+    return " ".join(nombre.split()).lower()[:100]
+
+
+def listar_etiquetas(db: Session, limit: int = 100):
+    """Devuelve las etiquetas del catálogo con más videos primero."""
+    return (
+        db.query(models.Etiqueta)
+        .filter(models.Etiqueta.total_videos > 0)
+        .order_by(models.Etiqueta.total_videos.desc(), models.Etiqueta.id_etiqueta)
+        .limit(limit)
+        .all()
+    )
+
+
+def _asociar_etiqueta(db: Session, nombre: str, id_video):
+    """
+    Asocia un video a una etiqueta del catálogo, creándola si no existe,
+    y suma 1 a su `total_videos` si la asociación es nueva. No hace commit.
+    Retorna {"id_etiqueta", "nombre", "id_video"} o None si el video no existe.
+    """
+    nombre = normalizar_etiqueta(nombre)
+    etiqueta = models.Etiqueta
+    # DO UPDATE (y no DO NOTHING) para que RETURNING devuelva también la fila existente
+    stmt = _insert_upsert(db, etiqueta).values(nombre=nombre, total_videos=0)
+    id_etiqueta = db.execute(
+        stmt.on_conflict_do_update(index_elements=[etiqueta.nombre], set_={"nombre": stmt.excluded.nombre})
+        .returning(etiqueta.id_etiqueta)
+    ).scalar()
+    asociacion = models.VideoEtiqueta
+    nueva = db.execute(
+        _insert_upsert(db, asociacion)
+        .from_select(
+            ["id_video", "id_etiqueta", "fecha_subida"],
+            select(
+                models.Video.id_video,
+                literal(id_etiqueta, asociacion.id_etiqueta.type),
+                models.Video.fecha_subida,
+            ).where(models.Video.id_video == id_video),
+        )
+        .on_conflict_do_nothing()
+        .returning(asociacion.id_video)
+    ).first()
+    if nueva is None:
+        if get_video_by_id(db, id_video) is None:
+            return None
+    else:
+        db.execute(
+            update(etiqueta)
+            .where(etiqueta.id_etiqueta == id_etiqueta)
+            .values(total_videos=etiqueta.total_videos + 1)
+            .execution_options(synchronize_session=False)
+        )
+    return {"id_etiqueta": id_etiqueta, "nombre": nombre, "id_video": id_video}
 
 
 def crear_etiqueta(db: Session, nombre: str, id_video):
-    """Crea una nueva etiqueta asociada a un video."""
-    etiqueta = models.Etiqueta(nombre=nombre, id_video=id_video)
-    db.add(etiqueta)
+    """
+    Asocia una etiqueta (por nombre) a un video; repetirla no tiene efecto.
+    Retorna None si el video no existe.
+    """
+    etiqueta = _asociar_etiqueta(db, nombre, id_video)
+    if etiqueta is None:
+        db.rollback()
+        return None
     db.commit()
-    db.refresh(etiqueta)
+    notificar("etiqueta", id_video)
     return etiqueta
 
 
 def get_etiqueta_por_video(db: Session, id_video):
-    """Obtiene la etiqueta asociada a un video."""
-    return db.query(models.Etiqueta).filter(models.Etiqueta.id_video == id_video).first()
+    """Obtiene la primera etiqueta asociada a un video."""
+    return (
+        db.query(models.Etiqueta)
+        .join(models.VideoEtiqueta, models.VideoEtiqueta.id_etiqueta == models.Etiqueta.id_etiqueta)
+        .filter(models.VideoEtiqueta.id_video == id_video)
+        .order_by(models.Etiqueta.id_etiqueta)
+        .first()
+    )
+
+
+def _restar_videos_etiquetas(db: Session, id_video):
+    """Resta 1 a `total_videos` de cada etiqueta del video (antes de eliminarlo)."""
+    db.execute(
+        update(models.Etiqueta)
+        .where(models.Etiqueta.id_etiqueta.in_(
+            select(models.VideoEtiqueta.id_etiqueta).where(models.VideoEtiqueta.id_video == id_video)
+        ))
+        .values(total_videos=models.Etiqueta.total_videos - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reconciliar_total_etiquetas(db: Session) -> int:
+    """
+    Repara `Etiqueta.total_videos` contando las asociaciones reales.
+    Retorna el número de contadores corregidos.
+    """
+    conteo = (
+        select(func.count())
+        .select_from(models.VideoEtiqueta)
+        .where(models.VideoEtiqueta.id_etiqueta == models.Etiqueta.id_etiqueta)
+        .correlate(models.Etiqueta)
+        .scalar_subquery()
+    )
+    corregidos = db.execute(
+        update(models.Etiqueta)
+        .where(models.Etiqueta.total_videos != conteo)
+        .values(total_videos=conteo)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if corregidos:
+        logger.warning("Reconciliados %s contadores de etiquetas", corregidos)
+    return corregidos
+
+
+def migrar_etiquetas_legadas(db: Session) -> int:
+    """
+    Copia la tabla `etiqueta` anterior (un nombre libre por fila y video)
+    al catálogo normalizado y la renombra a `etiqueta_legado` para no
+    volver a copiarla. Retorna el número de filas copiadas.
+    """
+    if not inspect(db.get_bind()).has_table("etiqueta"):
+        return 0
+    legado = Table(
+        "etiqueta", MetaData(),
+        Column("nombre", String(100)),
+        Column("id_video", models.Video.id_video.type),
+    )
+    filas = db.execute(select(legado.c.nombre, legado.c.id_video)).all()
+    for nombre, id_video in filas:
+        if normalizar_etiqueta(nombre or ""):
+            _asociar_etiqueta(db, nombre, id_video)
+    db.execute(text("ALTER TABLE etiqueta RENAME TO etiqueta_legado"))
+    db.commit()
+    logger.info("Migradas %s etiquetas al catálogo normalizado", len(filas))
+    return len(filas)
 
 
 # =====================================================
@@ -126,6 +384,80 @@ def get_like(db: Session, id_usuario: int, id_video):
         models.Like.id_video == id_video
     ).first()
 
+def toggle_like(db: Session, id_usuario: int, id_video):
+    """
+    Activa o desactiva el like de un usuario sobre un video.
+    El cambio de estado y el contador `Interaccion.total_likes` se actualizan
+    en la misma transacción con sentencias atómicas.
+    Retorna (liked, total_likes).
+    """
+    like = get_like(db, id_usuario, id_video)
+    if like is None:
+        # INSERT ... ON CONFLICT DO NOTHING: si otra petición crea el registro
+        # a la vez, se sigue como un cambio de estado sobre el suyo
+        creado = db.execute(
+            _insert_upsert(db, models.Like)
+            .values(like_id=uuid.uuid4(), id_usuario=id_usuario, id_video=id_video, activo=True)
+            .on_conflict_do_nothing(index_elements=[models.Like.id_usuario, models.Like.id_video])
+        ).rowcount
+        if creado:
+            total = _ajustar_total_likes(db, id_video, 1)
+            db.commit()
+            notificar("like", id_video)
+            return True, total
+        like = get_like(db, id_usuario, id_video)
+    liked = not like.activo
+    if not _cambiar_estado_like(db, id_usuario, id_video, liked):
+        # Otra petición cambió el estado primero: se devuelve el estado actual
+        db.rollback()
+        db.refresh(like)
+        return bool(like.activo), get_total_likes(db, id_video)
+    total = _ajustar_total_likes(db, id_video, 1 if liked else -1)
+    db.commit()
+    notificar("like", id_video)
+    return liked, total
+
+
+def get_ids_con_like(db: Session, id_usuario: int, ids: list) -> set:
+    """Subconjunto de `ids` con like activo del usuario, en una sola consulta IN."""
+    if not ids:
+        return set()
+    return set(db.scalars(
+        select(models.Like.id_video).where(
+            models.Like.id_usuario == id_usuario,
+            models.Like.activo.is_(True),
+            models.Like.id_video.in_(ids),
+        )
+    ))
+
+
+def get_estado_likes(db: Session, id_usuario: int, ids: list) -> list:
+    """
+    Estado de like de varios videos con dos consultas IN: los contadores
+    desde `interaccion` y los likes activos del usuario desde `likes`.
+    Retorna un dict por id (sin repetidos, en el orden recibido) con
+    id_video, likes, liked y like_id.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+    totales = dict(db.execute(
+        select(models.Interaccion.id_video, models.Interaccion.total_likes)
+        .where(models.Interaccion.id_video.in_(ids))
+    ).all())
+    likes = dict(db.execute(
+        select(models.Like.id_video, models.Like.like_id).where(
+            models.Like.id_usuario == id_usuario,
+            models.Like.activo.is_(True),
+            models.Like.id_video.in_(ids),
+        )
+    ).all())
+    return [
+        {"id_video": i, "likes": totales.get(i) or 0, "liked": i in likes, "like_id": likes.get(i)}
+        for i in ids
+    ]
+
+
 def create_like(db: Session, id_usuario: int, id_video):
     """
     Si no existe el registro, lo crea con activo=True y genera like_id (UUID).
@@ -133,68 +465,128 @@ def create_like(db: Session, id_usuario: int, id_video):
     Si existe y activo=True, lo pone en activo=False (quita el like).
     No elimina el registro.
     """
-    import uuid
-    like = get_like(db, id_usuario, id_video)
-    interaccion = get_interaccion_por_video(db, id_video)
-    if like:
-        if like.activo:
-            # Quitar el like
-            like.activo = False
-            if interaccion and interaccion.total_likes > 0:
-                interaccion.total_likes -= 1
-            db.commit()
-            return like
-        else:
-            # Dar el like
-            like.activo = True
-            if interaccion:
-                interaccion.total_likes += 1
-            db.commit()
-            return like
-    # Si no existe, crear nuevo registro con activo=True y like_id (UUID)
-    like = models.Like(
-        like_id=uuid.uuid4(),  # <-- Esto es correcto si la columna en la BD es tipo UUID
-        id_usuario=id_usuario,
-        id_video=id_video,
-        activo=True
-    )
-    db.add(like)
-    if not interaccion:
-        interaccion = crear_interaccion(db, id_video)
-    interaccion.total_likes += 1
-    db.commit()
-    db.refresh(like)
-    return like
+    toggle_like(db, id_usuario, id_video)
+    return get_like(db, id_usuario, id_video)
 
 def delete_like(db: Session, id_usuario: int, id_video):
     """No elimina el registro, solo lo pone en activo=False."""
-    like = get_like(db, id_usuario, id_video)
-    if like and like.activo:
-        like.activo = False
-        interaccion = get_interaccion_por_video(db, id_video)
-        if interaccion and interaccion.total_likes > 0:
-            interaccion.total_likes -= 1
+    if _cambiar_estado_like(db, id_usuario, id_video, False):
+        _ajustar_total_likes(db, id_video, -1)
         db.commit()
+        notificar("like", id_video)
         return True
     return False
 
 def actualizar_estado_like(db: Session, id_usuario: int, id_video, activo: bool):
     """Actualiza el campo activo de un registro Like existente."""
-    like = db.query(models.Like).filter_by(id_usuario=id_usuario, id_video=id_video).first()
-    if like:
-        like.activo = activo
+    if _cambiar_estado_like(db, id_usuario, id_video, activo):
+        _ajustar_total_likes(db, id_video, 1 if activo else -1)
         db.commit()
-        db.refresh(like)
-        return like
-    return None
+        notificar("like", id_video)
+    return get_like(db, id_usuario, id_video)
+
+def _cambiar_estado_like(db: Session, id_usuario: int, id_video, activo: bool) -> bool:
+    """
+    Cambia el estado del like sólo si es distinto del actual (UPDATE condicional).
+    Retorna True si la fila cambió, de modo que el contador se ajusta
+    exactamente una vez aunque lleguen peticiones concurrentes.
+    """
+    resultado = db.execute(
+        update(models.Like)
+        .where(
+            models.Like.id_usuario == id_usuario,
+            models.Like.id_video == id_video,
+            models.Like.activo.is_distinct_from(activo),
+        )
+        .values(activo=activo)
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount > 0
+
+def _ajustar_total_likes(db: Session, id_video, delta: int) -> int:
+    """
+    Suma `delta` al contador de likes del video en SQL
+    (UPDATE ... SET total_likes = total_likes ± 1) y devuelve el nuevo total.
+    No hace commit: forma parte de la transacción del cambio de like.
+    """
+    total = db.execute(
+        update(models.Interaccion)
+        .where(models.Interaccion.id_video == id_video)
+        .values(total_likes=func.coalesce(models.Interaccion.total_likes, 0) + delta)
+        .returning(models.Interaccion.total_likes)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if total is None:
+        # Video sin registro de interacción: se crea con el conteo real (que ya
+        # incluye este cambio). Si otra petición lo creó a la vez, se suma al suyo
+        db.flush()
+        total = _contar_likes_activos(db, id_video)
+        creado = db.execute(
+            _insert_upsert(db, models.Interaccion)
+            .values(id_video=id_video, total_vistas=0, total_likes=total,
+                    total_progresos=0, segundos_vistos_total=0)
+            .on_conflict_do_nothing(index_elements=[models.Interaccion.id_video])
+        ).rowcount
+        if not creado:
+            return _ajustar_total_likes(db, id_video, delta)
+    return total
 
 def get_total_likes(db: Session, id_video):
-    """Cuenta los likes activos de un video."""
+    """Devuelve el contador de likes activos de un video (O(1), desde `interaccion`)."""
+    total = db.query(models.Interaccion.total_likes).filter(
+        models.Interaccion.id_video == id_video
+    ).scalar()
+    return total or 0
+
+def _contar_likes_activos(db: Session, id_video):
+    """Cuenta los likes activos de un video en la tabla `likes` (fuente de verdad)."""
     return db.query(models.Like).filter(
         models.Like.id_video == id_video,
         models.Like.activo == True
     ).count()
 
+def reconciliar_total_likes(db: Session) -> int:
+    """
+    Repara la desviación de `Interaccion.total_likes` recalculándolo
+    desde la tabla `likes`, que es la fuente de verdad.
+    Crea el registro de interacción de los videos que no lo tengan.
+    Retorna el número de contadores corregidos.
+    """
+    conteo = (
+        select(func.count(models.Like.like_id))
+        .where(
+            models.Like.id_video == models.Interaccion.id_video,
+            models.Like.activo == True
+        )
+        .correlate(models.Interaccion)
+        .scalar_subquery()
+    )
+    corregidos = db.execute(
+        update(models.Interaccion)
+        .where(func.coalesce(models.Interaccion.total_likes, -1) != conteo)
+        .values(total_likes=conteo)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    conteo_video = (
+        select(func.count(models.Like.like_id))
+        .where(
+            models.Like.id_video == models.Video.id_video,
+            models.Like.activo == True
+        )
+        .correlate(models.Video)
+        .scalar_subquery()
+    )
+    sin_interaccion = ~exists().where(models.Interaccion.id_video == models.Video.id_video)
+    creados = db.execute(
+        insert(models.Interaccion).from_select(
+            ["id_video", "total_vistas", "total_likes"],
+            select(models.Video.id_video, literal(0), conteo_video).where(sin_interaccion),
+        )
+    ).rowcount
+    db.commit()
+    return corregidos + max(creados, 0)
+
 
 # =====================================================
 # 📊 INTERACCIONES (Vistas y analítica)
@@ -214,36 +606,1206 @@ def crear_interaccion(db: Session, id_video):
     return interaccion
 
 
+def _insert_upsert(db: Session, modelo):
+    """Devuelve un INSERT con soporte ON CONFLICT para el motor de la sesión."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(modelo)
+    return sqlite.insert(modelo)
+
+
+def _upsert_interaccion(db: Session, filas: list):
+    """
+    Suma contadores a los registros de interacción en una sola sentencia
+    INSERT ... ON CONFLICT (id_video) DO UPDATE, creando los que falten.
+    Cada fila trae id_video, total_vistas, total_progresos y
+    segundos_vistos_total como incrementos.
+    """
+    interaccion = models.Interaccion
+    stmt = _insert_upsert(db, interaccion).values(
+        [dict(fila, total_likes=0) for fila in filas]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[interaccion.id_video],
+        set_={
+            columna: func.coalesce(getattr(interaccion, columna), 0) + getattr(stmt.excluded, columna)
+            for columna in ("total_vistas", "total_progresos", "segundos_vistos_total")
+        },
+    )
+    registros = db.scalars(
+        stmt.returning(interaccion).execution_options(populate_existing=True)
+    ).all()
+    # Se separan de la sesión para que el commit no los expire y leerlos
+    # después no requiera otra consulta
+    for registro in registros:
+        db.expunge(registro)
+    return registros
+
+
 def registrar_vista(db: Session, id_video):
-    """Incrementa el contador de vistas de un video."""
-    interaccion = get_interaccion_por_video(db, id_video)
-    if not interaccion:
-        interaccion = crear_interaccion(db, id_video)
-    interaccion.total_vistas += 1
+    """Incrementa el contador de vistas de un video con una sentencia atómica."""
+    interaccion, = _upsert_interaccion(db, [
+        {"id_video": id_video, "total_vistas": 1, "total_progresos": 0, "segundos_vistos_total": 0},
+    ])
     db.commit()
-    db.refresh(interaccion)
     return interaccion
 
 
 def registrar_progreso(db: Session, id_video, segundos_vistos: float, duracion_total: float):
     """
-    Actualiza el promedio de tiempo visto según la duración visualizada por el usuario.
-    Similar al modelo usado por TikTok / Instagram Reels.
+    Registra el tiempo visualizado por el usuario (cuenta también como vista).
+    Suma los segundos y el número de eventos en SQL con una sentencia atómica;
+    el promedio se deriva de ambos (ver `Interaccion.promedio_tiempo_visto`).
+    """
+    interaccion, = _upsert_interaccion(db, [
+        {"id_video": id_video, "total_vistas": 1, "total_progresos": 1, "segundos_vistos_total": segundos_vistos},
+    ])
+    db.commit()
+    return interaccion
+
+
+def aplicar_incrementos_interaccion(db: Session, incrementos: dict):
     """
-    interaccion = get_interaccion_por_video(db, id_video)
-    if not interaccion:
-        interaccion = crear_interaccion(db, id_video)
-    interaccion.total_vistas += 1
+    Aplica en una sola sentencia los incrementos acumulados por el buffer
+    de interacciones (ver `buffer_interacciones.py`).
+
+    `incrementos` mapea id_video -> (vistas, progresos, segundos); cada evento
+    de progreso cuenta también como vista, igual que en `registrar_progreso`.
+    Los videos que ya no existen se descartan.
+    Retorna id_video -> registro de interacción ya persistido.
+    """
+    existentes = {
+        id_video for id_video, in
+        db.query(models.Video.id_video).filter(models.Video.id_video.in_(list(incrementos)))
+    }
+    filas = [
+        {
+            "id_video": id_video,
+            "total_vistas": vistas + progresos,
+            "total_progresos": progresos,
+            "segundos_vistos_total": segundos,
+        }
+        for id_video, (vistas, progresos, segundos) in incrementos.items()
+        if id_video in existentes
+    ]
+    if not filas:
+        return {}
+    totales = {interaccion.id_video: interaccion for interaccion in _upsert_interaccion(db, filas)}
+    db.commit()
+    return totales
+
+
 
-    # Calcular nuevo promedio (ponderado)
-    vistas_previas = max(1, interaccion.total_vistas)
-    nuevo_promedio = (
-        (interaccion.promedio_tiempo_visto.total_seconds() * (vistas_previas - 1) + segundos_vistos)
-        / vistas_previas
+# =====================================================
+# ⚙️ TRABAJOS DE PROCESAMIENTO DE MEDIOS
+# =====================================================
+
+def crear_trabajo_media(db: Session, id_video, tipo: str):
+    """Encola un trabajo de procesamiento para un video."""
+    trabajo = models.TrabajoMedia(id_video=id_video, tipo=tipo)
+    db.add(trabajo)
+    db.commit()
+    db.refresh(trabajo)
+    return trabajo
+
+
+def tomar_trabajo_media(db: Session, excluir_tipos=()):
+    """
+    Reserva el siguiente trabajo pendiente cuyo turno ya llegó y lo marca
+    como `en_proceso`. En PostgreSQL usa FOR UPDATE SKIP LOCKED para que
+    varios trabajadores (o procesos) no tomen el mismo trabajo.
+    Los tipos de `excluir_tipos` se omiten (p. ej. por estar al límite de
+    concurrencia). Retorna None si no hay trabajos disponibles.
+    """
+    filtros = [
+        models.TrabajoMedia.estado == "pendiente",
+        models.TrabajoMedia.disponible_desde <= datetime.utcnow(),
+    ]
+    if excluir_tipos:
+        filtros.append(models.TrabajoMedia.tipo.notin_(list(excluir_tipos)))
+    trabajo = (
+        db.query(models.TrabajoMedia)
+        .filter(*filtros)
+        .order_by(models.TrabajoMedia.disponible_desde, models.TrabajoMedia.id_trabajo)
+        .with_for_update(skip_locked=True)
+        .first()
     )
+    if trabajo is None:
+        db.rollback()
+        return None
+    # Actualización condicional: si otro trabajador lo tomó primero no cambia ninguna fila
+    tomado = db.execute(
+        update(models.TrabajoMedia)
+        .where(
+            models.TrabajoMedia.id_trabajo == trabajo.id_trabajo,
+            models.TrabajoMedia.estado == "pendiente",
+        )
+        .values(
+            estado="en_proceso",
+            intentos=models.TrabajoMedia.intentos + 1,
+            fecha_actualizacion=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if not tomado:
+        return None
+    db.refresh(trabajo)
+    return trabajo
 
-    interaccion.promedio_tiempo_visto = timedelta(seconds=nuevo_promedio)
 
+def finalizar_trabajo_media(db: Session, trabajo: models.TrabajoMedia, error: str = None,
+                            max_intentos: int = 3, espera_reintento: float = 30):
+    """
+    Marca un trabajo como completado o, si falló, lo reprograma con espera
+    exponencial hasta agotar `max_intentos`, tras lo cual queda `fallido`.
+    """
+    if error is None:
+        trabajo.estado = "completado"
+        trabajo.progreso = 1
+        trabajo.error = None
+    elif trabajo.intentos < max_intentos:
+        trabajo.estado = "pendiente"
+        trabajo.error = error
+        trabajo.disponible_desde = datetime.utcnow() + timedelta(
+            seconds=espera_reintento * 2 ** (trabajo.intentos - 1)
+        )
+    else:
+        trabajo.estado = "fallido"
+        trabajo.error = error
     db.commit()
-    db.refresh(interaccion)
-    return interaccion
+    return trabajo
+
+
+def actualizar_progreso_trabajo(db: Session, id_trabajo: int, progreso: float):
+    """Guarda el avance (0 a 1) de un trabajo en curso."""
+    db.execute(
+        update(models.TrabajoMedia)
+        .where(models.TrabajoMedia.id_trabajo == id_trabajo)
+        .values(progreso=progreso, fecha_actualizacion=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def reencolar_trabajos_colgados(db: Session, max_segundos: float) -> int:
+    """
+    Devuelve a `pendiente` los trabajos que siguen `en_proceso` sin avances
+    desde hace más de `max_segundos` (p. ej. por un reinicio del servidor).
+    """
+    limite = datetime.utcnow() - timedelta(seconds=max_segundos)
+    reencolados = db.execute(
+        update(models.TrabajoMedia)
+        .where(
+            models.TrabajoMedia.estado == "en_proceso",
+            models.TrabajoMedia.fecha_actualizacion < limite,
+        )
+        .values(estado="pendiente", disponible_desde=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return reencolados
+
+
+def get_trabajos_por_video(db: Session, id_video):
+    """Lista los trabajos de procesamiento de un video."""
+    return (
+        db.query(models.TrabajoMedia)
+        .filter(models.TrabajoMedia.id_video == id_video)
+        .order_by(models.TrabajoMedia.id_trabajo)
+        .all()
+    )
+
+# =====================================================
+# 📰 FEED (páginas hidratadas)
+# =====================================================
+
+def _etiqueta_principal():
+    """Subconsulta correlacionada con la primera etiqueta de cada video."""
+    return (
+        select(models.Etiqueta.nombre)
+        .join(models.VideoEtiqueta, models.VideoEtiqueta.id_etiqueta == models.Etiqueta.id_etiqueta)
+        .where(models.VideoEtiqueta.id_video == models.Video.id_video)
+        .order_by(models.Etiqueta.id_etiqueta)
+        .limit(1)
+        .correlate(models.Video)
+        .scalar_subquery()
+    )
+
+
+def _consulta_feed(db: Session, id_usuario: int = None):
+    """
+    Construye la consulta base del feed.
+    Cada fila trae el video junto con el nombre del autor, su etiqueta,
+    el contador de likes (`Interaccion.total_likes`) y si `id_usuario`
+    le dio 'like'. Todo se resuelve con joins y subconsultas correlacionadas
+    en una sola sentencia, evitando las consultas adicionales por cada video
+    de la página.
+    """
+    etiqueta = _etiqueta_principal()
+    if id_usuario is None:
+        liked = literal(False)
+    else:
+        liked = (
+            exists()
+            .where(
+                models.Like.id_video == models.Video.id_video,
+                models.Like.id_usuario == id_usuario,
+                models.Like.activo == True
+            )
+            .correlate(models.Video)
+        )
+    return (
+        db.query(
+            models.Video,
+            func.coalesce(models.UsuarioApp.nombre, "Desconocido").label("usuario"),
+            func.coalesce(etiqueta, "").label("etiqueta"),
+            func.coalesce(models.Interaccion.total_likes, 0).label("likes"),
+            liked.label("liked"),
+        )
+        .outerjoin(models.UsuarioApp, models.UsuarioApp.id_usuario == models.Video.id_usuario)
+        .outerjoin(models.Interaccion, models.Interaccion.id_video == models.Video.id_video)
+    )
+
+
+def codificar_cursor(fecha_subida: datetime, id_video) -> str:
+    """Genera el cursor opaco que apunta a la posición (fecha_subida, id_video)."""
+    crudo = f"{fecha_subida.isoformat()}|{id_video}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    """
+    Recupera la posición (fecha_subida, id_video) de un cursor.
+    Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha, id_video = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        return datetime.fromisoformat(fecha), UUID(id_video)
+    except Exception as exc:
+        raise ValueError("Cursor inválido") from exc
+
+
+def get_feed_videos(db: Session, limit: int = 10, skip: int = 0, cursor: str = None, id_usuario: int = None,
+                    etiqueta: str = None):
+    """
+    Devuelve una página del feed ordenada por (fecha_subida, id_video), ya hidratada.
+
+    Con `cursor` se usa paginación por cursor (keyset): la consulta busca
+    directamente a partir de la última posición vista usando el índice
+    compuesto, sin recorrer las filas anteriores como hace OFFSET.
+    Sin cursor se mantiene la paginación por `skip`.
+
+    Con `etiqueta` sólo se incluyen los videos con esa etiqueta; el orden
+    y el cursor usan entonces el índice (id_etiqueta, fecha_subida,
+    id_video) de `video_etiqueta`.
+
+    Se piden `limit + 1` filas para saber si hay más páginas sin contar
+    toda la tabla. Retorna (filas, has_more, next_cursor).
+    """
+    consulta = _consulta_feed(db, id_usuario)
+    fecha_orden, id_orden = models.Video.fecha_subida, models.Video.id_video
+    if etiqueta is not None:
+        asociacion = models.VideoEtiqueta
+        id_etiqueta = (
+            select(models.Etiqueta.id_etiqueta)
+            .where(models.Etiqueta.nombre == normalizar_etiqueta(etiqueta))
+            .scalar_subquery()
+        )
+        consulta = consulta.join(asociacion, asociacion.id_video == models.Video.id_video).filter(
+            asociacion.id_etiqueta == id_etiqueta
+        )
+        fecha_orden, id_orden = asociacion.fecha_subida, asociacion.id_video
+    consulta = consulta.order_by(fecha_orden.asc(), id_orden.asc())
+    if cursor:
+        fecha, id_video = decodificar_cursor(cursor)
+        consulta = consulta.filter(
+            tuple_(fecha_orden, id_orden)
+            > tuple_(
+                literal(fecha, fecha_orden.type),
+                literal(id_video, id_orden.type),
+            )
+        )
+    else:
+        consulta = consulta.offset(skip)
+    filas = consulta.limit(limit + 1).all()
+    has_more = len(filas) > limit
+    filas = filas[:limit]
+    next_cursor = None
+    if has_more:
+        ultimo = filas[-1].Video
+        next_cursor = codificar_cursor(ultimo.fecha_subida, ultimo.id_video)
+    return filas, has_more, next_cursor
+
+
+def get_feed_por_ids(db: Session, ids: list, id_usuario: int = None):
+    """
+    Hidrata un conjunto de videos conocidos en una sola consulta,
+    respetando el orden de `ids`.
+    """
+    if not ids:
+        return []
+    filas = _consulta_feed(db, id_usuario).filter(models.Video.id_video.in_(ids)).all()
+    por_id = {fila.Video.id_video: fila for fila in filas}
+    return [por_id[i] for i in ids if i in por_id]
+
+
+def _rotacion_aleatoria(semilla: int, id_usuario: int = None):
+    """
+    Deriva de forma estable, para una sesión, cuál de las claves aleatorias
+    del video se recorre y desde qué punto. Retorna (columna, inicio).
+    """
+    digest = hashlib.sha256(f"{semilla}:{id_usuario}".encode()).digest()
+    claves = (
+        models.Video.clave_aleatoria,
+        models.Video.clave_aleatoria_2,
+        models.Video.clave_aleatoria_3,
+        models.Video.clave_aleatoria_4,
+    )
+    return claves[digest[4] % len(claves)], int.from_bytes(digest[:4], "big") % 2**31
+
+
+def get_feed_aleatorio(db: Session, semilla: int, limit: int = 10,
+                       cursor: str = None, id_usuario: int = None):
+    """
+    Devuelve una página del feed aleatorio de una sesión, ya hidratada.
+
+    No es una permutación distinta por sesión sino una rotación: cada
+    video tiene cuatro claves aleatorias fijas e independientes, y la
+    semilla elige una de ellas y un punto de inicio. El feed recorre el
+    índice (clave, id_video) desde ahí, dando la vuelta al llegar al final
+    (fase 0: claves >= inicio, fase 1: claves < inicio). Las sesiones que
+    usan la misma clave ven los mismos videos seguidos, sólo empezando en
+    otro punto; a cambio el orden es estable, sin repetidos, y cada página
+    cuesta O(limit) en la base de datos (un recorrido de índice por cursor,
+    sin OFFSET ni conteos).
+
+    Sin `cursor` se devuelve la primera página de la semilla; con `cursor`
+    la semilla se toma del propio cursor.
+    Retorna (filas, has_more, next_cursor, semilla).
+    """
+    fase, posicion = 0, None
+    if cursor:
+        semilla_cursor, fase, posicion = _decodificar_cursor_aleatorio(cursor)
+        if semilla is not None and semilla_cursor != semilla:
+            raise ValueError("Cursor inválido")
+        semilla = semilla_cursor
+    clave, inicio = _rotacion_aleatoria(semilla, id_usuario)
+
+    filas = []
+    for fase_actual in range(fase, 2):
+        consulta = _consulta_feed(db, id_usuario).filter(
+            clave >= inicio if fase_actual == 0 else clave < inicio
+        )
+        if posicion and fase_actual == fase:
+            consulta = consulta.filter(
+                tuple_(clave, models.Video.id_video)
+                > tuple_(posicion[0], literal(posicion[1], models.Video.id_video.type))
+            )
+        consulta = consulta.order_by(clave.asc(), models.Video.id_video.asc())
+        encontradas = consulta.limit(limit + 1 - len(filas)).all()
+        filas.extend((fase_actual, fila) for fila in encontradas)
+        if len(filas) > limit:
+            break
+
+    has_more = len(filas) > limit
+    filas = filas[:limit]
+    next_cursor = None
+    if has_more:
+        fase_ultima, ultima = filas[-1]
+        next_cursor = _codificar_cursor_aleatorio(
+            semilla, fase_ultima, getattr(ultima.Video, clave.key), ultima.Video.id_video
+        )
+    return [fila for _, fila in filas], has_more, next_cursor, semilla
+
+
+def _codificar_cursor_aleatorio(semilla: int, fase: int, clave: int, id_video) -> str:
+    """Genera el cursor opaco del feed aleatorio."""
+    crudo = f"{semilla}|{fase}|{clave}|{id_video}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor_aleatorio(cursor: str):
+    """
+    Recupera (semilla, fase, (clave, id_video)) de un cursor del feed aleatorio.
+    Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        semilla, fase, clave, id_video = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        if fase not in ("0", "1"):
+            raise ValueError(fase)
+        return int(semilla), int(fase), (int(clave), UUID(id_video))
+    except Exception as exc:
+        raise ValueError("Cursor inválido") from exc
+
+
+
+# =====================================================
+# 🎯 FEED PERSONALIZADO (precalculado por usuario)
+# =====================================================
+# El ranking se calcula una vez por generación y se guarda
+# en `feed_usuario` como una lista ordenada de ids; cada
+# página es un rango de la clave primaria
+# (id_usuario, posicion). Se recalcula perezosamente en la
+# primera lectura sin generación vigente o caducada.
+
+# Videos candidatos por generación (mitad recientes, mitad populares)
+FEED_CANDIDATOS = 500
+# Horas tras las que la frescura de un video pesa la mitad
+FEED_VIDA_MEDIA_HORAS = 48.0
+# Multiplicador máximo por afinidad con las etiquetas que le gustan al usuario
+FEED_PESO_AFINIDAD = 2.0
+
+
+def _candidatos_feed(db: Session, limite: int):
+    """Videos más recientes y con más likes, con sus contadores y etiqueta."""
+    interaccion = models.Interaccion
+    likes = func.coalesce(interaccion.total_likes, 0)
+    base = (
+        select(
+            models.Video.id_video,
+            models.Video.fecha_subida,
+            likes.label("likes"),
+            func.coalesce(interaccion.total_vistas, 0).label("vistas"),
+            func.coalesce(_etiqueta_principal(), "").label("etiqueta"),
+        )
+        .outerjoin(interaccion, interaccion.id_video == models.Video.id_video)
+    )
+    mitad = max(limite // 2, 1)
+    recientes = db.execute(
+        base.order_by(models.Video.fecha_subida.desc(), models.Video.id_video.desc()).limit(mitad)
+    ).all()
+    populares = db.execute(base.order_by(likes.desc(), models.Video.id_video).limit(mitad)).all()
+    return list({fila.id_video: fila for fila in recientes + populares}.values())
+
+
+def _afinidad_etiquetas(db: Session, id_usuario: int) -> dict:
+    """Etiqueta -> fracción (0 a 1) de los likes activos del usuario con esa etiqueta."""
+    conteos = dict(db.execute(
+        select(models.Etiqueta.nombre, func.count())
+        .join(models.VideoEtiqueta, models.VideoEtiqueta.id_etiqueta == models.Etiqueta.id_etiqueta)
+        .join(models.Like, models.Like.id_video == models.VideoEtiqueta.id_video)
+        .where(models.Like.id_usuario == id_usuario, models.Like.activo.is_(True))
+        .group_by(models.Etiqueta.nombre)
+    ).all())
+    maximo = max(conteos.values(), default=0)
+    return {nombre: conteo / maximo for nombre, conteo in conteos.items()} if maximo else {}
+
+
+def rankear_feed(candidatos: list, afinidad: dict) -> list:
+    """
+    Ordena los candidatos por puntuación: popularidad (likes y vistas en
+    escala logarítmica) por afinidad con las etiquetas del usuario, con
+    decaimiento exponencial según la antigüedad respecto al video más
+    reciente. Retorna [(id_video, puntuacion)] de mayor a menor.
+    """
+    if not candidatos:
+        return []
+    referencia = max(fila.fecha_subida for fila in candidatos)
+    puntuados = []
+    for fila in candidatos:
+        horas = max((referencia - fila.fecha_subida).total_seconds() / 3600, 0)
+        popularidad = 1 + math.log1p(fila.likes) + 0.25 * math.log1p(fila.vistas)
+        preferencia = 1 + FEED_PESO_AFINIDAD * afinidad.get(fila.etiqueta, 0)
+        frescura = 0.5 ** (horas / FEED_VIDA_MEDIA_HORAS)
+        puntuados.append((fila.id_video, popularidad * preferencia * frescura))
+    puntuados.sort(key=lambda par: (-par[1], str(par[0])))
+    return puntuados
+
+
+def regenerar_feed_usuario(db: Session, id_usuario: int):
+    """
+    Recalcula y guarda el feed de un usuario como una nueva generación.
+    El UPSERT del estado bloquea su fila hasta el commit, así dos
+    regeneraciones simultáneas del mismo usuario no se mezclan.
+    """
+    estado = models.FeedUsuarioEstado
+    ahora = datetime.utcnow()
+    stmt = _insert_upsert(db, estado).values(id_usuario=id_usuario, generacion=1, generado_en=ahora, total=0)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[estado.id_usuario],
+        set_={"generacion": estado.generacion + 1, "generado_en": ahora},
+    ))
+    ranking = rankear_feed(_candidatos_feed(db, FEED_CANDIDATOS), _afinidad_etiquetas(db, id_usuario))
+    db.query(models.FeedUsuario).filter(
+        models.FeedUsuario.id_usuario == id_usuario
+    ).delete(synchronize_session=False)
+    if ranking:
+        db.execute(insert(models.FeedUsuario), [
+            {"id_usuario": id_usuario, "posicion": posicion, "id_video": id_video, "puntuacion": puntuacion}
+            for posicion, (id_video, puntuacion) in enumerate(ranking)
+        ])
+    db.execute(
+        update(estado).where(estado.id_usuario == id_usuario).values(total=len(ranking))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.get(estado, id_usuario, populate_existing=True)
+
+
+def get_feed_usuario(db: Session, id_usuario: int, limit: int, cursor: str = None,
+                     ttl: timedelta = timedelta(minutes=10)):
+    """
+    Devuelve una página del feed personalizado: (ids, has_more, next_cursor).
+
+    La primera página (sin cursor) recalcula el feed si no hay generación
+    o caducó su `ttl`; las siguientes siguen leyendo la generación vigente
+    para no reordenar la lista mientras se recorre.
+    Retorna None si el usuario no existe. Lanza ValueError si el cursor
+    no es válido y CursorCaducado si el feed cambió de generación desde
+    que se emitió (hay que volver a la primera página).
+    """
+    generacion, posicion = None, -1
+    if cursor:
+        generacion, posicion = _decodificar_cursor_feed_usuario(cursor)
+    estado = db.get(models.FeedUsuarioEstado, id_usuario, populate_existing=True)
+    if estado is None and get_usuario_by_id(db, id_usuario) is None:
+        return None
+    if cursor and (estado is None or estado.generacion != generacion):
+        raise CursorCaducado("El feed cambió; vuelve a pedir la primera página")
+    if estado is None or (cursor is None and datetime.utcnow() - estado.generado_en > ttl):
+        estado = regenerar_feed_usuario(db, id_usuario)
+    filas = db.execute(
+        select(models.FeedUsuario.posicion, models.FeedUsuario.id_video)
+        .where(models.FeedUsuario.id_usuario == id_usuario, models.FeedUsuario.posicion > posicion)
+        .order_by(models.FeedUsuario.posicion)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(filas) > limit
+    filas = filas[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = _codificar_cursor_feed_usuario(estado.generacion, filas[-1].posicion)
+    return [fila.id_video for fila in filas], has_more, next_cursor
+
+
+def purgar_feeds_usuario(db: Session, antiguedad: timedelta) -> int:
+    """Borra los feeds no regenerados en `antiguedad` (usuarios inactivos)."""
+    estado = models.FeedUsuarioEstado
+    viejos = select(estado.id_usuario).where(estado.generado_en < datetime.utcnow() - antiguedad)
+    db.query(models.FeedUsuario).filter(
+        models.FeedUsuario.id_usuario.in_(viejos)
+    ).delete(synchronize_session=False)
+    borrados = db.query(estado).filter(estado.id_usuario.in_(viejos)).delete(synchronize_session=False)
+    db.commit()
+    return borrados
+
+
+class CursorCaducado(ValueError):
+    """Cursor del feed personalizado de una generación que ya no existe."""
+
+
+def _codificar_cursor_feed_usuario(generacion: int, posicion: int) -> str:
+    """Genera el cursor opaco del feed personalizado."""
+    crudo = f"{generacion}|{posicion}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor_feed_usuario(cursor: str):
+    """
+    Recupera (generacion, posicion) de un cursor del feed personalizado.
+    Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        generacion, posicion = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        return int(generacion), int(posicion)
+    except Exception as exc:
+        raise ValueError("Cursor inválido") from exc
+
+
+
+# =====================================================
+# 🔎 BÚSQUEDA DE TEXTO
+# =====================================================
+# PostgreSQL: columna `Video.busqueda` (tsvector) con índice
+# GIN, consultas con websearch_to_tsquery y orden por
+# ts_rank_cd. SQLite (modo local): tabla virtual FTS5
+# `video_fts` con orden por bm25. En ambos casos el índice
+# se actualiza en la misma transacción que crea, modifica
+# o elimina el video.
+
+# Configuración de texto de PostgreSQL (raíces y palabras vacías)
+CONFIG_BUSQUEDA = "spanish"
+
+
+def _es_postgresql(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _documento_busqueda():
+    """Expresión tsvector del título (peso A) y la descripción (peso B) de cada video."""
+    config = cast(literal(CONFIG_BUSQUEDA), postgresql.REGCONFIG)
+    titulo = func.setweight(func.to_tsvector(config, func.coalesce(models.Video.titulo, "")), literal_column("'A'"))
+    descripcion = func.setweight(
+        func.to_tsvector(config, func.coalesce(models.Video.descripcion, "")), literal_column("'B'")
+    )
+    return titulo.op("||")(descripcion)
+
+
+def indexar_busqueda_video(db: Session, ids: list):
+    """(Re)indexa el texto de los videos `ids`. No hace commit."""
+    if not ids:
+        return
+    if _es_postgresql(db):
+        db.execute(
+            update(models.Video)
+            .where(models.Video.id_video.in_(ids))
+            .values(busqueda=_documento_busqueda())
+            .execution_options(synchronize_session=False)
+        )
+        return
+    _desindexar_busqueda_video(db, ids)
+    db.execute(
+        text(
+            "INSERT INTO video_fts (id_video, titulo, descripcion) "
+            "SELECT id_video, titulo, coalesce(descripcion, '') FROM video WHERE id_video IN :ids"
+        ).bindparams(bindparam("ids", expanding=True)),
+        {"ids": [UUID(str(i)).hex for i in ids]},
+    )
+
+
+def _desindexar_busqueda_video(db: Session, ids: list):
+    """Quita videos del índice FTS5 (en PostgreSQL el índice vive en la propia fila)."""
+    if ids and not _es_postgresql(db):
+        db.execute(
+            text("DELETE FROM video_fts WHERE id_video IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": [UUID(str(i)).hex for i in ids]},
+        )
+
+
+def indexar_busqueda_pendiente(db: Session, lote: int = 1000) -> int:
+    """
+    Indexa por lotes los videos que aún no están en el índice de búsqueda
+    (p. ej. los creados antes de existir). Retorna cuántos se indexaron.
+    """
+    total = 0
+    while True:
+        if _es_postgresql(db):
+            pendientes = select(models.Video.id_video).where(models.Video.busqueda.is_(None))
+        else:
+            pendientes = select(models.Video.id_video).where(
+                models.Video.id_video.notin_(select(literal_column("id_video")).select_from(text("video_fts")))
+            )
+        ids = db.scalars(pendientes.limit(lote)).all()
+        if not ids:
+            return total
+        indexar_busqueda_video(db, ids)
+        db.commit()
+        total += len(ids)
+
+
+def _consulta_fts5(texto: str) -> str:
+    """
+    Traduce el texto del usuario a una consulta FTS5 segura: cada palabra
+    entre comillas (todas obligatorias) y la última como prefijo.
+    """
+    palabras = re.findall(r"\w+", texto)
+    if not palabras:
+        return ""
+    return " ".join(f'"{p}"' for p in palabras[:-1]) + (" " if len(palabras) > 1 else "") + f'"{palabras[-1]}"*'
+
+
+def buscar_videos(db: Session, texto: str, limit: int = 10, cursor: str = None):
+    """
+    Busca videos por título y descripción, de mayor a menor relevancia.
+
+    La paginación es por cursor sobre (relevancia, id_video): cada página
+    continúa justo después de la última fila vista. Retorna
+    (ids, has_more, next_cursor). Lanza ValueError si el cursor no es válido.
+    """
+    posicion = _decodificar_cursor_busqueda(cursor) if cursor else None
+    if _es_postgresql(db):
+        consulta_ts = func.websearch_to_tsquery(cast(literal(CONFIG_BUSQUEDA), postgresql.REGCONFIG), texto)
+        rango = func.ts_rank_cd(models.Video.busqueda, consulta_ts)
+        consulta = select(models.Video.id_video, rango.label("rango")).where(
+            models.Video.busqueda.op("@@")(consulta_ts)
+        )
+        if posicion:
+            consulta = consulta.where(or_(
+                rango < posicion[0],
+                and_(rango == posicion[0], models.Video.id_video > posicion[1]),
+            ))
+        filas = db.execute(consulta.order_by(rango.desc(), models.Video.id_video).limit(limit + 1)).all()
+        filas = [(fila.id_video, fila.rango) for fila in filas]
+    else:
+        consulta_fts = _consulta_fts5(texto)
+        if not consulta_fts:
+            return [], False, None
+        # bm25 es menor cuanto más relevante: se invierte el signo para
+        # ordenar y paginar igual que en PostgreSQL
+        sql = "SELECT id_video, -bm25(video_fts) AS rango FROM video_fts WHERE video_fts MATCH :consulta"
+        parametros = {"consulta": consulta_fts, "limite": limit + 1}
+        if posicion:
+            sql += " AND (-bm25(video_fts) < :rango OR (-bm25(video_fts) = :rango AND id_video > :id_video))"
+            parametros.update(rango=posicion[0], id_video=posicion[1].hex)
+        sql += " ORDER BY rango DESC, id_video LIMIT :limite"
+        filas = [(UUID(id_video), rango) for id_video, rango in db.execute(text(sql), parametros)]
+    has_more = len(filas) > limit
+    filas = filas[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = _codificar_cursor_busqueda(filas[-1][1], filas[-1][0])
+    return [id_video for id_video, _ in filas], has_more, next_cursor
+
+
+def _codificar_cursor_busqueda(rango: float, id_video) -> str:
+    """Genera el cursor opaco de la búsqueda."""
+    crudo = f"{float(rango)!r}|{id_video}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor_busqueda(cursor: str):
+    """
+    Recupera (rango, id_video) de un cursor de la búsqueda.
+    Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        rango, id_video = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        return float(rango), UUID(id_video)
+    except Exception as exc:
+        raise ValueError("Cursor inválido") from exc
+
+
+
+# =====================================================
+# 🔥 TENDENCIAS
+# =====================================================
+# El cálculo de las puntuaciones vive en `tendencias.py`;
+# aquí sólo se leen y guardan.
+
+# Puntuación (logarítmica) de una fila creada sólo para bloquearla: equivale a 0
+_SIN_PUNTUACION = float("-inf")
+
+def bloquear_puntuaciones_tendencia(db: Session, ids: list) -> dict:
+    """
+    Lee las puntuaciones actuales de `ids` bloqueando sus filas hasta el
+    commit (FOR UPDATE en PostgreSQL), para sumarles incrementos sin
+    perder los de otros procesos. Las filas que faltan se crean antes
+    (ON CONFLICT DO NOTHING) para que también queden bloqueadas, y se
+    bloquean en orden de id_video para no interbloquearse con otro
+    proceso. Los videos que ya no existen se omiten.
+    Retorna id_video -> log_puntuacion (None para las filas recién creadas).
+    """
+    tendencia = models.PuntuacionTendencia
+    existentes = list(db.scalars(
+        select(models.Video.id_video).where(models.Video.id_video.in_(ids))
+    ))
+    if not existentes:
+        return {}
+    db.execute(
+        _insert_upsert(db, tendencia)
+        .values([
+            {"id_video": id_video, "log_puntuacion": _SIN_PUNTUACION, "fecha_actualizacion": datetime.utcnow()}
+            for id_video in existentes
+        ])
+        .on_conflict_do_nothing(index_elements=[tendencia.id_video])
+    )
+    filas = db.execute(
+        select(tendencia.id_video, tendencia.log_puntuacion)
+        .where(tendencia.id_video.in_(existentes))
+        .order_by(tendencia.id_video)
+        .with_for_update()
+    ).all()
+    return {id_video: None if valor == _SIN_PUNTUACION else valor for id_video, valor in filas}
+
+
+def guardar_puntuaciones_tendencia(db: Session, puntuaciones: dict) -> int:
+    """
+    Guarda id_video -> log_puntuacion con un único UPSERT y confirma.
+    Los videos que ya no existen se descartan. Retorna las filas guardadas.
+    """
+    existentes = set(db.scalars(
+        select(models.Video.id_video).where(models.Video.id_video.in_(list(puntuaciones)))
+    ))
+    filas = [
+        {"id_video": id_video, "log_puntuacion": valor, "fecha_actualizacion": datetime.utcnow()}
+        for id_video, valor in puntuaciones.items()
+        if id_video in existentes
+    ]
+    if filas:
+        stmt = _insert_upsert(db, models.PuntuacionTendencia).values(filas)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[models.PuntuacionTendencia.id_video],
+            set_={
+                "log_puntuacion": stmt.excluded.log_puntuacion,
+                "fecha_actualizacion": stmt.excluded.fecha_actualizacion,
+            },
+        ))
+    db.commit()
+    return len(filas)
+
+
+
+def get_top_tendencias(db: Session, limite: int) -> list:
+    """Las `limite` mejores puntuaciones [(id_video, log_puntuacion)], por el índice."""
+    tendencia = models.PuntuacionTendencia
+    return [tuple(fila) for fila in db.execute(
+        select(tendencia.id_video, tendencia.log_puntuacion)
+        .order_by(tendencia.log_puntuacion.desc(), tendencia.id_video)
+        .limit(limite)
+    )]
+
+
+def hay_puntuaciones_tendencia(db: Session) -> bool:
+    return db.query(exists().where(models.PuntuacionTendencia.id_video.isnot(None))).scalar()
+
+
+def iterar_interacciones(db: Session, lote: int = 1000):
+    """
+    Recorre por lotes (keyset por id_video) los contadores de todos los
+    videos: filas con id_video, fecha_subida, total_vistas, total_likes,
+    total_progresos y segundos_vistos_total.
+    """
+    ultimo = None
+    while True:
+        consulta = (
+            select(
+                models.Video.id_video,
+                models.Video.fecha_subida,
+                func.coalesce(models.Interaccion.total_vistas, 0).label("total_vistas"),
+                func.coalesce(models.Interaccion.total_likes, 0).label("total_likes"),
+                func.coalesce(models.Interaccion.total_progresos, 0).label("total_progresos"),
+                func.coalesce(models.Interaccion.segundos_vistos_total, 0).label("segundos_vistos_total"),
+            )
+            .outerjoin(models.Interaccion, models.Interaccion.id_video == models.Video.id_video)
+            .order_by(models.Video.id_video)
+            .limit(lote)
+        )
+        if ultimo is not None:
+            consulta = consulta.where(models.Video.id_video > ultimo)
+        filas = db.execute(consulta).all()
+        if not filas:
+            return
+        yield from filas
+        ultimo = filas[-1].id_video
+
+
+
+# =====================================================
+# 🧭 VIDEOS SIMILARES
+# =====================================================
+
+def iterar_likes_activos(db: Session, lote: int = 50000):
+    """
+    Recorre por lotes los likes activos como pares (id_usuario, id_video),
+    con paginación por cursor sobre el índice único (id_usuario, id_video).
+    """
+    ultimo = None
+    while True:
+        consulta = (
+            select(models.Like.id_usuario, models.Like.id_video)
+            .where(models.Like.activo.is_(True))
+            .order_by(models.Like.id_usuario, models.Like.id_video)
+            .limit(lote)
+        )
+        if ultimo is not None:
+            consulta = consulta.where(
+                tuple_(models.Like.id_usuario, models.Like.id_video)
+                > tuple_(literal(ultimo[0]), literal(ultimo[1], models.Like.id_video.type))
+            )
+        filas = db.execute(consulta).all()
+        if not filas:
+            return
+        yield from filas
+        ultimo = tuple(filas[-1])
+
+
+def guardar_similares(db: Session, vecinos: dict):
+    """
+    Reemplaza los vecinos de cada video: id_video -> [(id_similar, puntuacion)]
+    ya ordenados de mayor a menor. Confirma al terminar.
+    """
+    if not vecinos:
+        return
+    db.query(models.VideoSimilar).filter(
+        models.VideoSimilar.id_video.in_(list(vecinos))
+    ).delete(synchronize_session=False)
+    filas = [
+        {"id_video": id_video, "posicion": posicion, "id_similar": id_similar, "puntuacion": puntuacion}
+        for id_video, lista in vecinos.items()
+        for posicion, (id_similar, puntuacion) in enumerate(lista)
+    ]
+    if filas:
+        db.execute(insert(models.VideoSimilar), filas)
+    db.commit()
+
+
+def purgar_similares(db: Session) -> int:
+    """Borra los vecinos de los videos que ya no tienen likes activos."""
+    con_likes = select(models.Like.id_video).where(models.Like.activo.is_(True))
+    borrados = db.query(models.VideoSimilar).filter(
+        models.VideoSimilar.id_video.notin_(con_likes)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return borrados
+
+
+def get_similares(db: Session, id_video, limit: int = 10) -> list:
+    """Ids de los videos más parecidos a `id_video`, por la clave primaria."""
+    return list(db.scalars(
+        select(models.VideoSimilar.id_similar)
+        .where(models.VideoSimilar.id_video == id_video)
+        .order_by(models.VideoSimilar.posicion)
+        .limit(limit)
+    ))
+
+
+
+# =====================================================
+# 📈 ANALÍTICAS AGREGADAS
+# =====================================================
+# Las acumula `analiticas.py` y se suman aquí por lotes;
+# las consultas leen filas ya agregadas (nunca eventos).
+
+def empaquetar_histograma(valores) -> bytes:
+    """Empaqueta conteos como enteros de 64 bits little-endian."""
+    return struct.pack(f"<{len(valores)}q", *valores)
+
+
+def desempaquetar_histograma(datos: bytes) -> list:
+    return list(struct.unpack(f"<{len(datos) // 8}q", datos))
+
+
+def aplicar_analiticas(db: Session, horarias: dict, retencion: dict) -> set:
+    """
+    Suma en una transacción los agregados acumulados en memoria:
+      - horarias: (id_video, hora) -> (vistas, likes, progresos, segundos),
+        con un único UPSERT que suma a las filas existentes
+      - retencion: id_video -> conteos por cubeta (CUBETAS_RETENCION)
+    Los videos que ya no existen se descartan. Retorna los ids aplicados.
+    """
+    ids = {id_video for id_video, _ in horarias} | set(retencion)
+    existentes = set(db.scalars(
+        select(models.Video.id_video).where(models.Video.id_video.in_(list(ids)))
+    ))
+    metrica = models.MetricaHoraria
+    filas = [
+        {
+            "id_video": id_video, "hora": hora, "vistas": vistas, "likes": likes,
+            "progresos": progresos, "segundos_vistos": segundos,
+        }
+        for (id_video, hora), (vistas, likes, progresos, segundos) in horarias.items()
+        if id_video in existentes
+    ]
+    if filas:
+        stmt = _insert_upsert(db, metrica).values(filas)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[metrica.id_video, metrica.hora],
+            set_={
+                columna: getattr(metrica, columna) + getattr(stmt.excluded, columna)
+                for columna in ("vistas", "likes", "progresos", "segundos_vistos")
+            },
+        ))
+    retencion = {id_video: conteos for id_video, conteos in retencion.items() if id_video in existentes}
+    if retencion:
+        _sumar_retencion(db, retencion)
+    db.commit()
+    return existentes
+
+
+def _sumar_retencion(db: Session, retencion: dict):
+    """
+    Suma conteos a los histogramas empaquetados. Crea las filas que falten
+    y bloquea las de `retencion` (FOR UPDATE en PostgreSQL, en orden para
+    no bloquearse con otro proceso) antes de leerlas y reescribirlas.
+    """
+    modelo = models.RetencionVideo
+    ahora = datetime.utcnow()
+    vacio = empaquetar_histograma([0] * models.CUBETAS_RETENCION)
+    db.execute(
+        _insert_upsert(db, modelo)
+        .values([
+            {"id_video": id_video, "histograma": vacio, "total_sesiones": 0, "fecha_actualizacion": ahora}
+            for id_video in retencion
+        ])
+        .on_conflict_do_nothing(index_elements=[modelo.id_video])
+    )
+    actuales = db.execute(
+        select(modelo.id_video, modelo.histograma)
+        .where(modelo.id_video.in_(list(retencion)))
+        .order_by(modelo.id_video)
+        .with_for_update()
+    ).all()
+    cambios = []
+    for id_video, datos in actuales:
+        suma = [a + b for a, b in zip(desempaquetar_histograma(datos), retencion[id_video])]
+        cambios.append({
+            "id_video": id_video,
+            "histograma": empaquetar_histograma(suma),
+            "total_sesiones": sum(suma),
+            "fecha_actualizacion": ahora,
+        })
+    # UPDATE por clave primaria en lote (executemany)
+    db.execute(update(modelo), cambios)
+
+
+def get_retencion(db: Session, id_video):
+    """Conteos por cubeta del histograma de retención de un video, o None."""
+    datos = db.scalar(
+        select(models.RetencionVideo.histograma).where(models.RetencionVideo.id_video == id_video)
+    )
+    return None if datos is None else desempaquetar_histograma(datos)
+
+
+def get_metricas_horarias(db: Session, id_video, desde: datetime) -> list:
+    """Filas de `metrica_horaria` de un video desde `desde`, por la clave primaria."""
+    metrica = models.MetricaHoraria
+    return list(db.scalars(
+        select(metrica)
+        .where(metrica.id_video == id_video, metrica.hora >= desde)
+        .order_by(metrica.hora)
+    ))
+
+
+def purgar_metricas_horarias(db: Session, antiguedad: timedelta) -> int:
+    """Borra las métricas por hora más antiguas que `antiguedad`."""
+    borradas = (
+        db.query(models.MetricaHoraria)
+        .filter(models.MetricaHoraria.hora < datetime.utcnow() - antiguedad)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return borradas
+
+
+
+# =====================================================
+# 🛠️ MIGRACIONES DE ESQUEMA
+# =====================================================
+# `create_all` crea las tablas que faltan pero nunca
+# modifica las existentes. Estas migraciones llevan una
+# base creada con un esquema anterior al de `models.py`;
+# son idempotentes y se ejecutan al arrancar (ver main.py).
+
+def migrar_esquema(db: Session) -> list:
+    """
+    Agrega a las tablas existentes las columnas del modelo que les falten
+    (rellenando las filas existentes con su valor por defecto), aplica la
+    unicidad de likes por usuario y video y crea los índices que falten.
+    Retorna las columnas agregadas como "tabla.columna".
+    """
+    motor = db.get_bind()
+    agregadas = []
+    for tabla in models.Base.metadata.sorted_tables:
+        inspector = inspect(db.connection())
+        if not inspector.has_table(tabla.name):
+            continue
+        existentes = {columna["name"] for columna in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name not in existentes:
+                _agregar_columna(db, tabla, columna)
+                agregadas.append(f"{tabla.name}.{columna.name}")
+    for nombre in agregadas:
+        if nombre.startswith("video.clave_aleatoria"):
+            _rellenar_clave_aleatoria(db, nombre.split(".")[1])
+    _migrar_promedio_tiempo_visto(db)
+    if _es_postgresql(db):
+        preparador = motor.dialect.identifier_preparer
+        for nombre in agregadas:
+            tabla, columna = models.Base.metadata.tables[nombre.split(".")[0]], nombre.split(".")[1]
+            if not tabla.c[columna].nullable:
+                db.execute(text(
+                    f"ALTER TABLE {preparador.format_table(tabla)} "
+                    f"ALTER COLUMN {preparador.quote(columna)} SET NOT NULL"
+                ))
+    likes_unificados = _unificar_likes(db)
+    # Índices de las tablas existentes (los de las nuevas ya los creó create_all)
+    for tabla in models.Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(db.connection(), checkfirst=True)
+    db.commit()
+    if likes_unificados:
+        reconciliar_total_likes(db)
+    if agregadas:
+        logger.info("Columnas agregadas al esquema: %s", ", ".join(agregadas))
+    return agregadas
+
+
+def _agregar_columna(db: Session, tabla, columna):
+    """ALTER TABLE ... ADD COLUMN (nulable) y relleno con el valor por defecto escalar."""
+    dialecto = db.get_bind().dialect
+    preparador = dialecto.identifier_preparer
+    ddl = (
+        f"ALTER TABLE {preparador.format_table(tabla)} "
+        f"ADD COLUMN {preparador.format_column(columna)} {columna.type.compile(dialect=dialecto)}"
+    )
+    for clave_foranea in columna.foreign_keys:
+        referida = clave_foranea.column
+        ddl += f" REFERENCES {preparador.format_table(referida.table)} ({preparador.format_column(referida)})"
+    db.execute(text(ddl))
+    if columna.default is not None and columna.default.is_scalar:
+        db.execute(update(tabla).where(columna.is_(None)).values({columna.name: columna.default.arg}))
+
+
+def _rellenar_clave_aleatoria(db: Session, columna: str):
+    """Clave aleatoria `columna` del feed aleatorio para los videos existentes."""
+    if _es_postgresql(db):
+        valor = "floor(random() * 2147483647)::integer"
+    else:
+        valor = "abs(random() % 2147483647)"
+    db.execute(text(f"UPDATE video SET {columna} = {valor} WHERE {columna} IS NULL"))
+
+
+def _migrar_promedio_tiempo_visto(db: Session):
+    """
+    Pasa el promedio guardado como intervalo (`promedio_tiempo_visto`,
+    promediado sobre `total_vistas`) a suma de segundos y número de
+    eventos, y borra la columna anterior.
+    """
+    columnas = {columna["name"] for columna in inspect(db.connection()).get_columns("interaccion")}
+    if "promedio_tiempo_visto" not in columnas:
+        return
+    if _es_postgresql(db):
+        segundos = "EXTRACT(EPOCH FROM promedio_tiempo_visto)"
+    else:
+        # SQLite guarda el intervalo como fecha contada desde 1970-01-01
+        # (segundos enteros desde la época más la fracción de %f)
+        segundos = (
+            "(strftime('%s', promedio_tiempo_visto) - strftime('%S', promedio_tiempo_visto)"
+            " + strftime('%f', promedio_tiempo_visto))"
+        )
+    db.execute(text(
+        f"UPDATE interaccion SET segundos_vistos_total = {segundos} * COALESCE(total_vistas, 0), "
+        "total_progresos = COALESCE(total_vistas, 0) "
+        "WHERE promedio_tiempo_visto IS NOT NULL"
+    ))
+    db.execute(text("ALTER TABLE interaccion DROP COLUMN promedio_tiempo_visto"))
+    logger.info("Migrado promedio_tiempo_visto a segundos_vistos_total / total_progresos")
+
+
+def _unificar_likes(db: Session) -> int:
+    """
+    Crea la restricción única (id_usuario, id_video) de likes si falta,
+    dejando antes un solo registro por par (el activo, si lo hay).
+    Retorna el número de registros duplicados borrados.
+    """
+    inspector = inspect(db.connection())
+    nombres = {restriccion["name"] for restriccion in inspector.get_unique_constraints("likes")}
+    nombres |= {indice["name"] for indice in inspector.get_indexes("likes") if indice["unique"]}
+    if "uq_likes_usuario_video" in nombres:
+        return 0
+    like = models.Like
+    duplicados = db.execute(
+        select(like.id_usuario, like.id_video)
+        .group_by(like.id_usuario, like.id_video)
+        .having(func.count() > 1)
+    ).all()
+    borrados = 0
+    for id_usuario, id_video in duplicados:
+        registros = db.scalars(
+            select(like)
+            .where(like.id_usuario == id_usuario, like.id_video == id_video)
+            .order_by(func.coalesce(like.activo, False).desc())
+        ).all()
+        for registro in registros[1:]:
+            db.delete(registro)
+            borrados += 1
+    db.flush()
+    # Un índice único sirve de destino a ON CONFLICT igual que la restricción
+    db.execute(text("CREATE UNIQUE INDEX uq_likes_usuario_video ON likes (id_usuario, id_video)"))
+    if borrados:
+        logger.info("Borrados %s likes duplicados", borrados)
+    return borrados
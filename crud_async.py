@@ -0,0 +1,105 @@
+# =====================================================
+# ⚡ CRUD ASÍNCRONO
+# =====================================================
+# Versiones asíncronas de las funciones de `crud.py` para
+# usarlas con una `AsyncSession` desde endpoints `async def`.
+#
+# Cada función ejecuta la versión síncrona original con
+# `AsyncSession.run_sync`: la lógica (consultas, upserts,
+# actualizaciones condicionales) es la misma y las esperas
+# de E/S ocurren en el driver asíncrono (asyncpg), por lo
+# que no bloquean el bucle de eventos ni ocupan un hilo
+# del threadpool.
+#
+# Las funciones que hacen E/S de disco además de consultas
+# (p. ej. `eliminar_video`) no se exponen aquí: sus
+# endpoints siguen siendo síncronos.
+# =====================================================
+
+import functools
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+
+
+def _asincrona(funcion):
+    """Envuelve `funcion(db, ...)` de crud.py como corrutina sobre una AsyncSession."""
+    @functools.wraps(funcion)
+    async def envoltura(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(funcion, *args, **kwargs)
+    return envoltura
+
+
+# =====================================================
+# 🧍‍♂️ USUARIOS
+# =====================================================
+listar_usuarios = _asincrona(crud.listar_usuarios)
+get_usuario_by_correo = _asincrona(crud.get_usuario_by_correo)
+get_usuario_by_id = _asincrona(crud.get_usuario_by_id)
+crear_usuario = _asincrona(crud.crear_usuario)
+
+# =====================================================
+# 🎥 VIDEOS
+# =====================================================
+get_videos = _asincrona(crud.get_videos)
+contar_videos = _asincrona(crud.contar_videos)
+get_video_by_id = _asincrona(crud.get_video_by_id)
+actualizar_video = _asincrona(crud.actualizar_video)
+
+# =====================================================
+# 🏷️ ETIQUETAS
+# =====================================================
+listar_etiquetas = _asincrona(crud.listar_etiquetas)
+crear_etiqueta = _asincrona(crud.crear_etiqueta)
+get_etiqueta_por_video = _asincrona(crud.get_etiqueta_por_video)
+
+# =====================================================
+# ❤️ LIKES
+# =====================================================
+get_like = _asincrona(crud.get_like)
+toggle_like = _asincrona(crud.toggle_like)
+create_like = _asincrona(crud.create_like)
+delete_like = _asincrona(crud.delete_like)
+actualizar_estado_like = _asincrona(crud.actualizar_estado_like)
+get_total_likes = _asincrona(crud.get_total_likes)
+get_ids_con_like = _asincrona(crud.get_ids_con_like)
+get_estado_likes = _asincrona(crud.get_estado_likes)
+
+# =====================================================
+# 👀 INTERACCIONES
+# =====================================================
+get_interaccion_por_video = _asincrona(crud.get_interaccion_por_video)
+crear_interaccion = _asincrona(crud.crear_interaccion)
+registrar_vista = _asincrona(crud.registrar_vista)
+registrar_progreso = _asincrona(crud.registrar_progreso)
+aplicar_incrementos_interaccion = _asincrona(crud.aplicar_incrementos_interaccion)
+
+# =====================================================
+# ⚙️ TRABAJOS DE PROCESAMIENTO
+# =====================================================
+get_trabajos_por_video = _asincrona(crud.get_trabajos_por_video)
+
+# =====================================================
+# 📰 FEED
+# =====================================================
+get_feed_videos = _asincrona(crud.get_feed_videos)
+get_feed_por_ids = _asincrona(crud.get_feed_por_ids)
+get_feed_aleatorio = _asincrona(crud.get_feed_aleatorio)
+get_feed_usuario = _asincrona(crud.get_feed_usuario)
+
+# =====================================================
+# 🔎 BÚSQUEDA
+# =====================================================
+buscar_videos = _asincrona(crud.buscar_videos)
+
+# =====================================================
+# 🧭 VIDEOS SIMILARES
+# =====================================================
+get_similares = _asincrona(crud.get_similares)
+
+# =====================================================
+# 📈 ANALÍTICAS AGREGADAS
+# =====================================================
+get_retencion = _asincrona(crud.get_retencion)
+get_metricas_horarias = _asincrona(crud.get_metricas_horarias)
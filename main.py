@@ -1,38 +1,263 @@
-# ===================================================== # 🚀 MAIN.PY # ===================================================== # Archivo principal de la API con FastAPI. # Implementa los endpoints para: # - Usuarios (registro, login) # - Videos (subida, eliminación, listado) # - Likes (gestión de "me gusta") # - Interacciones (vistas, progreso) # - Etiquetas (asociación a videos) # Incluye manejo de archivos multimedia, paginación, # y cálculo automático de duración de video. # =====================================================
+# ===================================================== # 🚀 MAIN.PY # ===================================================== # Archivo principal de la API con FastAPI. # Implementa los endpoints para: # - Usuarios (registro, login) # - Videos (subida, eliminación, listado) # - Likes (gestión de "me gusta") # - Interacciones (vistas, progreso) # - Etiquetas (asociación a videos) # Incluye manejo de archivos multimedia, paginación, # y procesamiento de video en segundo plano. # =====================================================
 from fastapi import (
-    FastAPI, Depends, HTTPException, UploadFile, File, Form, Query,
+    FastAPI, Depends, HTTPException, Form, Query, Request,
 )
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from pymediainfo import MediaInfo
-from datetime import timedelta
+from datetime import datetime, timedelta
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import json
 import os
 import random
+import time
+from urllib.parse import quote
 from uuid import UUID
 
 # Importaciones locales
-import models, schemas, crud
-from database import SessionLocal, engine
+import models, schemas, crud, crud_async, almacenamiento, medios, metricas
+from database import SessionLocal, AsyncSessionLocal, SesionLectura, engine, async_engine, replica_engines
+import database
+from tareas import TareaPeriodica
+from buffer_interacciones import BufferInteracciones, agrupar_eventos, descartar_duplicados
+from procesamiento import ColaMedia
+from cache import CacheFeed, crear_cache
+from tendencias import MotorTendencias
+from analiticas import AgregadorAnaliticas, curva_retencion
+import recomendaciones
 
 # ===================================================== # ⚙️ CONFIGURACIÓN INICIAL # =====================================================
 # Crear las tablas en caso de que no existan
 models.Base.metadata.create_all(bind=engine)
 
+# Llevar las tablas existentes al esquema actual, pasar las etiquetas de la
+# tabla anterior (texto libre por video) al catálogo e indexar para la
+# búsqueda los videos que aún no lo estén
+with SessionLocal() as db_migracion:
+    crud.migrar_esquema(db_migracion)
+    crud.migrar_etiquetas_legadas(db_migracion)
+    crud.indexar_busqueda_pendiente(db_migracion)
+
+# Cada cuántos segundos se reparan los contadores de likes (0 = deshabilitado)
+RECONCILIACION_LIKES_SEGUNDOS = float(os.getenv("RECONCILIACION_LIKES_SEGUNDOS", "3600"))
+
+# Buffer de vistas/progreso: intervalo de persistencia (0 = escritura directa)
+# y retraso máximo de un evento en memoria antes de forzar la persistencia
+INTERACCIONES_FLUSH_SEGUNDOS = float(os.getenv("INTERACCIONES_FLUSH_SEGUNDOS", "5"))
+INTERACCIONES_RETRASO_MAXIMO_SEGUNDOS = float(os.getenv("INTERACCIONES_RETRASO_MAXIMO_SEGUNDOS", "2"))
+
+# Videos cuyos totales persistidos recuerda el buffer para estimar las respuestas
+INTERACCIONES_MAX_VIDEOS = int(os.getenv("INTERACCIONES_MAX_VIDEOS", "10000"))
+
+# Eventos máximos aceptados en un lote de `POST /interacciones`
+INTERACCIONES_LOTE_MAX = int(os.getenv("INTERACCIONES_LOTE_MAX", "1000"))
+
+# Tamaño máximo de un video subido, en MB (0 = sin límite)
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "500"))
+
+# Bytes que se toleran en Content-Length por encima de MAX_UPLOAD_MB
+# para los campos de texto y las cabeceras del formulario
+MARGEN_FORMULARIO_BYTES = 256 * 1024
+
+# Horas sin actividad tras las que se descarta una subida reanudable
+SUBIDAS_MAX_HORAS = float(os.getenv("SUBIDAS_MAX_HORAS", "24"))
+
+# Procesamiento de medios: hilos trabajadores (0 = no procesar en este
+# proceso) y reintentos máximos por trabajo
+MEDIA_TRABAJADORES = int(os.getenv("MEDIA_TRABAJADORES", "2"))
+MEDIA_MAX_INTENTOS = int(os.getenv("MEDIA_MAX_INTENTOS", "3"))
+
+# Transcodificaciones HLS simultáneas por proceso (0 = no generar HLS)
+MEDIA_HLS_SIMULTANEOS = int(os.getenv("MEDIA_HLS_SIMULTANEOS", "1"))
+
+# Caché del feed: "memoria" (LRU por proceso) o una URL redis:// compartida
+# entre procesos. Con la caché en memoria y varios procesos, la invalidación
+# sólo llega al proceso que hizo el cambio; el TTL acota lo que tardan los demás
+CACHE_URL = os.getenv("CACHE_URL", "memoria")
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "10000"))
+# Páginas del feed (por número) que se guardan en caché; las cursorizadas
+# siempre se guardan (0 = no usar caché)
+FEED_CACHE_PAGINAS = int(os.getenv("FEED_CACHE_PAGINAS", "5"))
+FEED_CACHE_TTL_PAGINA = float(os.getenv("FEED_CACHE_TTL_PAGINA", "30"))
+FEED_CACHE_TTL_TARJETA = float(os.getenv("FEED_CACHE_TTL_TARJETA", "120"))
+
+# Feed personalizado: minutos de validez de cada generación y días sin
+# uso tras los que se borra el feed precalculado de un usuario
+FEED_PERSONAL_TTL_MINUTOS = float(os.getenv("FEED_PERSONAL_TTL_MINUTOS", "10"))
+FEED_PERSONAL_MAX_DIAS = float(os.getenv("FEED_PERSONAL_MAX_DIAS", "7"))
+
+# Tendencias: vida media de cada evento en horas, tamaño del top servido
+# e intervalo de persistencia en segundos (0 = deshabilitado)
+TENDENCIAS_VIDA_MEDIA_HORAS = float(os.getenv("TENDENCIAS_VIDA_MEDIA_HORAS", "12"))
+TENDENCIAS_TOP = int(os.getenv("TENDENCIAS_TOP", "100"))
+TENDENCIAS_PERSISTIR_SEGUNDOS = float(os.getenv("TENDENCIAS_PERSISTIR_SEGUNDOS", "30"))
+
+# Videos similares: intervalo de recálculo en segundos (0 = deshabilitado),
+# vecinos guardados por video, videos por bloque del producto de matrices
+# (acota la memoria) y likes a partir de los que se ignora a un usuario
+SIMILARES_SEGUNDOS = float(os.getenv("SIMILARES_SEGUNDOS", "3600"))
+SIMILARES_TOP = int(os.getenv("SIMILARES_TOP", "20"))
+SIMILARES_FILAS_POR_LOTE = int(os.getenv("SIMILARES_FILAS_POR_LOTE", "1000"))
+SIMILARES_MAX_LIKES_USUARIO = int(os.getenv("SIMILARES_MAX_LIKES_USUARIO", "5000"))
+
+# Analíticas agregadas: intervalo de persistencia en segundos
+# (0 = deshabilitado) y días que se conservan las métricas por hora
+ANALITICAS_PERSISTIR_SEGUNDOS = float(os.getenv("ANALITICAS_PERSISTIR_SEGUNDOS", "10"))
+ANALITICAS_MAX_DIAS = float(os.getenv("ANALITICAS_MAX_DIAS", "90"))
+
+# Métricas de rendimiento en `/metrics` (0 = deshabilitadas) y umbral en ms
+# a partir del cual una petición se registra en el log con sus consultas
+# (0 = sin log de peticiones lentas)
+METRICAS_ACTIVAS = os.getenv("METRICAS_ACTIVAS", "1") == "1"
+METRICAS_PETICION_LENTA_MS = float(os.getenv("METRICAS_PETICION_LENTA_MS", "0"))
+
+# ===================================================== # ⏰ TAREAS EN SEGUNDO PLANO # =====================================================
+def reconciliar_likes():
+    """
+    Repara los contadores `Interaccion.total_likes` a partir de la tabla
+    likes y los `total_videos` del catálogo de etiquetas.
+    """
+    db = SessionLocal()
+    try:
+        crud.reconciliar_total_likes(db)
+        crud.reconciliar_total_etiquetas(db)
+    finally:
+        db.close()
+
+BUFFER_INTERACCIONES = BufferInteracciones(
+    SessionLocal, INTERACCIONES_FLUSH_SEGUNDOS, INTERACCIONES_RETRASO_MAXIMO_SEGUNDOS,
+    INTERACCIONES_MAX_VIDEOS,
+)
+
+def purgar_feeds():
+    """Borra los feeds personalizados de usuarios inactivos."""
+    db = SessionLocal()
+    try:
+        crud.purgar_feeds_usuario(db, timedelta(days=FEED_PERSONAL_MAX_DIAS))
+    finally:
+        db.close()
+
+def purgar_metricas():
+    """Borra las métricas por hora más antiguas que ANALITICAS_MAX_DIAS."""
+    db = SessionLocal()
+    try:
+        crud.purgar_metricas_horarias(db, timedelta(days=ANALITICAS_MAX_DIAS))
+    finally:
+        db.close()
+
+def calcular_similares():
+    """Recalcula los videos similares a partir de la matriz de likes."""
+    recomendaciones.calcular_similares(
+        SessionLocal, SIMILARES_TOP, SIMILARES_FILAS_POR_LOTE, SIMILARES_MAX_LIKES_USUARIO
+    )
+
+def limpiar_subidas():
+    """Elimina las subidas reanudables abandonadas y los temporales de subida huérfanos."""
+    almacenamiento.limpiar_subidas_abandonadas(SUBIDAS_DIR, SUBIDAS_MAX_HORAS * 3600)
+    almacenamiento.limpiar_temporales(OBJETOS_DIR, SUBIDAS_MAX_HORAS * 3600)
+
+COLA_MEDIA = ColaMedia(
+    SessionLocal, os.path.dirname(os.path.abspath(__file__)), MEDIA_TRABAJADORES, MEDIA_MAX_INTENTOS,
+    limites={"hls": MEDIA_HLS_SIMULTANEOS},
+    posteriores={
+        "contenido": ["analizar"],
+        "analizar": ["miniaturas", "hls"] if MEDIA_HLS_SIMULTANEOS > 0 else ["miniaturas"],
+    },
+)
+
+CACHE_FEED = CacheFeed(
+    crear_cache(CACHE_URL, FEED_CACHE_TTL_TARJETA, CACHE_MAX_ENTRADAS),
+    FEED_CACHE_TTL_PAGINA, FEED_CACHE_TTL_TARJETA,
+)
+crud.suscribir(CACHE_FEED.invalidar)
+
+TENDENCIAS = MotorTendencias(
+    SessionLocal, TENDENCIAS_VIDA_MEDIA_HORAS, TENDENCIAS_TOP, TENDENCIAS_PERSISTIR_SEGUNDOS
+)
+crud.suscribir(TENDENCIAS.al_cambiar)
+
+ANALITICAS = AgregadorAnaliticas(SessionLocal, ANALITICAS_PERSISTIR_SEGUNDOS)
+crud.suscribir(ANALITICAS.al_cambiar)
+
+TAREAS = [
+    TareaPeriodica("reconciliar_likes", RECONCILIACION_LIKES_SEGUNDOS, reconciliar_likes),
+    TareaPeriodica("limpiar_subidas", 3600, limpiar_subidas),
+    TareaPeriodica("purgar_feeds", 3600, purgar_feeds),
+    TareaPeriodica("calcular_similares", SIMILARES_SEGUNDOS, calcular_similares),
+    TareaPeriodica("purgar_metricas", 3600, purgar_metricas),
+    BUFFER_INTERACCIONES,
+    COLA_MEDIA,
+    TENDENCIAS,
+    ANALITICAS,
+]
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    """Arranca las tareas en segundo plano y las detiene al apagar la API."""
+    for tarea in TAREAS:
+        tarea.iniciar()
+    yield
+    for tarea in TAREAS:
+        tarea.detener()
+    await async_engine.dispose()
+    for motor in replica_engines:
+        await motor.dispose()
+
 # Inicializar aplicación
-app = FastAPI(title="API Plataforma de Videos", version="3.0")
+app = FastAPI(title="API Plataforma de Videos", version="3.0", lifespan=ciclo_de_vida)
+
+# Latencia, consultas y filas por ruta (ver `metricas.py`)
+if METRICAS_ACTIVAS:
+    app.add_middleware(metricas.MiddlewareMetricas, lenta_segundos=METRICAS_PETICION_LENTA_MS / 1000)
+    for motor in database.motores().values():
+        metricas.instrumentar_motor(motor)
 
 # Configuración de directorios estáticos
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/media", StaticFiles(directory="media"), name="media")
 
-# Directorio donde se almacenan los videos
+# Directorio donde se almacenan los videos (servido por `/media/...`)
 VIDEO_DIR = os.path.join(os.path.dirname(__file__), "media")
 os.makedirs(VIDEO_DIR, exist_ok=True)
 
+# Directorio de trabajo de las subidas reanudables
+SUBIDAS_DIR = os.path.join(VIDEO_DIR, ".subidas")
+os.makedirs(SUBIDAS_DIR, exist_ok=True)
+
+# Originales guardados por contenido (nombre = SHA-256) y sus derivados
+OBJETOS_DIR = os.path.join(VIDEO_DIR, "objetos")
+os.makedirs(OBJETOS_DIR, exist_ok=True)
+
+# Originales de subidas reanudables completadas cuyo SHA-256 aún se está
+# calculando en segundo plano (trabajo "contenido"); oculta para /media
+PENDIENTES_DIR = os.path.join(OBJETOS_DIR, ".pendientes")
+os.makedirs(PENDIENTES_DIR, exist_ok=True)
+
 # ===================================================== # 📦 DEPENDENCIA DE BASE DE DATOS # =====================================================
-def get_db():
-    """Crea una sesión temporal a la base de datos."""
+async def get_db():
+    """
+    Crea una sesión asíncrona temporal a la base de datos. Los endpoints
+    `async def` consultan con ella sin bloquear el bucle de eventos.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_db_lectura():
+    """
+    Sesión asíncrona sobre una réplica de lectura (o el primario si no
+    hay réplicas), para el feed y los listados que toleran un leve atraso.
+    """
+    async with SesionLectura() as db:
+        yield db
+
+def get_db_sync():
+    """
+    Crea una sesión síncrona temporal, para los endpoints que además hacen
+    E/S de disco pesada (subidas, eliminación) y se ejecutan en el threadpool.
+    """
     db = SessionLocal()
     try:
         yield db
@@ -40,17 +265,147 @@ def get_db():
         db.close()
 
 # ===================================================== # ⏱️ FUNCIONES AUXILIARES # =====================================================
-def get_video_duration(path: str) -> str:
+def registrar_video_subido(
+    db: Session, guardado: almacenamiento.ArchivoGuardado, nombre_archivo: str,
+    titulo: str, descripcion: str, id_usuario: int, etiqueta: str
+) -> dict:
     """
-    Obtiene la duración de un archivo de video utilizando pymediainfo.
-    Retorna la duración en formato HH:MM:SS.
+    Publica en OBJETOS_DIR el temporal ya hasheado, registra el video
+    (junto con su etiqueta) y encola su análisis: la duración y demás
+    metadatos se completan en segundo plano y después se generan el
+    póster, las miniaturas y la versión HLS, a la que pasa a apuntar
+    `ruta`. Si el contenido ya existía no se guarda otra copia y los
+    trabajos reutilizan los resultados del original.
+    Común a la subida directa y a la subida reanudable.
     """
-    info = MediaInfo.parse(path)
-    for track in info.tracks:
-        if track.track_type == "Video" and track.duration:
-            duracion_seg = track.duration / 1000
-            return str(timedelta(seconds=int(duracion_seg)))
-    return "00:00:00"
+    nombre = almacenamiento.nombre_objeto(guardado.sha256, nombre_archivo)
+    try:
+        # La fila del objeto queda bloqueada hasta el commit de crear_video
+        objeto = crud.sumar_referencia_objeto(db, guardado.sha256, f"media/objetos/{nombre}", guardado.tamano)
+        nuevo = almacenamiento.publicar_objeto(
+            guardado.ruta, os.path.join(OBJETOS_DIR, os.path.basename(objeto.ruta))
+        )
+        nuevo_video = models.Video(
+            titulo=titulo,
+            descripcion=descripcion,
+            duracion=timedelta(0),
+            id_usuario=id_usuario,
+            ruta=objeto.ruta,
+            ruta_original=objeto.ruta,
+            sha256=guardado.sha256,
+            estado="procesando",
+        )
+        crud.crear_video(db, nuevo_video)
+    except BaseException:
+        db.rollback()
+        if os.path.exists(guardado.ruta):
+            os.unlink(guardado.ruta)
+        raise
+    if crud.normalizar_etiqueta(etiqueta or ""):
+        crud.crear_etiqueta(db, etiqueta, nuevo_video.id_video)
+    COLA_MEDIA.encolar(db, nuevo_video.id_video, "analizar")
+    return {
+        "message": "Video subido correctamente",
+        "id_video": str(nuevo_video.id_video),
+        "ruta": nuevo_video.ruta,
+        "estado": nuevo_video.estado,
+        "sha256": guardado.sha256,
+        "duplicado": not nuevo,
+    }
+
+def registrar_video_pendiente(
+    db: Session, nombre_archivo: str, titulo: str, descripcion: str, id_usuario: int, etiqueta: str
+) -> dict:
+    """
+    Registra el video de una subida reanudable cuyo original ya está en
+    PENDIENTES_DIR (`nombre_archivo`) y encola el trabajo "contenido", que
+    calcula su SHA-256 y lo pasa al almacenamiento por contenido antes del
+    análisis. Mientras tanto el video queda "procesando" y sin hash.
+    """
+    ruta = f"media/objetos/.pendientes/{nombre_archivo}"
+    nuevo_video = models.Video(
+        titulo=titulo,
+        descripcion=descripcion,
+        duracion=timedelta(0),
+        id_usuario=id_usuario,
+        ruta=ruta,
+        ruta_original=ruta,
+        estado="procesando",
+    )
+    try:
+        crud.crear_video(db, nuevo_video)
+    except BaseException:
+        db.rollback()
+        os.unlink(os.path.join(PENDIENTES_DIR, nombre_archivo))
+        raise
+    if crud.normalizar_etiqueta(etiqueta or ""):
+        crud.crear_etiqueta(db, etiqueta, nuevo_video.id_video)
+    COLA_MEDIA.encolar(db, nuevo_video.id_video, "contenido")
+    return {
+        "message": "Video subido correctamente",
+        "id_video": str(nuevo_video.id_video),
+        "ruta": nuevo_video.ruta,
+        "estado": nuevo_video.estado,
+        "sha256": None,
+        "duplicado": False,
+    }
+
+def liberar_objeto(objeto: models.ObjetoMedia):
+    """Borra del disco un objeto sin referencias y sus derivados."""
+    ruta_archivo = os.path.join(OBJETOS_DIR, os.path.basename(objeto.ruta))
+    almacenamiento.eliminar_objeto(ruta_archivo, os.path.join(OBJETOS_DIR, objeto.sha256))
+
+def serializar_video_feed(fila) -> dict:
+    """
+    Convierte una fila hidratada del feed (ver `crud._consulta_feed`)
+    al formato de `schemas.VideoResponse`.
+    """
+    v = fila.Video
+    return {
+        "id_video": str(v.id_video),
+        "titulo": v.titulo,
+        "descripcion": v.descripcion,
+        "ruta": v.ruta,
+        "usuario": fila.usuario,
+        "etiqueta": fila.etiqueta,
+        "likes": fila.likes or 0,
+        "liked": bool(fila.liked),
+        "fecha_subida": v.fecha_subida,
+        "duracion": str(v.duracion),
+        "poster": v.poster,
+        "miniaturas_vtt": v.miniaturas_vtt,
+    }
+
+async def tarjetas_feed(db: AsyncSession, ids: list) -> list:
+    """
+    Tarjetas de los videos `ids` en ese orden: las que faltan en caché se
+    hidratan con una sola consulta y se guardan. Los videos que ya no
+    existen se omiten.
+    Lo que se guarda en caché se lee siempre del primario: justo después
+    de una invalidación, una réplica atrasada volvería a guardar la
+    tarjeta vieja durante todo su TTL. `db` no se usa para hidratar.
+    """
+    tarjetas = await CACHE_FEED.get_tarjetas(ids)
+    faltantes = [UUID(i) for i in ids if i not in tarjetas]
+    if faltantes:
+        async with AsyncSessionLocal() as primario:
+            filas = await crud_async.get_feed_por_ids(primario, faltantes)
+        nuevas = [serializar_video_feed(fila) for fila in filas]
+        await CACHE_FEED.set_tarjetas(nuevas)
+        tarjetas.update((tarjeta["id_video"], tarjeta) for tarjeta in nuevas)
+    return [tarjetas[i] for i in ids if i in tarjetas]
+
+async def superponer_liked(db: AsyncSession, tarjetas: list, id_usuario: Optional[int]) -> list:
+    """
+    Copia las tarjetas (compartidas entre usuarios) marcando `liked` según
+    los likes activos de `id_usuario`; sin usuario, `liked` es False.
+    """
+    con_like = set()
+    if id_usuario is not None and tarjetas:
+        con_like = {str(i) for i in await crud_async.get_ids_con_like(
+            db, id_usuario, [UUID(tarjeta["id_video"]) for tarjeta in tarjetas]
+        )}
+    return [dict(tarjeta, liked=tarjeta["id_video"] in con_like) for tarjeta in tarjetas]
 
 # ===================================================== # 🌐 RUTA PRINCIPAL # =====================================================
 @app.get("/")
@@ -58,31 +413,70 @@ def root():
     """Sirve la página principal de la aplicación."""
     return FileResponse(os.path.join("static", "index.html"))
 
+# ===================================================== # 📡 ARCHIVOS MULTIMEDIA # =====================================================
+@app.api_route("/media/{ruta:path}", methods=["GET", "HEAD"])
+def servir_media(ruta: str, request: Request):
+    """
+    Sirve un archivo de VIDEO_DIR con soporte de Range (incluido
+    multi-rango), ETag y peticiones condicionales, para que adelantar en
+    el video no vuelva a descargarlo desde el byte 0. Los archivos
+    nombrados por su SHA-256 se marcan como inmutables en caché.
+    """
+    ruta_archivo = medios.resolver_ruta(VIDEO_DIR, ruta)
+    if ruta_archivo is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return medios.RespuestaArchivo(
+        ruta_archivo,
+        request.headers,
+        metodo=request.method,
+        inmutable=medios.es_direccionado_por_contenido(ruta),
+    )
+
+# ===================================================== # 🩺 ESTADO DE LA BASE DE DATOS # =====================================================
+@app.get("/health/db")
+def estado_base_datos():
+    """Ocupación de los pools de conexiones (primario y réplicas)."""
+    return {"pools": database.estado_pools()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def exponer_metricas():
+    """
+    Métricas de este proceso en el formato de texto de Prometheus:
+    latencia por ruta, consultas, tiempo y filas de base de datos,
+    subidas, trabajos de medios y ocupación de los pools.
+    """
+    if not METRICAS_ACTIVAS:
+        raise HTTPException(status_code=404, detail="Métricas deshabilitadas")
+    return PlainTextResponse(
+        metricas.exponer(metricas.texto_pools(database.estado_pools())),
+        media_type="text/plain; version=0.0.4",
+    )
+
 # ===================================================== # 👤 USUARIOS # =====================================================
 @app.post("/usuarios", response_model=schemas.UsuarioResponse)
-def crear_usuario(usuario: schemas.UsuarioCreate, db: Session = Depends(get_db)):
+async def crear_usuario(usuario: schemas.UsuarioCreate, db: AsyncSession = Depends(get_db)):
     """
     Registra un nuevo usuario si el correo no está en uso.
     """
-    existente = crud.get_usuario_by_correo(db, usuario.correo)
+    existente = await crud_async.get_usuario_by_correo(db, usuario.correo)
     if existente:
         raise HTTPException(status_code=400, detail="Correo ya registrado")
-    nuevo = crud.crear_usuario(db, usuario.nombre, usuario.correo, usuario.contrasena)
+    nuevo = await crud_async.crear_usuario(db, usuario.nombre, usuario.correo, usuario.contrasena)
     return schemas.UsuarioResponse.from_orm(nuevo)
 
 @app.get("/usuarios", response_model=list[schemas.UsuarioResponse])
-def listar_usuarios(db: Session = Depends(get_db)):
+async def listar_usuarios(db: AsyncSession = Depends(get_db_lectura)):
     """Lista todos los usuarios registrados en la base de datos."""
-    return crud.listar_usuarios(db)
+    return await crud_async.listar_usuarios(db)
 
 # ===================================================== # 🔐 LOGIN # =====================================================
 @app.post("/login", response_model=schemas.LoginResponse)
-def login(request: schemas.LoginRequest, db: Session = Depends(get_db)):
+async def login(request: schemas.LoginRequest, db: AsyncSession = Depends(get_db)):
     """
     Valida las credenciales de acceso del usuario.
     Retorna su información básica en caso de éxito.
     """
-    usuario = crud.get_usuario_by_correo(db, request.correo)
+    usuario = await crud_async.get_usuario_by_correo(db, request.correo)
     if not usuario:
         raise HTTPException(status_code=401, detail="Correo no registrado")
     if usuario.contrasena != request.contrasena:
@@ -95,78 +489,327 @@ def login(request: schemas.LoginRequest, db: Session = Depends(get_db)):
 
 # ===================================================== # 🎥 VIDEOS # =====================================================
 @app.post("/upload_video")
-def upload_video(
-    titulo: str = Form(...),
-    descripcion: str = Form(""),
-    id_usuario: int = Form(...),
-    etiqueta: str = Form(""),
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-):
+async def upload_video(request: Request, db: Session = Depends(get_db_sync)):
     """
-    Sube un nuevo video, obtiene su duración automáticamente
-    y registra la información en la base de datos.
+    Sube un nuevo video y lo registra en la base de datos. Recibe un
+    formulario multipart con `titulo`, `descripcion`, `id_usuario`,
+    `etiqueta` y el archivo en `file`.
+    Responde de inmediato con el video en estado "procesando": la duración
+    y los metadatos se obtienen en segundo plano
+    (ver `/videos/{id_video}/procesamiento`).
     """
-    usuario = crud.get_usuario_by_id(db, id_usuario)
-    if not usuario:
+    max_bytes = int(MAX_UPLOAD_MB * 1024 * 1024)
+    longitud = request.headers.get("content-length", "")
+    # Un cuerpo declarado mayor que el límite (más el margen de los campos)
+    # se rechaza antes de leerlo
+    if max_bytes and longitud.isdigit() and int(longitud) > max_bytes + MARGEN_FORMULARIO_BYTES:
+        raise HTTPException(status_code=413, detail=f"El video supera el máximo de {MAX_UPLOAD_MB:g} MB")
+    try:
+        formulario = almacenamiento.FormularioSubida(
+            request.headers.get("content-type", ""), OBJETOS_DIR, "file", max_bytes
+        )
+    except almacenamiento.FormularioInvalido as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # El cuerpo se analiza y escribe a medida que llega, por bloques: el
+    # video nunca se carga completo en memoria ni pasa por un temporal
+    # intermedio, y el límite de tamaño corta la subida en cuanto se supera
+    inicio = time.perf_counter()
+    pendiente = bytearray()
+    try:
+        async for datos in request.stream():
+            pendiente += datos
+            if len(pendiente) >= almacenamiento.TAMANO_BLOQUE:
+                await run_in_threadpool(formulario.alimentar, bytes(pendiente))
+                pendiente.clear()
+        await run_in_threadpool(formulario.alimentar, bytes(pendiente))
+        guardado = await run_in_threadpool(formulario.terminar)
+    except almacenamiento.ArchivoDemasiadoGrande:
+        formulario.descartar()
+        raise HTTPException(status_code=413, detail=f"El video supera el máximo de {MAX_UPLOAD_MB:g} MB")
+    except almacenamiento.FormularioInvalido as exc:
+        formulario.descartar()
+        raise HTTPException(status_code=400, detail=str(exc))
+    except BaseException:
+        formulario.descartar()
+        raise
+    metricas.registrar_subida("directa", guardado.tamano, time.perf_counter() - inicio)
+    try:
+        datos = schemas.VideoSubida.model_validate(formulario.campos)
+    except ValidationError as error:
+        os.unlink(guardado.ruta)
+        raise HTTPException(status_code=422, detail=error.errors(include_url=False))
+    if not await run_in_threadpool(crud.get_usuario_by_id, db, datos.id_usuario):
+        os.unlink(guardado.ruta)
         raise HTTPException(status_code=401, detail="Usuario no válido")
-    filename = file.filename
-    save_path = os.path.join(VIDEO_DIR, filename)
-    with open(save_path, "wb") as buffer:
-        buffer.write(file.file.read())
-    duracion = get_video_duration(save_path)
-    ruta = f"media/{filename}"
-    nuevo_video = models.Video(
-        titulo=titulo,
-        descripcion=descripcion,
-        duracion=duracion,
-        id_usuario=id_usuario,
-        ruta=ruta,
+    return await run_in_threadpool(
+        registrar_video_subido, db, guardado, formulario.nombre_archivo,
+        datos.titulo, datos.descripcion, datos.id_usuario, datos.etiqueta
+    )
+
+# ===================================================== # 🧩 SUBIDAS REANUDABLES # =====================================================
+@app.post("/uploads", response_model=schemas.SubidaEstado)
+async def iniciar_subida(subida: schemas.SubidaCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Inicia una subida reanudable. El cliente envía después cada parte
+    (en cualquier orden y en paralelo) y finalmente la completa.
+    """
+    if not await crud_async.get_usuario_by_id(db, subida.id_usuario):
+        raise HTTPException(status_code=401, detail="Usuario no válido")
+    if MAX_UPLOAD_MB and subida.tamano_total > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"El video supera el máximo de {MAX_UPLOAD_MB:g} MB")
+    try:
+        nombre_archivo = almacenamiento.nombre_seguro(subida.nombre_archivo)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Nombre de archivo inválido")
+    metadatos = subida.dict(exclude={"tamano_total", "tamano_parte"})
+    metadatos["nombre_archivo"] = nombre_archivo
+    return await run_in_threadpool(
+        almacenamiento.iniciar_subida, SUBIDAS_DIR, metadatos, subida.tamano_total, subida.tamano_parte
+    )
+
+@app.get("/uploads/{id_subida}", response_model=schemas.SubidaEstado)
+def estado_subida(id_subida: UUID):
+    """Devuelve qué partes de la subida ya se recibieron, para reanudarla."""
+    try:
+        return almacenamiento.estado_subida(SUBIDAS_DIR, id_subida.hex)
+    except almacenamiento.SubidaNoEncontrada:
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+
+@app.put("/uploads/{id_subida}/chunks/{indice}")
+async def subir_parte(id_subida: UUID, indice: int, request: Request):
+    """
+    Recibe una parte de la subida (cuerpo binario) y la escribe en su
+    posición del archivo final. Reenviar una parte la sobrescribe.
+    """
+    try:
+        escritura = await run_in_threadpool(
+            almacenamiento.EscrituraParte, SUBIDAS_DIR, id_subida.hex, indice
+        )
+    except almacenamiento.SubidaNoEncontrada:
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    inicio, recibidos = time.perf_counter(), 0
+    # Los trozos del cuerpo se juntan en bloques antes de pasar al threadpool
+    pendiente = bytearray()
+    try:
+        async for datos in request.stream():
+            recibidos += len(datos)
+            pendiente += datos
+            if len(pendiente) >= almacenamiento.TAMANO_BLOQUE:
+                await run_in_threadpool(escritura.escribir, bytes(pendiente))
+                pendiente.clear()
+        await run_in_threadpool(escritura.escribir, bytes(pendiente))
+        await run_in_threadpool(escritura.confirmar)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        escritura.cerrar()
+    metricas.registrar_subida("parte", recibidos, time.perf_counter() - inicio)
+    return {"id_subida": id_subida.hex, "indice": indice, "recibida": True}
+
+@app.post("/uploads/{id_subida}/complete")
+def completar_subida(id_subida: UUID, db: Session = Depends(get_db_sync)):
+    """
+    Cierra una subida con todas sus partes: mueve el archivo ensamblado a
+    PENDIENTES_DIR sin volver a leerlo y registra el video. Las partes
+    llegan en cualquier orden, así que el SHA-256 no se conoce todavía:
+    lo calcula en segundo plano el trabajo "contenido" (ver
+    `registrar_video_pendiente`). Responde 409 si faltan partes o si
+    alguna se está escribiendo todavía.
+    """
+    try:
+        estado = almacenamiento.estado_subida(SUBIDAS_DIR, id_subida.hex)
+        nombre = almacenamiento.nombre_objeto(id_subida.hex, estado["nombre_archivo"])
+        almacenamiento.completar_subida(SUBIDAS_DIR, id_subida.hex, os.path.join(PENDIENTES_DIR, nombre))
+    except almacenamiento.SubidaNoEncontrada:
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    except almacenamiento.SubidaIncompleta:
+        raise HTTPException(status_code=409, detail="Faltan partes por recibir")
+    except almacenamiento.SubidaOcupada:
+        raise HTTPException(status_code=409, detail="Hay partes subiéndose todavía")
+    return registrar_video_pendiente(
+        db, nombre, estado["titulo"], estado["descripcion"], estado["id_usuario"], estado["etiqueta"]
     )
-    crud.crear_video(db, nuevo_video)
-    if etiqueta:
-        crud.crear_etiqueta(db, etiqueta, nuevo_video.id_video)
-    return {
-        "message": "Video subido correctamente",
-        "id_video": str(nuevo_video.id_video),
-        "ruta": ruta,
-        "duracion": duracion,
-    }
 
 @app.get("/videos", response_model=schemas.PaginacionVideos)
-def listar_videos(page: int = 1, db: Session = Depends(get_db)):
+async def listar_videos(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(3, ge=1, le=50),
+    cursor: Optional[str] = None,
+    id_usuario: Optional[int] = None,
+    etiqueta: Optional[str] = None,
+    db: AsyncSession = Depends(get_db_lectura),
+):
     """
     Devuelve una lista paginada de videos, mostrando su autor,
     etiqueta, likes y duración.
+    Acepta `page` (de `page_size` videos) o, para el feed infinito, el
+    `cursor` opaco devuelto en `next_cursor` por la página anterior.
+    Con `etiqueta` sólo se listan los videos con esa etiqueta.
+    Las primeras páginas y las cursorizadas se sirven desde caché;
+    con `id_usuario` se marca `liked` en cada video.
+    Las páginas que se van a guardar en caché se leen del primario (una
+    réplica atrasada llenaría la nueva versión con filas viejas); el
+    resto, de una réplica, con el atraso que ésta tenga.
     """
-    limit = 3
+    limit = page_size
     skip = (page - 1) * limit
-    videos = crud.get_videos(db, skip=skip, limit=limit)
-    total = crud.contar_videos(db)
-    has_more = skip + limit < total
-    result = []
-    for v in videos:
-        usuario = crud.get_usuario_by_id(db, v.id_usuario)
-        etiqueta = crud.get_etiqueta_por_video(db, v.id_video)
-        total_likes = crud.get_total_likes(db, v.id_video)
-        result.append(
-            {
-                "id_video": str(v.id_video),
-                "titulo": v.titulo,
-                "descripcion": v.descripcion,
-                "ruta": v.ruta,
-                "usuario": usuario.nombre if usuario else "Desconocido",
-                "etiqueta": etiqueta.nombre if etiqueta else "",
-                "likes": total_likes or 0,
-                "liked": False,
-                "fecha_subida": v.fecha_subida,
-                "duracion": str(v.duracion),
-            }
+    clave = None
+    if FEED_CACHE_PAGINAS > 0 and (cursor is not None or page <= FEED_CACHE_PAGINAS):
+        posicion = f"c:{cursor}" if cursor is not None else f"p:{page}"
+        if etiqueta is not None:
+            posicion = f"e:{quote(crud.normalizar_etiqueta(etiqueta), safe='')}:{posicion}"
+        clave = await CACHE_FEED.clave_pagina(posicion, limit)
+    pagina = await CACHE_FEED.get_pagina(clave) if clave else None
+    if pagina is not None:
+        has_more, next_cursor = pagina["has_more"], pagina["next_cursor"]
+        tarjetas = await tarjetas_feed(db, pagina["ids"])
+    else:
+        try:
+            if clave:
+                async with AsyncSessionLocal() as primario:
+                    filas, has_more, next_cursor = await crud_async.get_feed_videos(
+                        primario, limit=limit, skip=skip, cursor=cursor, etiqueta=etiqueta
+                    )
+            else:
+                filas, has_more, next_cursor = await crud_async.get_feed_videos(
+                    db, limit=limit, skip=skip, cursor=cursor, etiqueta=etiqueta
+                )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        tarjetas = [serializar_video_feed(fila) for fila in filas]
+        await CACHE_FEED.set_tarjetas(tarjetas)
+        if clave:
+            await CACHE_FEED.set_pagina(clave, [t["id_video"] for t in tarjetas], has_more, next_cursor)
+    result = await superponer_liked(db, tarjetas, id_usuario)
+    return {"page": page, "videos": result, "has_more": has_more, "next_cursor": next_cursor}
+
+@app.get("/feed_videos/{id_usuario}", response_model=schemas.PaginacionFeedPersonal)
+async def feed_personal(
+    id_usuario: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Devuelve el feed personalizado del usuario, precalculado y guardado
+    por `crud.regenerar_feed_usuario` (ranking por popularidad, frescura
+    y afinidad con las etiquetas que le gustan). Cada página es un rango
+    de la lista guardada; se continúa con el `next_cursor` devuelto.
+    Si el feed se regeneró mientras se recorría, el cursor deja de valer
+    (410) y hay que volver a pedir la primera página.
+    """
+    try:
+        pagina = await crud_async.get_feed_usuario(
+            db, id_usuario, limit, cursor, timedelta(minutes=FEED_PERSONAL_TTL_MINUTOS)
         )
-    return {"page": page, "videos": result, "has_more": has_more}
+    except crud.CursorCaducado:
+        raise HTTPException(status_code=410, detail="El feed cambió; vuelve a cargar desde el inicio")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if pagina is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    ids, has_more, next_cursor = pagina
+    tarjetas = await tarjetas_feed(db, [str(i) for i in ids])
+    videos = await superponer_liked(db, tarjetas, id_usuario)
+    return {"videos": videos, "has_more": has_more, "next_cursor": next_cursor}
+
+@app.get("/videos/buscar", response_model=schemas.PaginacionBusqueda)
+async def buscar_videos(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    id_usuario: Optional[int] = None,
+    db: AsyncSession = Depends(get_db_lectura),
+):
+    """
+    Busca videos por título y descripción, ordenados por relevancia.
+    Para la página siguiente se envía el `next_cursor` recibido.
+    """
+    try:
+        ids, has_more, next_cursor = await crud_async.buscar_videos(db, q, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    tarjetas = await tarjetas_feed(db, [str(i) for i in ids])
+    videos = await superponer_liked(db, tarjetas, id_usuario)
+    return {"videos": videos, "has_more": has_more, "next_cursor": next_cursor}
+
+@app.get("/videos/trending", response_model=schemas.ListaTendencias)
+async def videos_tendencia(
+    limit: int = Query(20, ge=1, le=100),
+    id_usuario: Optional[int] = None,
+    db: AsyncSession = Depends(get_db_lectura),
+):
+    """
+    Devuelve los videos en tendencia: vistas, tiempo visto y likes
+    recientes pesan más que los antiguos. El ranking se mantiene en
+    memoria (ver `tendencias.py`), así que sólo se hidratan las tarjetas.
+    """
+    tarjetas = await tarjetas_feed(db, [str(i) for i in TENDENCIAS.top(limit)])
+    return {"videos": await superponer_liked(db, tarjetas, id_usuario)}
+
+@app.get("/videos/{id_video}/similar", response_model=schemas.ListaSimilares)
+async def videos_similares(
+    id_video: UUID,
+    limit: int = Query(10, ge=1, le=50),
+    id_usuario: Optional[int] = None,
+    db: AsyncSession = Depends(get_db_lectura),
+):
+    """
+    Devuelve los videos que más gustan a quienes dieron like a este,
+    de más a menos parecido. Los vecinos los precalcula la tarea
+    `calcular_similares` (ver `recomendaciones.py`).
+    """
+    ids = await crud_async.get_similares(db, id_video, limit)
+    if not ids and not await crud_async.get_video_by_id(db, id_video):
+        raise HTTPException(status_code=404, detail="Video no encontrado")
+    tarjetas = await tarjetas_feed(db, [str(i) for i in ids])
+    return {"videos": await superponer_liked(db, tarjetas, id_usuario)}
+
+@app.get("/videos/{id_video}/procesamiento", response_model=schemas.ProcesamientoResponse)
+async def estado_procesamiento(id_video: UUID, db: AsyncSession = Depends(get_db)):
+    """
+    Devuelve el estado del procesamiento de un video, sus metadatos
+    técnicos y el avance de cada trabajo encolado.
+    """
+    video = await crud_async.get_video_by_id(db, id_video)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video no encontrado")
+    return {
+        "id_video": video.id_video,
+        "estado": video.estado,
+        "duracion": str(video.duracion),
+        "ancho": video.ancho,
+        "alto": video.alto,
+        "bitrate": video.bitrate,
+        "codec": video.codec,
+        "ruta": video.ruta,
+        "ruta_original": video.ruta_original,
+        "poster": video.poster,
+        "miniaturas_vtt": video.miniaturas_vtt,
+        "trabajos": await crud_async.get_trabajos_por_video(db, id_video),
+    }
+
+@app.patch("/videos/{id_video}", response_model=schemas.VideoResponse)
+async def actualizar_video(
+    id_video: UUID, id_usuario: int, datos: schemas.VideoUpdate, db: AsyncSession = Depends(get_db)
+):
+    """
+    Cambia el título y/o la descripción de un video del usuario;
+    el índice de búsqueda se actualiza en la misma transacción.
+    """
+    video = await crud_async.get_video_by_id(db, id_video)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video no encontrado")
+    if video.id_usuario != id_usuario:
+        raise HTTPException(status_code=403, detail="No tienes permiso para editar este video")
+    await crud_async.actualizar_video(db, video, datos.titulo, datos.descripcion)
+    tarjetas = await tarjetas_feed(db, [str(id_video)])
+    return (await superponer_liked(db, tarjetas, id_usuario))[0]
 
 @app.delete("/videos/{id_video}")
-def eliminar_video(id_video: UUID, id_usuario: int, db: Session = Depends(get_db)):
+def eliminar_video(id_video: UUID, id_usuario: int, db: Session = Depends(get_db_sync)):
     """
     Elimina un video si pertenece al usuario autenticado.
     """
@@ -175,131 +818,239 @@ def eliminar_video(id_video: UUID, id_usuario: int, db: Session = Depends(get_db
         raise HTTPException(status_code=404, detail="Video no encontrado")
     if video.id_usuario != id_usuario:
         raise HTTPException(status_code=403, detail="No tienes permiso para eliminar este video")
-    crud.eliminar_video(db, id_video)
+    # Un original que aún no pasó al almacenamiento por contenido no tiene objeto
+    pendiente = None
+    if video.sha256 is None and (video.ruta_original or "").startswith("media/objetos/.pendientes/"):
+        pendiente = os.path.join(PENDIENTES_DIR, os.path.basename(video.ruta_original))
+    crud.eliminar_video(db, id_video, liberar_objeto=liberar_objeto)
+    if pendiente and os.path.exists(pendiente):
+        os.unlink(pendiente)
     return {"message": "Video eliminado correctamente"}
 
 # ===================================================== # ❤️ LIKES # =====================================================
 @app.get("/videos/{id_video}/like", response_model=schemas.LikeResponse)
-def obtener_estado_like(id_video: UUID, id_usuario: int, db: Session = Depends(get_db)):
+async def obtener_estado_like(id_video: UUID, id_usuario: int, db: AsyncSession = Depends(get_db)):
     """
     Devuelve si el usuario actual ha dado 'like' a un video
     y el número total de 'likes' del mismo.
     """
-    video = crud.get_video_by_id(db, id_video)
+    video = await crud_async.get_video_by_id(db, id_video)
     if not video:
         raise HTTPException(status_code=404, detail="Video no encontrado")
-    like = crud.get_like(db, id_usuario, id_video)
+    like = await crud_async.get_like(db, id_usuario, id_video)
     liked = like.activo if like else False
-    total_likes = crud.get_total_likes(db, id_video)
+    total_likes = await crud_async.get_total_likes(db, id_video)
     return {"likes": total_likes, "liked": liked}
 
+@app.post("/likes/estado", response_model=List[schemas.EstadoLikeResponse])
+async def estado_likes(datos: schemas.EstadoLikesRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Devuelve `likes` y `liked` de varios videos a la vez (hasta 100),
+    con el mismo formato que `GET /videos/{id_video}/like` más el
+    `id_video`. Un id que no corresponde a ningún video aparece con
+    0 likes y sin like.
+    """
+    return await crud_async.get_estado_likes(db, datos.id_usuario, datos.ids)
+
 @app.post("/videos/{id_video}/like", response_model=schemas.LikeResponse)
-def toggle_like(id_video: UUID, id_usuario: int, db: Session = Depends(get_db)):
+async def toggle_like(id_video: UUID, id_usuario: int, db: AsyncSession = Depends(get_db)):
     """
     Activa o desactiva el 'like' de un usuario sobre un video.
     Actualiza automáticamente el contador.
     """
-    video = crud.get_video_by_id(db, id_video)
+    video = await crud_async.get_video_by_id(db, id_video)
     if not video:
         raise HTTPException(status_code=404, detail="Video no encontrado")
-    like = crud.get_like(db, id_usuario, id_video)
-    if like:
-        nuevo_estado = not like.activo
-        crud.actualizar_estado_like(db, id_usuario, id_video, nuevo_estado)
-        liked = nuevo_estado
-    else:
-        crud.create_like(db, id_usuario, id_video)
-        liked = True
-    total_likes = crud.get_total_likes(db, id_video)
+    liked, total_likes = await crud_async.toggle_like(db, id_usuario, id_video)
+    TENDENCIAS.registrar_like(id_video, liked)
+    ANALITICAS.registrar_like(id_video, liked)
     return {"likes": total_likes, "liked": liked}
 
 # ===================================================== # 👀 INTERACCIONES (VISTAS Y PROGRESO) # =====================================================
+async def preparar_buffer_interacciones(db: AsyncSession, id_video):
+    """
+    Asegura que el buffer conozca el total persistido del video antes de
+    acumular eventos (una sola lectura por video). Lanza 404 si no existe.
+    """
+    if BUFFER_INTERACCIONES.conoce(id_video):
+        return
+    leido_desde = time.monotonic()
+    interaccion = await crud_async.get_interaccion_por_video(db, id_video)
+    if not interaccion:
+        if not await crud_async.get_video_by_id(db, id_video):
+            raise HTTPException(status_code=404, detail="Video no encontrado")
+        interaccion = await crud_async.crear_interaccion(db, id_video)
+    BUFFER_INTERACCIONES.sembrar(interaccion, leido_desde)
+
 @app.post("/videos/{id_video}/view")
-def registrar_vista(id_video: UUID, db: Session = Depends(get_db)):
+async def registrar_vista(id_video: UUID, db: AsyncSession = Depends(get_db)):
     """
     Incrementa el contador de vistas del video especificado.
+    Con el buffer activo la vista se acumula en memoria y se
+    persiste por lotes; el total devuelto es una estimación.
     """
-    video = crud.get_video_by_id(db, id_video)
-    if not video:
-        raise HTTPException(status_code=404, detail="Video no encontrado")
-    interaccion = crud.registrar_vista(db, id_video)
-    return {"views": interaccion.total_vistas}
+    if BUFFER_INTERACCIONES.activo:
+        await preparar_buffer_interacciones(db, id_video)
+        vistas = BUFFER_INTERACCIONES.registrar_vista(id_video)
+    else:
+        video = await crud_async.get_video_by_id(db, id_video)
+        if not video:
+            raise HTTPException(status_code=404, detail="Video no encontrado")
+        vistas = (await crud_async.registrar_vista(db, id_video)).total_vistas
+    TENDENCIAS.registrar_incrementos({id_video: (1, 0, 0.0)})
+    ANALITICAS.registrar_vista(id_video)
+    return {"views": vistas}
 
 @app.post("/videos/{id_video}/progress")
-def registrar_progreso(
+async def registrar_progreso(
     id_video: UUID,
     segundos_vistos: float = Form(...),
     duracion_total: float = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Registra el tiempo total que el usuario ha visto de un video.
     Permite calcular promedios de visualización.
     """
-    video = crud.get_video_by_id(db, id_video)
-    if not video:
-        raise HTTPException(status_code=404, detail="Video no encontrado")
-    interaccion = crud.registrar_progreso(db, id_video, segundos_vistos, duracion_total)
+    if BUFFER_INTERACCIONES.activo:
+        await preparar_buffer_interacciones(db, id_video)
+        vistas, promedio = BUFFER_INTERACCIONES.registrar_progreso(id_video, segundos_vistos)
+    else:
+        video = await crud_async.get_video_by_id(db, id_video)
+        if not video:
+            raise HTTPException(status_code=404, detail="Video no encontrado")
+        interaccion = await crud_async.registrar_progreso(db, id_video, segundos_vistos, duracion_total)
+        vistas, promedio = interaccion.total_vistas, interaccion.promedio_tiempo_visto
+    TENDENCIAS.registrar_incrementos({id_video: (0, 1, segundos_vistos)})
+    ANALITICAS.registrar_progreso(id_video, segundos_vistos, duracion_total)
     return {
         "message": "Progreso registrado",
-        "vistas": interaccion.total_vistas,
-        "promedio_tiempo_visto": str(interaccion.promedio_tiempo_visto),
+        "vistas": vistas,
+        "promedio_tiempo_visto": str(promedio),
+    }
+
+async def leer_eventos_interaccion(request: Request) -> list:
+    """
+    Lee el cuerpo de `POST /interacciones`: un arreglo JSON o, con
+    Content-Type application/x-ndjson, un evento JSON por línea.
+    """
+    cuerpo = await request.body()
+    tipo = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        if tipo in ("application/x-ndjson", "application/jsonl"):
+            crudos = [json.loads(linea) for linea in cuerpo.splitlines() if linea.strip()]
+        else:
+            crudos = json.loads(cuerpo)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cuerpo JSON inválido")
+    if not isinstance(crudos, list):
+        raise HTTPException(status_code=400, detail="Se esperaba una lista de eventos")
+    if len(crudos) > INTERACCIONES_LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {INTERACCIONES_LOTE_MAX} eventos por lote")
+    try:
+        return [schemas.EventoInteraccion.model_validate(crudo) for crudo in crudos]
+    except ValidationError as error:
+        raise HTTPException(status_code=422, detail=error.errors(include_url=False))
+
+@app.post("/interacciones", response_model=schemas.LoteInteraccionesResponse)
+async def registrar_interacciones(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Registra por lotes eventos de vista y progreso de varios videos.
+    Los eventos se agrupan por video y se aplican con un único UPSERT,
+    con el mismo resultado que llamar a `/view` y `/progress` por cada
+    evento. Los eventos de videos inexistentes se descartan.
+    """
+    eventos = await leer_eventos_interaccion(request)
+    unicos, duplicados = descartar_duplicados(eventos)
+    incrementos = agrupar_eventos(unicos)
+    totales = {}
+    leido_desde = time.monotonic()
+    if incrementos:
+        totales = await crud_async.aplicar_incrementos_interaccion(db, incrementos)
+    TENDENCIAS.registrar_incrementos({id_video: incrementos[id_video] for id_video in totales})
+    ANALITICAS.registrar_eventos(evento for evento in unicos if evento.id_video in totales)
+    for id_video, interaccion in totales.items():
+        # Mantener al día las estimaciones del buffer para este video
+        if BUFFER_INTERACCIONES.conoce(id_video):
+            BUFFER_INTERACCIONES.sembrar(interaccion, leido_desde)
+    return {
+        "recibidos": len(eventos),
+        "duplicados": duplicados,
+        "videos": len(totales),
+        "descartados": len(incrementos) - len(totales),
+    }
+
+@app.get("/videos/{id_video}/analiticas", response_model=schemas.AnaliticasVideoResponse)
+async def analiticas_video(
+    id_video: UUID,
+    horas: int = Query(48, ge=1, le=24 * 90),
+    db: AsyncSession = Depends(get_db_lectura),
+):
+    """
+    Devuelve la curva de retención del video y sus métricas hora a hora
+    de las últimas `horas` (las horas sin actividad se omiten). Se leen
+    de tablas ya agregadas (ver `analiticas.py`); los eventos de los
+    últimos segundos pueden no estar incluidos todavía.
+    """
+    desde = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=horas - 1)
+    conteos = await crud_async.get_retencion(db, id_video)
+    serie = await crud_async.get_metricas_horarias(db, id_video, desde)
+    if conteos is None and not serie and not await crud_async.get_video_by_id(db, id_video):
+        raise HTTPException(status_code=404, detail="Video no encontrado")
+    conteos = conteos or [0] * models.CUBETAS_RETENCION
+    return {
+        "id_video": id_video,
+        "sesiones": sum(conteos),
+        "histograma": conteos,
+        "retencion": curva_retencion(conteos),
+        "serie": serie,
     }
 
 # ===================================================== # 🏷️ ETIQUETAS # =====================================================
-@app.get("/etiquetas", response_model=list[schemas.EtiquetaResponse])
-def listar_etiquetas(db: Session = Depends(get_db)):
-    """Devuelve todas las etiquetas registradas."""
-    return crud.listar_etiquetas(db)
+@app.get("/etiquetas", response_model=list[schemas.EtiquetaConteoResponse])
+async def listar_etiquetas(limit: int = Query(100, ge=1, le=1000), db: AsyncSession = Depends(get_db_lectura)):
+    """
+    Devuelve las etiquetas del catálogo con su número de videos,
+    de la más usada a la menos usada.
+    """
+    return await crud_async.listar_etiquetas(db, limit)
 
 @app.post("/etiquetas", response_model=schemas.EtiquetaResponse)
-def crear_etiqueta(etiqueta: schemas.EtiquetaCreate, db: Session = Depends(get_db)):
-    """Crea una nueva etiqueta asociada a un video existente."""
-    nueva = crud.crear_etiqueta(db, etiqueta.nombre, etiqueta.id_video)
-    return schemas.EtiquetaResponse.from_orm(nueva)
+async def crear_etiqueta(etiqueta: schemas.EtiquetaCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Asocia una etiqueta a un video existente. El nombre se normaliza
+    (minúsculas, espacios simples) y se crea en el catálogo si no existe.
+    """
+    if not crud.normalizar_etiqueta(etiqueta.nombre):
+        raise HTTPException(status_code=400, detail="La etiqueta no puede estar vacía")
+    nueva = await crud_async.crear_etiqueta(db, etiqueta.nombre, etiqueta.id_video)
+    if nueva is None:
+        raise HTTPException(status_code=404, detail="Video no encontrado")
+    return nueva
 
 # ===================================================== # 🎲 VIDEOS ALEATORIOS # =====================================================
-@app.get("/videos/random")
+@app.get("/videos/random", response_model=schemas.PaginacionAleatoria)
 async def videos_random(
     id_usuario: int = Query(...),
-    page: int = Query(1),
-    page_size: int = Query(3),
-    db: Session = Depends(get_db)
+    page_size: int = Query(3, ge=1, le=50),
+    seed: Optional[int] = Query(None),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db_lectura)
 ):
     """
-    Devuelve una lista de videos aleatorios paginados (5 por página).
-    Solo carga más cuando se solicita una nueva página.
-    """
-    # Obtener todos los videos
-    todos_videos = crud.get_videos(db, skip=0, limit=crud.contar_videos(db))
-    import random
-    random.shuffle(todos_videos)
-    total = len(todos_videos)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paged_videos = todos_videos[start:end]
-    if not paged_videos:
-        return {"videos": [], "has_more": False}
-    result = []
-    for v in paged_videos:
-        usuario = crud.get_usuario_by_id(db, v.id_usuario)
-        etiqueta = crud.get_etiqueta_por_video(db, v.id_video)
-        total_likes = crud.get_total_likes(db, v.id_video)
-        like = crud.get_like(db, id_usuario, v.id_video)
-        liked = like.activo if like else False
-        result.append(
-            {
-                "id_video": str(v.id_video),
-                "titulo": v.titulo,
-                "descripcion": v.descripcion,
-                "ruta": v.ruta,
-                "usuario": usuario.nombre if usuario else "Desconocido",
-                "etiqueta": etiqueta.nombre if etiqueta else "",
-                "likes": total_likes or 0,
-                "liked": liked,
-                "fecha_subida": v.fecha_subida,
-                "duracion": str(v.duracion),
-            }
+    Devuelve una lista de videos aleatorios paginados.
+    La semilla (`seed`) fija el orden de la sesión: si no se envía se genera
+    una nueva y se devuelve para que el cliente la reutilice. Las páginas
+    siguientes se piden con `next_cursor` y nunca repiten videos dentro de
+    la sesión.
+    """
+    if seed is None and cursor is None:
+        seed = random.getrandbits(31)
+    try:
+        filas, has_more, next_cursor, seed = await crud_async.get_feed_aleatorio(
+            db, seed, limit=page_size, cursor=cursor, id_usuario=id_usuario
         )
-    has_more = end < total
-    return {"videos": result, "has_more": has_more}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    result = [serializar_video_feed(fila) for fila in filas]
+    return {"videos": result, "has_more": has_more, "seed": seed, "next_cursor": next_cursor}
@@ -0,0 +1,272 @@
+# =====================================================
+# 📡 ENTREGA DE ARCHIVOS MULTIMEDIA
+# =====================================================
+# Respuesta HTTP para servir videos e imágenes desde el
+# disco con soporte completo de peticiones parciales:
+#   - Range de uno o varios rangos (206, multipart/byteranges)
+#     y 416 cuando ningún rango es satisfacible
+#   - ETag fuerte, Last-Modified y las condiciones
+#     If-None-Match, If-Modified-Since e If-Range
+#   - Cache-Control largo e `immutable` para archivos
+#     direccionados por contenido
+#   - envío sin copia (sendfile) cuando el servidor ASGI
+#     ofrece la extensión `http.response.zerocopysend`
+# Así adelantar o retroceder en el feed sólo descarga los
+# bytes pedidos y las reproducciones repetidas se
+# resuelven desde la caché del navegador o de un CDN.
+# =====================================================
+
+from email.utils import formatdate, parsedate_to_datetime
+import mimetypes
+import os
+import re
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+# Tamaño de cada bloque enviado cuando no hay sendfile (256 KiB)
+TAMANO_BLOQUE = 256 * 1024
+
+# Rangos distintos admitidos en una sola petición; más que eso
+# se trata como abuso y se responde con el archivo completo
+MAX_RANGOS = 16
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "public, max-age=60, must-revalidate"
+
+# Un archivo nombrado por el SHA-256 de un contenido (o guardado en la
+# carpeta de derivados de ese contenido) nunca cambia
+_NOMBRE_POR_CONTENIDO = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]+)?$")
+
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+mimetypes.add_type("text/vtt", ".vtt")
+mimetypes.add_type("image/webp", ".webp")
+
+
+def es_direccionado_por_contenido(ruta: str) -> bool:
+    """Indica si algún componente de la ruta es el hash SHA-256 de un contenido."""
+    return any(_NOMBRE_POR_CONTENIDO.match(parte) for parte in ruta.replace("\\", "/").split("/"))
+
+
+def resolver_ruta(directorio: str, ruta: str):
+    """
+    Convierte la ruta pedida en una ruta del disco dentro de `directorio`.
+    Retorna None si sale del directorio, apunta a un archivo o carpeta
+    oculta (p. ej. las subidas en curso) o no es un archivo regular.
+    """
+    partes = [p for p in ruta.replace("\\", "/").split("/") if p]
+    if not partes or any(p.startswith(".") for p in partes):
+        return None
+    base = os.path.realpath(directorio)
+    completa = os.path.realpath(os.path.join(base, *partes))
+    if os.path.commonpath([base, completa]) != base or not os.path.isfile(completa):
+        return None
+    return completa
+
+
+def _etag(stat) -> str:
+    # Los archivos se escriben en un temporal y se renombran, así que
+    # inodo + tamaño + mtime identifican un contenido byte a byte
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _coincide_etag(cabecera: str, etag: str, debil: bool) -> bool:
+    """Compara `etag` con una lista de If-None-Match / If-Range."""
+    if cabecera.strip() == "*":
+        return True
+    for candidata in cabecera.split(","):
+        candidata = candidata.strip()
+        if debil and candidata.startswith("W/"):
+            candidata = candidata[2:]
+        if candidata == etag:
+            return True
+    return False
+
+
+def _no_modificado_desde(cabecera: str, mtime: float) -> bool:
+    try:
+        fecha = parsedate_to_datetime(cabecera)
+    except (TypeError, ValueError):
+        return False
+    return int(mtime) <= fecha.timestamp()
+
+
+def interpretar_rangos(cabecera: str, tamano: int):
+    """
+    Interpreta una cabecera Range de bytes.
+
+    Retorna None si la cabecera no es válida o debe ignorarse (se sirve el
+    archivo completo), una lista vacía si ningún rango es satisfacible (416)
+    o la lista de rangos (inicio, fin) inclusivos, ordenados y fusionados.
+    """
+    unidad, _, especificacion = cabecera.partition("=")
+    if unidad.strip().lower() != "bytes" or not especificacion.strip():
+        return None
+    rangos = []
+    for parte in especificacion.split(","):
+        inicio, guion, fin = parte.strip().partition("-")
+        if not guion:
+            return None
+        try:
+            if inicio:
+                inicio = int(inicio)
+                fin = int(fin) if fin else max(inicio, tamano - 1)
+                if fin < inicio:
+                    return None
+            else:
+                # bytes=-N: los últimos N bytes
+                sufijo = int(fin)
+                if sufijo == 0:
+                    continue
+                inicio, fin = max(0, tamano - sufijo), tamano - 1
+        except ValueError:
+            return None
+        if inicio < tamano:
+            rangos.append((inicio, min(fin, tamano - 1)))
+    rangos.sort()
+    fusionados = []
+    for inicio, fin in rangos:
+        if fusionados and inicio <= fusionados[-1][1] + 1:
+            fusionados[-1] = (fusionados[-1][0], max(fusionados[-1][1], fin))
+        else:
+            fusionados.append((inicio, fin))
+    if len(fusionados) > MAX_RANGOS:
+        return None
+    return fusionados
+
+
+class RespuestaArchivo(Response):
+    """
+    Sirve un archivo del disco aplicando las cabeceras condicionales y de
+    rango de la petición. `inmutable` indica que el contenido de la ruta
+    nunca cambia y puede guardarse en caché indefinidamente.
+    """
+
+    def __init__(self, ruta: str, peticion: Headers, metodo: str = "GET",
+                 inmutable: bool = False, media_type: str = None):
+        self.ruta = ruta
+        self.metodo = metodo.upper()
+        self.media_type = media_type or mimetypes.guess_type(ruta)[0] or "application/octet-stream"
+        self.background = None
+        self.body = b""
+        stat = os.stat(ruta)
+        self.tamano = stat.st_size
+        self.etag = _etag(stat)
+        self.rangos = None
+        self.frontera = None
+
+        cabeceras = {
+            "accept-ranges": "bytes",
+            "etag": self.etag,
+            "last-modified": formatdate(stat.st_mtime, usegmt=True),
+            "cache-control": CACHE_INMUTABLE if inmutable else CACHE_REVALIDAR,
+        }
+        self.status_code = 200
+        if self._no_modificado(peticion, stat):
+            self.status_code = 304
+        elif "range" in peticion and self._aplica_rango(peticion, stat):
+            rangos = interpretar_rangos(peticion["range"], self.tamano)
+            if rangos == []:
+                self.status_code = 416
+                cabeceras["content-range"] = f"bytes */{self.tamano}"
+            elif rangos:
+                self.status_code = 206
+                self.rangos = rangos
+
+        if self.status_code == 200:
+            cabeceras["content-type"] = self._tipo_con_charset()
+            cabeceras["content-length"] = str(self.tamano)
+        elif self.status_code == 206 and len(self.rangos) == 1:
+            inicio, fin = self.rangos[0]
+            cabeceras["content-type"] = self._tipo_con_charset()
+            cabeceras["content-range"] = f"bytes {inicio}-{fin}/{self.tamano}"
+            cabeceras["content-length"] = str(fin - inicio + 1)
+        elif self.status_code == 206:
+            self.frontera = os.urandom(12).hex()
+            cabeceras["content-type"] = f"multipart/byteranges; boundary={self.frontera}"
+            cabeceras["content-length"] = str(sum(
+                len(encabezado) + fin - inicio + 1 for encabezado, inicio, fin in self._partes()
+            ) + len(self._cierre()))
+        elif self.status_code == 416:
+            cabeceras["content-length"] = "0"
+        self.init_headers(cabeceras)
+
+    def _tipo_con_charset(self) -> str:
+        if self.media_type.startswith("text/") or self.media_type.endswith("mpegurl"):
+            return f"{self.media_type}; charset=utf-8"
+        return self.media_type
+
+    def _no_modificado(self, peticion, stat) -> bool:
+        if self.metodo not in ("GET", "HEAD"):
+            return False
+        # If-None-Match tiene prioridad sobre If-Modified-Since (RFC 9110 §13.2.2)
+        if "if-none-match" in peticion:
+            return _coincide_etag(peticion["if-none-match"], self.etag, debil=True)
+        if "if-modified-since" in peticion:
+            return _no_modificado_desde(peticion["if-modified-since"], stat.st_mtime)
+        return False
+
+    def _aplica_rango(self, peticion, stat) -> bool:
+        """If-Range: el rango sólo se respeta si el archivo no cambió."""
+        if self.metodo != "GET":
+            return False
+        condicion = peticion.get("if-range")
+        if condicion is None:
+            return True
+        condicion = condicion.strip()
+        if condicion.startswith('"') or condicion.startswith("W/"):
+            # Para If-Range la comparación es fuerte: un ETag débil nunca coincide
+            return condicion == self.etag
+        return condicion == formatdate(stat.st_mtime, usegmt=True)
+
+    def _partes(self):
+        for inicio, fin in self.rangos:
+            encabezado = (
+                f"\r\n--{self.frontera}\r\n"
+                f"Content-Type: {self._tipo_con_charset()}\r\n"
+                f"Content-Range: bytes {inicio}-{fin}/{self.tamano}\r\n\r\n"
+            ).encode("latin-1")
+            yield encabezado, inicio, fin
+
+    def _cierre(self) -> bytes:
+        return f"\r\n--{self.frontera}--\r\n".encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.metodo == "HEAD" or self.status_code in (304, 416):
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        rangos = self.rangos or [(0, self.tamano - 1)]
+        async with await anyio.open_file(self.ruta, "rb") as archivo:
+            if self.frontera is None:
+                inicio, fin = rangos[0]
+                await self._enviar_tramo(send, archivo, inicio, fin, zerocopy, ultimo=True)
+                return
+            for encabezado, inicio, fin in self._partes():
+                await send({"type": "http.response.body", "body": encabezado, "more_body": True})
+                await self._enviar_tramo(send, archivo, inicio, fin, zerocopy, ultimo=False)
+            await send({"type": "http.response.body", "body": self._cierre(), "more_body": False})
+
+    async def _enviar_tramo(self, send, archivo, inicio: int, fin: int, zerocopy: bool, ultimo: bool):
+        restante = fin - inicio + 1
+        if zerocopy and restante > 0:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": archivo.wrapped.fileno(),
+                "offset": inicio,
+                "count": restante,
+                "more_body": not ultimo,
+            })
+            return
+        await archivo.seek(inicio)
+        while restante > 0:
+            bloque = await archivo.read(min(TAMANO_BLOQUE, restante))
+            if not bloque:
+                break
+            restante -= len(bloque)
+            await send({"type": "http.response.body", "body": bloque, "more_body": restante > 0 or not ultimo})
+        if restante > 0 or (fin < inicio and ultimo):
+            await send({"type": "http.response.body", "body": b"", "more_body": not ultimo})
@@ -0,0 +1,322 @@
+# =====================================================
+# 📏 MÉTRICAS DE RENDIMIENTO
+# =====================================================
+# Instrumentación por petición, pensada para dejarla
+# activa en producción:
+#   - un middleware ASGI mide la latencia de cada petición
+#     por ruta (la plantilla, p. ej. /videos/{id_video},
+#     no la URL, para acotar el número de series)
+#   - eventos de SQLAlchemy cuentan las consultas, su
+#     tiempo y las filas que informa el driver, y los
+#     atribuyen a la petición en curso con una ContextVar
+#     (las de las tareas en segundo plano van a la ruta
+#     "segundo_plano")
+#   - subidas (bytes y velocidad) y trabajos de medios se
+#     registran desde su código con `registrar_subida` y
+#     `medir`
+#
+# `exponer()` genera el formato de texto de Prometheus
+# para `GET /metrics`. Cada proceso lleva sus propios
+# contadores: con varios workers, Prometheus debe leer
+# cada uno. Opcionalmente, las peticiones más lentas que
+# un umbral se registran en el log con sus consultas.
+# =====================================================
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Cubetas de los histogramas
+CUBETAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CUBETAS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100)
+CUBETAS_BYTES_POR_SEGUNDO = (1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9)
+CUBETAS_TRABAJOS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# Ruta de las consultas hechas fuera de una petición
+RUTA_SEGUNDO_PLANO = "segundo_plano"
+# Ruta de las peticiones que no corresponden a ningún endpoint (404, estáticos)
+RUTA_OTRAS = "otras"
+
+# Consultas que se guardan por petición para el log de peticiones lentas
+MAX_CONSULTAS_LOG = 50
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+# =====================================================
+# 🧮 TIPOS DE MÉTRICA
+# =====================================================
+
+class Contador:
+    """Contador acumulado por combinación de etiquetas."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, valor: float = 1, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def lineas(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        for etiquetas, valor in valores:
+            yield f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {_numero(valor)}"
+
+
+class Histograma:
+    """Histograma acumulado (cubetas, suma y número de observaciones) por etiquetas."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, cubetas: tuple, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.cubetas = tuple(cubetas)
+        self.etiquetas = etiquetas
+        # etiquetas -> [conteos por cubeta (no acumulados), suma, total]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *etiquetas):
+        indice = len(self.cubetas)
+        for i, limite in enumerate(self.cubetas):
+            if valor <= limite:
+                indice = i
+                break
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.cubetas) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def lineas(self):
+        with self._lock:
+            series = [
+                (etiquetas, list(conteos), suma, total)
+                for etiquetas, (conteos, suma, total) in self._series.items()
+            ]
+        for etiquetas, conteos, suma, total in series:
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas + (float("inf"),), conteos):
+                acumulado += conteo
+                le = f'le="{_numero(float(limite))}"'
+                yield f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}"
+            yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(suma)}"
+            yield f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {total}"
+
+
+REGISTRO = []
+
+
+def _registrar(metrica):
+    REGISTRO.append(metrica)
+    return metrica
+
+
+HTTP_PETICIONES = _registrar(Contador(
+    "http_peticiones_total", "Peticiones HTTP atendidas", ("ruta", "metodo", "estado")))
+HTTP_DURACION = _registrar(Histograma(
+    "http_duracion_segundos", "Latencia de las peticiones HTTP", CUBETAS_SEGUNDOS, ("ruta", "metodo")))
+HTTP_CONSULTAS = _registrar(Histograma(
+    "http_consultas_db", "Consultas a la base de datos por petición", CUBETAS_CONSULTAS, ("ruta",)))
+DB_CONSULTAS = _registrar(Contador(
+    "db_consultas_total", "Consultas a la base de datos", ("ruta",)))
+DB_TIEMPO = _registrar(Contador(
+    "db_tiempo_segundos_total", "Tiempo en consultas a la base de datos", ("ruta",)))
+DB_FILAS = _registrar(Contador(
+    "db_filas_total", "Filas devueltas o afectadas según el driver (SQLite no informa las de SELECT)", ("ruta",)))
+DB_DURACION = _registrar(Histograma(
+    "db_consulta_segundos", "Duración de cada consulta a la base de datos", CUBETAS_SEGUNDOS))
+SUBIDA_BYTES = _registrar(Contador(
+    "subida_bytes_total", "Bytes de video recibidos", ("tipo",)))
+SUBIDA_VELOCIDAD = _registrar(Histograma(
+    "subida_bytes_por_segundo", "Velocidad de recepción de cada subida o parte", CUBETAS_BYTES_POR_SEGUNDO, ("tipo",)))
+MEDIA_DURACION = _registrar(Histograma(
+    "media_operacion_segundos", "Duración de los trabajos y análisis de medios", CUBETAS_TRABAJOS, ("operacion",)))
+
+
+def registrar_subida(tipo: str, bytes_recibidos: int, segundos: float):
+    """Registra los bytes de una subida (o parte) y su velocidad."""
+    SUBIDA_BYTES.sumar(bytes_recibidos, tipo)
+    if segundos > 0:
+        SUBIDA_VELOCIDAD.observar(bytes_recibidos / segundos, tipo)
+
+
+@contextmanager
+def medir(operacion: str):
+    """Mide la duración de una operación de medios (también si falla)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        MEDIA_DURACION.observar(time.perf_counter() - inicio, operacion)
+
+
+def texto_pools(estados: list) -> list:
+    """Líneas de métricas para `database.estado_pools()`."""
+    campos = ("prestamos", "tamano", "prestadas", "libres", "desborde", "capacidad", "saturacion")
+    lineas = []
+    for campo in campos:
+        nombre = f"db_pool_{campo}" + ("_total" if campo == "prestamos" else "")
+        tipo = "counter" if campo == "prestamos" else "gauge"
+        valores = [(estado["motor"], estado[campo]) for estado in estados if campo in estado]
+        if not valores:
+            continue
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        lineas.extend(f'{nombre}{{motor="{_escapar(motor)}"}} {_numero(valor)}' for motor, valor in valores)
+    return lineas
+
+
+def exponer(extra: list = ()) -> str:
+    """Todas las métricas en el formato de texto de Prometheus."""
+    lineas = []
+    for metrica in REGISTRO:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.lineas())
+    lineas.extend(extra)
+    return "\n".join(lineas) + "\n"
+
+
+# =====================================================
+# 🗄️ CONSULTAS (eventos de SQLAlchemy)
+# =====================================================
+
+class EstadisticasPeticion:
+    """Consultas de una petición; se llena desde los eventos del motor."""
+
+    __slots__ = ("consultas", "tiempo_db", "filas", "sentencias")
+
+    def __init__(self, guardar_sentencias: bool):
+        self.consultas = 0
+        self.tiempo_db = 0.0
+        self.filas = 0
+        # [(sentencia, segundos)] sólo si el log de peticiones lentas está activo
+        self.sentencias = [] if guardar_sentencias else None
+
+
+_peticion_actual = ContextVar("metricas_peticion", default=None)
+
+
+def instrumentar_motor(motor):
+    """Engancha los eventos de consulta a un motor síncrono o asíncrono."""
+    motor_sync = getattr(motor, "sync_engine", motor)
+
+    @event.listens_for(motor_sync, "before_cursor_execute")
+    def antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+    @event.listens_for(motor_sync, "after_cursor_execute")
+    def despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+        duracion = time.perf_counter() - conn.info["metricas_inicio"].pop()
+        filas = max(cursor.rowcount, 0)
+        DB_DURACION.observar(duracion)
+        estadisticas = _peticion_actual.get()
+        if estadisticas is None:
+            DB_CONSULTAS.sumar(1, RUTA_SEGUNDO_PLANO)
+            DB_TIEMPO.sumar(duracion, RUTA_SEGUNDO_PLANO)
+            DB_FILAS.sumar(filas, RUTA_SEGUNDO_PLANO)
+            return
+        estadisticas.consultas += 1
+        estadisticas.tiempo_db += duracion
+        estadisticas.filas += filas
+        if estadisticas.sentencias is not None and len(estadisticas.sentencias) < MAX_CONSULTAS_LOG:
+            estadisticas.sentencias.append((statement, duracion))
+
+    @event.listens_for(motor_sync, "handle_error")
+    def al_fallar(contexto_error):
+        # La consulta fallida no llega a after_cursor_execute
+        inicios = contexto_error.connection.info.get("metricas_inicio") if contexto_error.connection else None
+        if inicios:
+            inicios.pop()
+
+
+# =====================================================
+# 🌐 MIDDLEWARE
+# =====================================================
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI (sin la sobrecarga de BaseHTTPMiddleware ni
+    interferir con las respuestas en streaming) que registra latencia,
+    estado y consultas de cada petición HTTP. Con `lenta_segundos`
+    mayor que 0 registra en el log las peticiones más lentas con la
+    lista de sus consultas.
+    """
+
+    def __init__(self, app, lenta_segundos: float = 0):
+        self.app = app
+        self.lenta_segundos = lenta_segundos
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        estadisticas = EstadisticasPeticion(self.lenta_segundos > 0)
+        token = _peticion_actual.set(estadisticas)
+        estado = 500
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _peticion_actual.reset(token)
+            self._registrar(scope, estado, time.perf_counter() - inicio, estadisticas)
+
+    def _registrar(self, scope, estado: int, duracion: float, estadisticas: EstadisticasPeticion):
+        # FastAPI deja en el scope la ruta que atendió la petición
+        ruta = getattr(scope.get("route"), "path", None) or RUTA_OTRAS
+        metodo = scope["method"]
+        HTTP_PETICIONES.sumar(1, ruta, metodo, str(estado))
+        HTTP_DURACION.observar(duracion, ruta, metodo)
+        HTTP_CONSULTAS.observar(estadisticas.consultas, ruta)
+        if estadisticas.consultas:
+            DB_CONSULTAS.sumar(estadisticas.consultas, ruta)
+            DB_TIEMPO.sumar(estadisticas.tiempo_db, ruta)
+            DB_FILAS.sumar(estadisticas.filas, ruta)
+        if self.lenta_segundos > 0 and duracion >= self.lenta_segundos:
+            consultas = "".join(
+                f"\n  {segundos * 1000:8.1f} ms  {' '.join(sentencia.split())[:300]}"
+                for sentencia, segundos in estadisticas.sentencias
+            )
+            logger.warning(
+                "Petición lenta: %s %s -> %s en %.1f ms (%s consultas, %.1f ms en base de datos)%s",
+                metodo, scope.get("path"), estado, duracion * 1000,
+                estadisticas.consultas, estadisticas.tiempo_db * 1000, consultas,
+            )
@@ -2,25 +2,48 @@
 # 📦 MODELOS DE BASE DE DATOS
 # =====================================================
 # Define las tablas principales de la plataforma usando SQLAlchemy ORM.
-# Incluye usuarios, videos, etiquetas, likes e interacciones.
+# Incluye usuarios, videos, etiquetas, likes, interacciones, los
+# trabajos de procesamiento de medios, los objetos de almacenamiento,
+# el feed personalizado precalculado de cada usuario, las
+# puntuaciones de tendencia, los videos similares y las analíticas
+# agregadas (retención y métricas por hora).
 # =====================================================
 
 from sqlalchemy import (
     Column,
     Integer,
+    SmallInteger,
+    BigInteger,
     String,
     Text,
     ForeignKey,
     Boolean,
+    Float,
     Interval,
+    LargeBinary,
     TIMESTAMP,
+    Index,
+    UniqueConstraint,
+    DDL,
+    event,
     func,
 )
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from sqlalchemy.orm import deferred, relationship
 from database import Base
+from datetime import datetime, timedelta
+import random
 import uuid
 
+# Marca de tiempo con valor por defecto del servidor. En SQLite (modo local)
+# CURRENT_TIMESTAMP no guarda microsegundos; los parámetros se guardan con el
+# mismo formato para que las comparaciones de texto del cursor del feed
+# ordenen igual que en PostgreSQL.
+MarcaTiempo = TIMESTAMP().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
 
 # =====================================================
 # 🧍‍♂️ USUARIO APP
@@ -37,7 +60,7 @@ class UsuarioApp(Base):
     nombre = Column(String(100), nullable=False)
     correo = Column(String(150), unique=True, nullable=False)
     contrasena = Column(String(255), nullable=False)
-    fecha_registro = Column(TIMESTAMP, server_default=func.now())
+    fecha_registro = Column(MarcaTiempo, server_default=func.now())
 
     # Relaciones
     videos = relationship("Video", back_populates="usuario", cascade="all, delete-orphan")
@@ -59,16 +82,89 @@ class Video(Base):
     titulo = Column(String(200), nullable=False)
     descripcion = Column(Text)
     duracion = Column(Interval, nullable=False)  # formato hh:mm:ss
-    fecha_subida = Column(TIMESTAMP, server_default=func.now())
+    fecha_subida = Column(MarcaTiempo, server_default=func.now())
     id_usuario = Column(Integer, ForeignKey("usuario_app.id_usuario", ondelete="CASCADE"), nullable=False)
     ruta = Column(String(500), nullable=False)
+    # Archivo tal como se subió; `ruta` pasa a la lista maestra HLS cuando está lista
+    ruta_original = Column(String(500))
+    # Objeto de almacenamiento (SHA-256 del contenido) que contiene el original
+    sha256 = Column(String(64), ForeignKey("objeto_media.sha256"), index=True)
     id_iteracion = Column(Integer, unique=True)
+    # Claves aleatorias fijas e independientes por video: el feed aleatorio
+    # recorre el índice de una de ellas, elegida por la semilla de cada
+    # sesión, a partir de un punto derivado también de la semilla
+    clave_aleatoria = Column(Integer, nullable=False, default=lambda: random.randint(0, 2**31 - 1))
+    clave_aleatoria_2 = Column(Integer, nullable=False, default=lambda: random.randint(0, 2**31 - 1))
+    clave_aleatoria_3 = Column(Integer, nullable=False, default=lambda: random.randint(0, 2**31 - 1))
+    clave_aleatoria_4 = Column(Integer, nullable=False, default=lambda: random.randint(0, 2**31 - 1))
+    # Estado del procesamiento en segundo plano: procesando, listo o error
+    estado = Column(String(20), nullable=False, default="listo")
+    # Metadatos técnicos obtenidos al analizar el archivo
+    ancho = Column(Integer)
+    alto = Column(Integer)
+    bitrate = Column(Integer)  # bits por segundo
+    codec = Column(String(50))
+    # Póster y miniaturas para adelantar (índice WebVTT sobre un sprite)
+    poster = Column(String(500))
+    miniaturas_vtt = Column(String(500))
+    # Documento de búsqueda (título con peso A, descripción con peso B) que
+    # mantiene `crud.indexar_busqueda_video`. Sólo en PostgreSQL; en SQLite
+    # queda vacío y se usa la tabla FTS5 `video_fts`. Diferida: no se
+    # carga al leer videos
+    busqueda = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
 
     # Relaciones
     usuario = relationship("UsuarioApp", back_populates="videos")
-    etiquetas = relationship("Etiqueta", back_populates="video", cascade="all, delete-orphan")
+    etiquetas = relationship("VideoEtiqueta", back_populates="video", cascade="all, delete-orphan")
     interaccion = relationship("Interaccion", back_populates="video", uselist=False, cascade="all, delete-orphan")
     likes = relationship("Like", back_populates="video", cascade="all, delete-orphan")
+    trabajos = relationship("TrabajoMedia", back_populates="video", cascade="all, delete-orphan")
+    objeto = relationship("ObjetoMedia", back_populates="videos")
+
+    # Índices compuestos para la paginación por cursor del feed cronológico
+    # y del aleatorio, y el índice invertido de la búsqueda de texto
+    __table_args__ = (
+        Index("ix_video_fecha_subida_id_video", "fecha_subida", "id_video"),
+        Index("ix_video_clave_aleatoria_id_video", "clave_aleatoria", "id_video"),
+        Index("ix_video_clave_aleatoria_2_id_video", "clave_aleatoria_2", "id_video"),
+        Index("ix_video_clave_aleatoria_3_id_video", "clave_aleatoria_3", "id_video"),
+        Index("ix_video_clave_aleatoria_4_id_video", "clave_aleatoria_4", "id_video"),
+        Index("ix_video_busqueda", "busqueda", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+
+# Índice de búsqueda de texto para SQLite (modo local): tabla virtual FTS5
+# con el id del video (no indexado), su título y su descripción
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS video_fts USING fts5("
+        "id_video UNINDEXED, titulo, descripcion, tokenize = 'unicode61 remove_diacritics 2')"
+    ).execute_if(dialect="sqlite"),
+)
+
+
+# =====================================================
+# 💾 OBJETO DE ALMACENAMIENTO
+# =====================================================
+class ObjetoMedia(Base):
+    """
+    Archivo original guardado una sola vez por contenido: su nombre es el
+    SHA-256 de los bytes. `referencias` cuenta los videos que lo usan; al
+    llegar a 0 se borran el archivo y sus derivados (HLS, miniaturas).
+    """
+
+    __tablename__ = "objeto_media"
+
+    sha256 = Column(String(64), primary_key=True)
+    ruta = Column(String(500), nullable=False)
+    tamano = Column(BigInteger, nullable=False)
+    referencias = Column(Integer, nullable=False, default=1)
+    fecha_creacion = Column(MarcaTiempo, server_default=func.now())
+
+    # Relaciones
+    videos = relationship("Video", back_populates="objeto")
 
 
 # =====================================================
@@ -76,18 +172,47 @@ class Video(Base):
 # =====================================================
 class Etiqueta(Base):
     """
-    Define una etiqueta o categoría asociada a un video.
-    Por ejemplo: 'educación', 'tutorial', 'entretenimiento'.
+    Catálogo de etiquetas o categorías, por ejemplo 'educación',
+    'tutorial', 'entretenimiento'. Cada nombre (normalizado, ver
+    `crud.normalizar_etiqueta`) aparece una sola vez; `total_videos`
+    se mantiene al asociar y eliminar videos.
     """
 
-    __tablename__ = "etiqueta"
+    __tablename__ = "catalogo_etiquetas"
 
     id_etiqueta = Column(Integer, primary_key=True, index=True)
-    nombre = Column(String(100), nullable=False)
-    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), nullable=False)
+    nombre = Column(String(100), nullable=False, unique=True)
+    total_videos = Column(Integer, nullable=False, default=0)
+
+    # Relaciones
+    videos = relationship("VideoEtiqueta", back_populates="etiqueta", cascade="all, delete-orphan")
+
+    # Listado de etiquetas por popularidad
+    __table_args__ = (
+        Index("ix_catalogo_etiquetas_total_videos", "total_videos", "id_etiqueta"),
+    )
+
+
+class VideoEtiqueta(Base):
+    """
+    Asociación entre un video y una etiqueta del catálogo.
+    Copia `Video.fecha_subida` para que el feed filtrado por etiqueta se
+    pagine por cursor recorriendo un único índice.
+    """
+
+    __tablename__ = "video_etiqueta"
+
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), primary_key=True)
+    id_etiqueta = Column(Integer, ForeignKey("catalogo_etiquetas.id_etiqueta", ondelete="CASCADE"), primary_key=True)
+    fecha_subida = Column(MarcaTiempo, nullable=False)
 
     # Relaciones
     video = relationship("Video", back_populates="etiquetas")
+    etiqueta = relationship("Etiqueta", back_populates="videos")
+
+    __table_args__ = (
+        Index("ix_video_etiqueta_etiqueta_fecha", "id_etiqueta", "fecha_subida", "id_video"),
+    )
 
 
 # =====================================================
@@ -110,6 +235,13 @@ class Like(Base):
     usuario = relationship("UsuarioApp", back_populates="likes")
     video = relationship("Video", back_populates="likes")
 
+    # Un único registro de like por (usuario, video); el índice por video
+    # sirve a la reconciliación del contador `Interaccion.total_likes`
+    __table_args__ = (
+        UniqueConstraint("id_usuario", "id_video", name="uq_likes_usuario_video"),
+        Index("ix_likes_id_video_activo", "id_video", "activo"),
+    )
+
 
 # =====================================================
 # 📊 INTERACCIÓN
@@ -126,7 +258,158 @@ class Interaccion(Base):
     id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), unique=True, nullable=False)
     total_vistas = Column(Integer, default=0)
     total_likes = Column(Integer, default=0)
-    promedio_tiempo_visto = Column(Interval, default="00:00:00")  # Duración promedio vista
+    # El promedio de tiempo visto se guarda como suma de segundos y número de
+    # eventos de progreso, para poder actualizarlo con sumas atómicas en SQL
+    segundos_vistos_total = Column(Float, default=0)
+    total_progresos = Column(Integer, default=0)
 
     # Relaciones
     video = relationship("Video", back_populates="interaccion")
+
+    @property
+    def promedio_tiempo_visto(self) -> timedelta:
+        """Duración promedio vista por evento de progreso."""
+        if not self.total_progresos:
+            return timedelta(0)
+        return timedelta(seconds=(self.segundos_vistos_total or 0) / self.total_progresos)
+
+
+# =====================================================
+# ⚙️ TRABAJO DE PROCESAMIENTO DE MEDIOS
+# =====================================================
+class TrabajoMedia(Base):
+    """
+    Trabajo pendiente o realizado sobre el archivo de un video
+    (análisis de metadatos, transcodificación, miniaturas...).
+    La cola de `procesamiento.py` los toma y ejecuta en segundo plano.
+    """
+
+    __tablename__ = "trabajo_media"
+
+    id_trabajo = Column(Integer, primary_key=True, index=True)
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), nullable=False, index=True)
+    tipo = Column(String(50), nullable=False)
+    # pendiente, en_proceso, completado o fallido
+    estado = Column(String(20), nullable=False, default="pendiente")
+    intentos = Column(Integer, nullable=False, default=0)
+    progreso = Column(Float, nullable=False, default=0)  # 0 a 1
+    error = Column(Text)
+    # Los reintentos se programan moviendo esta fecha hacia adelante
+    disponible_desde = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    fecha_actualizacion = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relaciones
+    video = relationship("Video", back_populates="trabajos")
+
+    __table_args__ = (
+        Index("ix_trabajo_media_estado_disponible", "estado", "disponible_desde"),
+    )
+
+
+# =====================================================
+# 📰 FEED PERSONALIZADO
+# =====================================================
+class FeedUsuario(Base):
+    """
+    Feed precalculado de un usuario: una fila por video en el orden de la
+    última generación. Las páginas se leen por rango de `posicion` sobre
+    la clave primaria, sin volver a ordenar el catálogo.
+    """
+
+    __tablename__ = "feed_usuario"
+
+    id_usuario = Column(Integer, ForeignKey("usuario_app.id_usuario", ondelete="CASCADE"), primary_key=True)
+    posicion = Column(Integer, primary_key=True)
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), nullable=False, index=True)
+    puntuacion = Column(Float, nullable=False)
+
+
+class FeedUsuarioEstado(Base):
+    """
+    Generación vigente del feed de un usuario. Si no existe o caducó,
+    el feed se vuelve a calcular en la siguiente lectura.
+    """
+
+    __tablename__ = "feed_usuario_estado"
+
+    id_usuario = Column(Integer, ForeignKey("usuario_app.id_usuario", ondelete="CASCADE"), primary_key=True)
+    generacion = Column(Integer, nullable=False, default=0)
+    generado_en = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    total = Column(Integer, nullable=False, default=0)
+
+
+# =====================================================
+# 🔥 TENDENCIAS
+# =====================================================
+class PuntuacionTendencia(Base):
+    """
+    Puntuación de tendencia de un video, con decaimiento exponencial en
+    el tiempo. Se guarda como logaritmo en una escala con origen fijo
+    (ver `tendencias.py`), así valores calculados en momentos distintos
+    son comparables y el orden se resuelve con el índice.
+    """
+
+    __tablename__ = "puntuacion_tendencia"
+
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), primary_key=True)
+    log_puntuacion = Column(Float, nullable=False, index=True)
+    fecha_actualizacion = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# =====================================================
+# 🧭 VIDEOS SIMILARES
+# =====================================================
+class VideoSimilar(Base):
+    """
+    Vecinos más parecidos de cada video según quién les dio like
+    (similitud coseno item-item, ver `recomendaciones.py`). Los vecinos
+    de un video se leen por rango de la clave primaria, ya ordenados.
+    """
+
+    __tablename__ = "video_similar"
+
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), primary_key=True)
+    posicion = Column(SmallInteger, primary_key=True)
+    id_similar = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), nullable=False, index=True)
+    puntuacion = Column(Float, nullable=False)
+
+
+# =====================================================
+# 📈 ANALÍTICAS AGREGADAS
+# =====================================================
+# Número de cubetas del histograma de retención: la cubeta i cuenta las
+# sesiones que vieron entre i/N y (i+1)/N del video. Cambiarlo invalida
+# los histogramas ya guardados.
+CUBETAS_RETENCION = 20
+
+
+class RetencionVideo(Base):
+    """
+    Histograma de tiempo visto de cada video, en fracciones fijas de su
+    duración. Se guarda empaquetado (CUBETAS_RETENCION enteros de 64 bits
+    little-endian) para que cada video ocupe una sola fila pequeña.
+    """
+
+    __tablename__ = "retencion_video"
+
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), primary_key=True)
+    histograma = Column(LargeBinary, nullable=False)
+    total_sesiones = Column(BigInteger, nullable=False, default=0)
+    fecha_actualizacion = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class MetricaHoraria(Base):
+    """
+    Vistas, likes netos, eventos de progreso y segundos vistos de un video
+    en una hora (UTC, truncada). La serie de un video es un rango de la
+    clave primaria (id_video, hora).
+    """
+
+    __tablename__ = "metrica_horaria"
+
+    id_video = Column(UUID(as_uuid=True), ForeignKey("video.id_video", ondelete="CASCADE"), primary_key=True)
+    hora = Column(MarcaTiempo, primary_key=True)
+    vistas = Column(Integer, nullable=False, default=0)
+    likes = Column(Integer, nullable=False, default=0)
+    progresos = Column(Integer, nullable=False, default=0)
+    segundos_vistos = Column(Float, nullable=False, default=0)
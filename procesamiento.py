@@ -0,0 +1,515 @@
+# =====================================================
+# 🎞️ PROCESAMIENTO DE MEDIOS EN SEGUNDO PLANO
+# =====================================================
+# Cola de trabajos respaldada por la tabla `trabajo_media`
+# y atendida por un grupo de hilos dentro del proceso.
+#
+# La subida sólo guarda el archivo y encola el análisis
+# (las reanudables, antes, el cálculo de su SHA-256);
+# los trabajadores obtienen después la duración y demás
+# metadatos (resolución, bitrate, códec) con pymediainfo.
+# Cada tipo de trabajo tiene un manejador registrado con
+# `@manejador("tipo")`, de modo que etapas posteriores
+# (p. ej. con ffmpeg) se agregan sin tocar la cola.
+#
+# Los errores se reintentan con espera exponencial hasta
+# `max_intentos`; el número de hilos limita la concurrencia
+# total y `limites` la de los tipos costosos (transcodificar).
+# Al completarse un trabajo se encolan sus etapas
+# `posteriores` (p. ej. analizar -> hls).
+# =====================================================
+
+from datetime import timedelta
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+
+import ffmpeg
+from pymediainfo import MediaInfo
+
+import almacenamiento
+import crud
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# tipo de trabajo -> función(cola, db, trabajo, video)
+MANEJADORES = {}
+
+
+def manejador(tipo: str):
+    """Registra la función que ejecuta los trabajos de `tipo`."""
+    def registrar(funcion):
+        MANEJADORES[tipo] = funcion
+        return funcion
+    return registrar
+
+
+class ColaMedia:
+    """
+    Grupo de `trabajadores` hilos que toman trabajos pendientes de la base
+    de datos y los ejecutan. Con 0 trabajadores la cola queda deshabilitada
+    (los trabajos se acumulan hasta que otro proceso los atienda).
+    """
+
+    def __init__(self, fabrica_sesion, directorio_base: str, trabajadores: int = 2,
+                 max_intentos: int = 3, intervalo_sondeo: float = 5,
+                 limites: dict = None, posteriores: dict = None):
+        self.fabrica_sesion = fabrica_sesion
+        self.directorio_base = directorio_base
+        self.trabajadores = trabajadores
+        self.max_intentos = max_intentos
+        self.intervalo_sondeo = intervalo_sondeo
+        # tipo -> máximo de trabajos simultáneos de ese tipo en este proceso
+        self._semaforos = {
+            tipo: threading.BoundedSemaphore(maximo) for tipo, maximo in (limites or {}).items()
+        }
+        # tipo -> tipos que se encolan cuando un trabajo termina con éxito
+        self.posteriores = posteriores or {}
+        self._hay_trabajo = threading.Event()
+        self._detener = threading.Event()
+        self._hilos = []
+
+    def ruta_archivo(self, ruta: str) -> str:
+        """Convierte la ruta relativa guardada en `Video.ruta` en una ruta del disco."""
+        return os.path.join(self.directorio_base, ruta)
+
+    def encolar(self, db, id_video, tipo: str):
+        """Crea un trabajo y despierta a los trabajadores."""
+        trabajo = crud.crear_trabajo_media(db, id_video, tipo)
+        self._hay_trabajo.set()
+        return trabajo
+
+    # -------------------------------------------------
+    # Ciclo de vida
+    # -------------------------------------------------
+    def iniciar(self):
+        """Reencola los trabajos que quedaron a medias y arranca los hilos."""
+        if self.trabajadores <= 0 or self._hilos:
+            return
+        db = self.fabrica_sesion()
+        try:
+            crud.reencolar_trabajos_colgados(db, max_segundos=3600)
+        finally:
+            db.close()
+        self._detener.clear()
+        for numero in range(self.trabajadores):
+            hilo = threading.Thread(target=self._bucle, name=f"cola_media_{numero}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self):
+        """Espera a que los trabajadores terminen el trabajo en curso."""
+        self._detener.set()
+        self._hay_trabajo.set()
+        for hilo in self._hilos:
+            hilo.join()
+        self._hilos = []
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            if not self.procesar_siguiente():
+                self._hay_trabajo.wait(self.intervalo_sondeo)
+                self._hay_trabajo.clear()
+
+    # -------------------------------------------------
+    # Ejecución
+    # -------------------------------------------------
+    def procesar_siguiente(self) -> bool:
+        """Toma y ejecuta un trabajo. Retorna False si no había ninguno."""
+        # Se reserva un cupo de cada tipo limitado; los tipos sin cupo no se toman
+        reservados = {tipo for tipo, semaforo in self._semaforos.items() if semaforo.acquire(blocking=False)}
+        db = self.fabrica_sesion()
+        try:
+            trabajo = crud.tomar_trabajo_media(db, excluir_tipos=set(self._semaforos) - reservados)
+            tomado = trabajo.tipo if trabajo else None
+            for tipo in reservados - {tomado}:
+                self._semaforos[tipo].release()
+            reservados &= {tomado}
+            if trabajo is None:
+                return False
+            error = None
+            video = None
+            try:
+                video = crud.get_video_by_id(db, trabajo.id_video)
+                if video is not None:
+                    with metricas.medir(trabajo.tipo):
+                        MANEJADORES[trabajo.tipo](self, db, trabajo, video)
+            except Exception as exc:
+                logger.exception("Error en el trabajo %s (%s)", trabajo.id_trabajo, trabajo.tipo)
+                db.rollback()
+                error = f"{type(exc).__name__}: {exc}"
+            trabajo = crud.finalizar_trabajo_media(db, trabajo, error, max_intentos=self.max_intentos)
+            if trabajo.estado == "fallido":
+                self._marcar_error(db, trabajo)
+            elif trabajo.estado == "completado" and video is not None:
+                # Los manejadores cambian columnas que muestra el feed (ruta, póster...)
+                crud.notificar("video_actualizado", trabajo.id_video)
+                for tipo in self.posteriores.get(trabajo.tipo, ()):
+                    self.encolar(db, trabajo.id_video, tipo)
+            return True
+        finally:
+            for tipo in reservados:
+                self._semaforos[tipo].release()
+            db.close()
+
+    def reportar_progreso(self, db, trabajo, progreso: float):
+        """Guarda el avance de un trabajo; también evita que se considere colgado."""
+        crud.actualizar_progreso_trabajo(db, trabajo.id_trabajo, round(min(max(progreso, 0), 1), 4))
+
+    def _marcar_error(self, db, trabajo):
+        """Un análisis (o su hash previo) que agotó sus reintentos deja el video en estado de error."""
+        if trabajo.tipo not in ("contenido", "analizar"):
+            return
+        video = crud.get_video_by_id(db, trabajo.id_video)
+        if video is not None:
+            video.estado = "error"
+            db.commit()
+            crud.notificar("video_actualizado", trabajo.id_video)
+
+
+# =====================================================
+# 🔑 CONTENIDO DE LAS SUBIDAS REANUDABLES
+# =====================================================
+
+@manejador("contenido")
+def contenido(cola: ColaMedia, db, trabajo, video):
+    """
+    Calcula el SHA-256 del original de una subida reanudable (que se
+    completó sin volver a leerlo) y lo pasa al almacenamiento por
+    contenido igual que una subida directa: suma la referencia al objeto,
+    lo publica y apunta el video a él. En un reintento que ya lo hizo no
+    hace nada.
+    """
+    if video.sha256:
+        return
+    pendiente = cola.ruta_archivo(video.ruta_original)
+    sha256 = almacenamiento.calcular_sha256(pendiente)
+    nombre = almacenamiento.nombre_objeto(sha256, video.ruta_original)
+    # La fila del objeto queda bloqueada hasta el commit (ver `crud.sumar_referencia_objeto`)
+    objeto = crud.sumar_referencia_objeto(db, sha256, f"media/objetos/{nombre}", os.path.getsize(pendiente))
+    almacenamiento.publicar_objeto(pendiente, cola.ruta_archivo(objeto.ruta))
+    video.sha256 = sha256
+    video.ruta = video.ruta_original = objeto.ruta
+    db.commit()
+
+
+# =====================================================
+# 🔎 ANÁLISIS DE METADATOS
+# =====================================================
+
+def analizar_video(path: str) -> dict:
+    """
+    Obtiene duración, resolución, bitrate y códec de un archivo de video
+    utilizando pymediainfo.
+    """
+    with metricas.medir("sondeo"):
+        info = MediaInfo.parse(path)
+    metadatos = {"duracion": timedelta(0), "ancho": None, "alto": None, "bitrate": None, "codec": None}
+    for track in info.tracks:
+        if track.track_type == "General" and track.overall_bit_rate:
+            metadatos["bitrate"] = int(track.overall_bit_rate)
+        if track.track_type == "Video":
+            if track.duration:
+                metadatos["duracion"] = timedelta(seconds=int(float(track.duration) / 1000))
+            metadatos["ancho"] = track.width
+            metadatos["alto"] = track.height
+            metadatos["codec"] = track.format
+            break
+    return metadatos
+
+
+CAMPOS_ANALISIS = ("duracion", "ancho", "alto", "bitrate", "codec")
+
+
+@manejador("analizar")
+def analizar(cola: ColaMedia, db, trabajo, video):
+    """
+    Completa los metadatos técnicos del video y lo deja listo. Si otro
+    video con el mismo contenido ya fue analizado se copian sus datos.
+    """
+    original = video.sha256 and crud.get_video_analizado_por_sha(db, video.sha256, excluir=video.id_video)
+    if original:
+        metadatos = {campo: getattr(original, campo) for campo in CAMPOS_ANALISIS}
+    else:
+        metadatos = analizar_video(cola.ruta_archivo(video.ruta_original or video.ruta))
+    for campo, valor in metadatos.items():
+        setattr(video, campo, valor)
+    video.estado = "listo"
+    db.commit()
+
+
+# =====================================================
+# 📶 TRANSCODIFICACIÓN HLS
+# =====================================================
+# Genera una escalera de calidades HLS (segmentos .ts y
+# lista por calidad) más la lista maestra en la carpeta
+# de derivados del video (ver `carpeta_derivados`). Todas las calidades salen de
+# un único proceso ffmpeg que decodifica una sola vez; los
+# fotogramas clave se fuerzan cada SEGUNDOS_SEGMENTO para
+# que los segmentos estén alineados y el reproductor
+# pueda cambiar de calidad en cualquier corte.
+# =====================================================
+
+# (altura, bitrate de video, bitrate de audio)
+ESCALERA_HLS = [
+    (360, "800k", "96k"),
+    (480, "1400k", "128k"),
+    (720, "2800k", "128k"),
+    (1080, "5000k", "192k"),
+]
+
+SEGUNDOS_SEGMENTO = 4
+
+# Cada cuántos segundos, como mucho, se guarda el avance de ffmpeg
+INTERVALO_PROGRESO = 2
+
+
+def escalera_para(alto) -> list:
+    """Calidades de ESCALERA_HLS que no superan la altura original (al menos una)."""
+    if not alto:
+        alto = 720
+    escalera = [calidad for calidad in ESCALERA_HLS if calidad[0] <= alto]
+    return escalera or ESCALERA_HLS[:1]
+
+
+def tiene_audio(path: str) -> bool:
+    return any(track.track_type == "Audio" for track in MediaInfo.parse(path).tracks)
+
+
+def comando_hls(origen: str, destino: str, escalera: list, con_audio: bool):
+    """Construye el comando ffmpeg que genera todas las calidades y la lista maestra."""
+    entrada = ffmpeg.input(origen)
+    videos = entrada.video.filter_multi_output("split", len(escalera))
+    flujos = []
+    opciones = {}
+    mapa = []
+    for i, (altura, bitrate_video, bitrate_audio) in enumerate(escalera):
+        flujos.append(videos.stream(i).filter("scale", -2, altura))
+        opciones[f"b:v:{i}"] = bitrate_video
+        opciones[f"maxrate:v:{i}"] = bitrate_video
+        opciones[f"bufsize:v:{i}"] = f"{2 * int(bitrate_video[:-1])}k"
+        if con_audio:
+            flujos.append(entrada.audio)
+            opciones[f"b:a:{i}"] = bitrate_audio
+            mapa.append(f"v:{i},a:{i},name:{altura}p")
+        else:
+            mapa.append(f"v:{i},name:{altura}p")
+    if con_audio:
+        opciones["c:a"] = "aac"
+        opciones["ac"] = 2
+    return (
+        ffmpeg.output(
+            *flujos,
+            os.path.join(destino, "%v", "indice.m3u8"),
+            f="hls",
+            vcodec="libx264",
+            preset="veryfast",
+            pix_fmt="yuv420p",
+            force_key_frames=f"expr:gte(t,n_forced*{SEGUNDOS_SEGMENTO})",
+            hls_time=SEGUNDOS_SEGMENTO,
+            hls_playlist_type="vod",
+            hls_segment_filename=os.path.join(destino, "%v", "segmento_%04d.ts"),
+            master_pl_name="maestra.m3u8",
+            var_stream_map=" ".join(mapa),
+            **opciones,
+        )
+        .global_args("-progress", "pipe:1", "-nostats", "-loglevel", "error")
+        .overwrite_output()
+    )
+
+
+def transcodificar_hls(origen: str, destino: str, alto, duracion_segundos: float, al_avanzar=None):
+    """
+    Ejecuta ffmpeg y va llamando a `al_avanzar(fraccion)` según el progreso
+    que ffmpeg informa por stdout. Lanza RuntimeError si ffmpeg falla.
+    """
+    os.makedirs(destino, exist_ok=True)
+    proceso = comando_hls(origen, destino, escalera_para(alto), tiene_audio(origen)).run_async(
+        pipe_stdout=True, pipe_stderr=True
+    )
+    # stderr se lee en otro hilo para que ffmpeg no se bloquee si se llena
+    errores = []
+    lector = threading.Thread(target=lambda: errores.append(proceso.stderr.read()), daemon=True)
+    lector.start()
+    ultimo_aviso = 0.0
+    for linea in proceso.stdout:
+        clave, _, valor = linea.decode(errors="replace").strip().partition("=")
+        # out_time_ms también viene en microsegundos
+        if clave in ("out_time_us", "out_time_ms") and valor.isdigit() and duracion_segundos:
+            if al_avanzar and time.monotonic() - ultimo_aviso >= INTERVALO_PROGRESO:
+                ultimo_aviso = time.monotonic()
+                al_avanzar(int(valor) / 1_000_000 / duracion_segundos)
+    codigo = proceso.wait()
+    lector.join()
+    if codigo != 0:
+        detalle = b"".join(errores).decode(errors="replace").strip()[-500:]
+        raise RuntimeError(f"ffmpeg terminó con código {codigo}: {detalle}")
+
+
+def carpeta_derivados(video, tipo: str) -> str:
+    """
+    Ruta relativa donde se guardan los derivados `tipo` del video: junto a
+    su objeto de almacenamiento (compartida por todos los videos con el
+    mismo contenido) o, para videos anteriores a éste, por id de video.
+    """
+    if video.sha256:
+        return f"media/objetos/{video.sha256}/{tipo}"
+    return f"media/{tipo}/{video.id_video.hex}"
+
+
+def generar_carpeta(final: str, generar):
+    """
+    Ejecuta `generar(carpeta)` sobre una carpeta temporal oculta junto a
+    `final` (`/media` no la sirve) y al terminar la renombra a `final`, así
+    un reintento nunca deja una salida a medias publicada. Si otro trabajo
+    con el mismo contenido publicó primero, se conserva la suya.
+    """
+    sufijo = f"{os.getpid()}-{threading.get_ident()}"
+    temporal = os.path.join(os.path.dirname(final), f".{os.path.basename(final)}.{sufijo}.tmp")
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    try:
+        generar(temporal)
+        try:
+            os.rename(temporal, final)
+        except OSError:
+            if not os.path.isdir(final):
+                raise
+            shutil.rmtree(temporal, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+
+
+@manejador("hls")
+def hls(cola: ColaMedia, db, trabajo, video):
+    """
+    Transcodifica el original a HLS y apunta `Video.ruta` a la lista
+    maestra. Mientras tanto el video se sigue reproduciendo desde el
+    original. Si el contenido ya se transcodificó se reutiliza.
+    """
+    ruta_relativa = carpeta_derivados(video, "hls")
+    final = cola.ruta_archivo(ruta_relativa)
+    if not os.path.isfile(os.path.join(final, "maestra.m3u8")):
+        generar_carpeta(final, lambda carpeta: transcodificar_hls(
+            cola.ruta_archivo(video.ruta_original or video.ruta),
+            carpeta,
+            video.alto,
+            video.duracion.total_seconds() if video.duracion else 0,
+            al_avanzar=lambda fraccion: cola.reportar_progreso(db, trabajo, min(fraccion, 0.99)),
+        ))
+    if video.ruta_original is None:
+        video.ruta_original = video.ruta
+    video.ruta = f"{ruta_relativa}/maestra.m3u8"
+    db.commit()
+
+
+# =====================================================
+# 🖼️ PÓSTER Y MINIATURAS PARA ADELANTAR
+# =====================================================
+# Por cada video se generan en su carpeta de derivados:
+#   - poster.jpg: un fotograma representativo, para que el
+#     feed muestre algo sin descargar bytes de video
+#   - sprite.jpg: una cuadrícula de miniaturas de baja
+#     resolución tomadas a intervalos regulares
+#   - miniaturas.vtt: índice WebVTT que asocia cada tramo
+#     del video con su recorte (#xywh=) dentro del sprite
+# =====================================================
+
+ANCHO_POSTER = 720
+ANCHO_MINIATURA = 160
+COLUMNAS_SPRITE = 10
+MAX_MINIATURAS = 100
+# Separación mínima entre miniaturas, en segundos
+INTERVALO_MINIATURAS = 2
+
+
+def _alto_par(ancho: int, ancho_original, alto_original) -> int:
+    """Alto (par, como exige libx264/mjpeg) que conserva la proporción original."""
+    if not ancho_original or not alto_original:
+        return ancho * 9 // 16 // 2 * 2
+    return max(2, round(ancho * alto_original / ancho_original / 2) * 2)
+
+
+def _tiempo_vtt(segundos: float) -> str:
+    milisegundos = int(round(segundos * 1000))
+    horas, resto = divmod(milisegundos, 3_600_000)
+    minutos, resto = divmod(resto, 60_000)
+    segundos, milisegundos = divmod(resto, 1000)
+    return f"{horas:02d}:{minutos:02d}:{segundos:02d}.{milisegundos:03d}"
+
+
+def generar_poster(origen: str, destino: str, duracion_segundos: float, ancho=None, alto=None):
+    """Extrae como póster un fotograma cercano al 10 % del video (máximo a los 3 s)."""
+    instante = min(duracion_segundos * 0.1, 3) if duracion_segundos else 0
+    ancho_poster = min(ANCHO_POSTER, ancho or ANCHO_POSTER)
+    (
+        ffmpeg.input(origen, ss=instante)
+        .filter("scale", ancho_poster, _alto_par(ancho_poster, ancho, alto))
+        .output(destino, vframes=1, **{"q:v": 3})
+        .global_args("-loglevel", "error")
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+
+def generar_sprite(origen: str, carpeta: str, duracion_segundos: float, ancho=None, alto=None,
+                   url_sprite: str = "sprite.jpg"):
+    """
+    Genera sprite.jpg y miniaturas.vtt en `carpeta`. Cada entrada del VTT
+    apunta a `url_sprite#xywh=x,y,w,h`.
+    """
+    intervalo = max(INTERVALO_MINIATURAS, duracion_segundos / MAX_MINIATURAS)
+    cantidad = min(MAX_MINIATURAS, max(1, math.ceil(duracion_segundos / intervalo)))
+    columnas = min(COLUMNAS_SPRITE, cantidad)
+    filas = -(-cantidad // columnas)
+    alto_miniatura = _alto_par(ANCHO_MINIATURA, ancho, alto)
+    (
+        ffmpeg.input(origen)
+        .filter("fps", fps=1 / intervalo)
+        .filter("scale", ANCHO_MINIATURA, alto_miniatura)
+        .filter("tile", f"{columnas}x{filas}")
+        .output(os.path.join(carpeta, "sprite.jpg"), vframes=1, **{"q:v": 5})
+        .global_args("-loglevel", "error")
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    lineas = ["WEBVTT", ""]
+    for i in range(cantidad):
+        inicio = i * intervalo
+        fin = min((i + 1) * intervalo, duracion_segundos) if duracion_segundos else intervalo
+        x, y = (i % columnas) * ANCHO_MINIATURA, (i // columnas) * alto_miniatura
+        lineas += [
+            f"{_tiempo_vtt(inicio)} --> {_tiempo_vtt(fin)}",
+            f"{url_sprite}#xywh={x},{y},{ANCHO_MINIATURA},{alto_miniatura}",
+            "",
+        ]
+    with open(os.path.join(carpeta, "miniaturas.vtt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lineas))
+
+
+@manejador("miniaturas")
+def miniaturas(cola: ColaMedia, db, trabajo, video):
+    """
+    Genera póster, sprite y su índice WebVTT, y guarda sus rutas en el
+    video. Si el contenido ya los tenía se reutilizan.
+    """
+    ruta_relativa = carpeta_derivados(video, "miniaturas")
+    final = cola.ruta_archivo(ruta_relativa)
+    origen = cola.ruta_archivo(video.ruta_original or video.ruta)
+    duracion = video.duracion.total_seconds() if video.duracion else 0
+
+    def generar(carpeta):
+        generar_poster(origen, os.path.join(carpeta, "poster.jpg"), duracion, video.ancho, video.alto)
+        cola.reportar_progreso(db, trabajo, 0.3)
+        generar_sprite(origen, carpeta, duracion, video.ancho, video.alto)
+
+    if not os.path.isfile(os.path.join(final, "miniaturas.vtt")):
+        generar_carpeta(final, generar)
+    video.poster = f"{ruta_relativa}/poster.jpg"
+    video.miniaturas_vtt = f"{ruta_relativa}/miniaturas.vtt"
+    db.commit()
@@ -0,0 +1,108 @@
+# =====================================================
+# 🧭 RECOMENDACIONES ("más como este")
+# =====================================================
+# Trabajo periódico que calcula los videos parecidos a
+# cada video a partir de la matriz de likes activos
+# (videos x usuarios): dos videos se parecen si les dieron
+# like los mismos usuarios (similitud coseno item-item).
+#
+# Los likes se leen por lotes a una matriz dispersa de
+# SciPy y el producto X · Xᵀ se calcula por bloques de
+# `filas_por_lote` videos, así la memoria queda acotada
+# por el tamaño de un bloque del resultado y no por
+# videos². De cada fila se guardan los `top_n` vecinos en
+# `video_similar`, que `GET /videos/{id}/similar` lee con
+# una sola búsqueda por clave primaria.
+# =====================================================
+
+from array import array
+import logging
+import time
+
+import numpy as np
+from scipy import sparse
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+
+def cargar_matriz_likes(db, max_likes_usuario: int = 0):
+    """
+    Construye la matriz binaria videos x usuarios de los likes activos.
+    Los usuarios con más de `max_likes_usuario` likes (0 = sin límite) se
+    omiten: aportan poca señal y su fila densifica el producto.
+    Retorna (matriz CSR, lista de id_video por fila).
+    """
+    videos, usuarios = {}, {}
+    filas, columnas = array("i"), array("i")
+    for id_usuario, id_video in crud.iterar_likes_activos(db):
+        filas.append(videos.setdefault(id_video, len(videos)))
+        columnas.append(usuarios.setdefault(id_usuario, len(usuarios)))
+    filas = np.frombuffer(filas, dtype=np.int32)
+    columnas = np.frombuffer(columnas, dtype=np.int32)
+    if max_likes_usuario > 0 and len(columnas):
+        likes_por_usuario = np.bincount(columnas, minlength=len(usuarios))
+        conservar = likes_por_usuario[columnas] <= max_likes_usuario
+        filas, columnas = filas[conservar], columnas[conservar]
+    matriz = sparse.csr_matrix(
+        (np.ones(len(filas), dtype=np.float32), (filas, columnas)),
+        shape=(len(videos), len(usuarios)),
+    )
+    return matriz, list(videos)
+
+
+def vecinos_coseno(matriz, top_n: int, filas_por_lote: int):
+    """
+    Similitud coseno entre filas de `matriz`, por bloques. Genera, para
+    cada fila, (fila, índices de vecinos, puntuaciones) con los `top_n`
+    vecinos de mayor similitud (sin la propia fila), ordenados.
+    """
+    normas = np.sqrt(np.asarray(matriz.multiply(matriz).sum(axis=1)).ravel())
+    normas[normas == 0] = 1
+    normalizada = sparse.diags((1 / normas).astype(np.float32)) @ matriz
+    normalizada = normalizada.tocsr()
+    traspuesta = normalizada.T.tocsr()
+    for inicio in range(0, normalizada.shape[0], filas_por_lote):
+        bloque = (normalizada[inicio:inicio + filas_por_lote] @ traspuesta).tocsr()
+        # La diagonal del bloque completo (similitud de cada video consigo mismo)
+        bloque.setdiag(0, k=inicio)
+        bloque.eliminate_zeros()
+        for desplazamiento in range(bloque.shape[0]):
+            desde, hasta = bloque.indptr[desplazamiento], bloque.indptr[desplazamiento + 1]
+            if desde == hasta:
+                continue
+            indices = bloque.indices[desde:hasta]
+            valores = bloque.data[desde:hasta]
+            if len(valores) > top_n:
+                mejores = np.argpartition(-valores, top_n)[:top_n]
+                indices, valores = indices[mejores], valores[mejores]
+            orden = np.lexsort((indices, -valores))
+            yield inicio + desplazamiento, indices[orden], valores[orden]
+
+
+def calcular_similares(fabrica_sesion, top_n: int = 20, filas_por_lote: int = 1000,
+                       max_likes_usuario: int = 5000):
+    """
+    Recalcula y guarda los vecinos de todos los videos con likes.
+    Los resultados se confirman por bloques: mientras corre, cada video
+    conserva sus vecinos anteriores hasta que se reemplazan.
+    """
+    inicio = time.monotonic()
+    db = fabrica_sesion()
+    try:
+        matriz, ids = cargar_matriz_likes(db, max_likes_usuario)
+        pendientes = {}
+        for fila, indices, valores in vecinos_coseno(matriz, top_n, filas_por_lote):
+            pendientes[ids[fila]] = [(ids[i], float(v)) for i, v in zip(indices, valores)]
+            if len(pendientes) >= filas_por_lote:
+                crud.guardar_similares(db, pendientes)
+                pendientes = {}
+        crud.guardar_similares(db, pendientes)
+        crud.purgar_similares(db)
+    finally:
+        db.close()
+    logger.info(
+        "Similares calculados para %s videos (%s likes) en %.1f s",
+        matriz.shape[0], matriz.nnz, time.monotonic() - inicio,
+    )
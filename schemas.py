@@ -9,7 +9,7 @@
 # =====================================================
 
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Optional, List, Literal
 from datetime import datetime, timedelta
 from uuid import UUID
 
@@ -72,6 +72,12 @@ class VideoCreate(VideoBase):
     id_usuario: int
 
 
+class VideoUpdate(BaseModel):
+    """Campos editables de un video (los omitidos no cambian)."""
+    titulo: Optional[str] = Field(None, min_length=1, max_length=200)
+    descripcion: Optional[str] = None
+
+
 class VideoResponse(VideoBase):
     """Datos devueltos por la API al listar videos."""
     id_video: UUID
@@ -80,11 +86,80 @@ class VideoResponse(VideoBase):
     etiqueta: Optional[str] = None
     likes: int = 0
     liked: bool = False
+    poster: Optional[str] = None
+    miniaturas_vtt: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+# =====================================================
+# ⚙️ PROCESAMIENTO DE MEDIOS
+# =====================================================
+
+class TrabajoMediaResponse(BaseModel):
+    """Estado de un trabajo de procesamiento en segundo plano."""
+    id_trabajo: int
+    tipo: str
+    estado: str
+    intentos: int
+    progreso: float
+    error: Optional[str] = None
 
     class Config:
         from_attributes = True
 
 
+class ProcesamientoResponse(BaseModel):
+    """Estado del procesamiento de un video y sus metadatos técnicos."""
+    id_video: UUID
+    estado: str
+    duracion: Optional[str] = None
+    ancho: Optional[int] = None
+    alto: Optional[int] = None
+    bitrate: Optional[int] = None
+    codec: Optional[str] = None
+    ruta: Optional[str] = None
+    ruta_original: Optional[str] = None
+    poster: Optional[str] = None
+    miniaturas_vtt: Optional[str] = None
+    trabajos: List[TrabajoMediaResponse] = []
+
+
+class VideoSubida(BaseModel):
+    """Campos de texto del formulario de `POST /upload_video`."""
+    titulo: str
+    descripcion: Optional[str] = ""
+    id_usuario: int
+    etiqueta: Optional[str] = ""
+
+
+# =====================================================
+# 🧩 SUBIDAS REANUDABLES
+# =====================================================
+
+class SubidaCreate(BaseModel):
+    """Datos requeridos para iniciar una subida reanudable por partes."""
+    titulo: str
+    descripcion: Optional[str] = ""
+    id_usuario: int
+    etiqueta: Optional[str] = ""
+    nombre_archivo: str
+    tamano_total: int = Field(..., gt=0)
+    tamano_parte: int = Field(8 * 1024 * 1024, ge=256 * 1024)
+
+
+class SubidaEstado(BaseModel):
+    """Estado de una subida reanudable: partes recibidas y pendientes."""
+    id_subida: str
+    nombre_archivo: str
+    tamano_total: int
+    tamano_parte: int
+    total_partes: int
+    recibidas: List[int]
+    completa: bool
+
+
 # =====================================================
 # 🏷️ ETIQUETA
 # =====================================================
@@ -100,7 +175,7 @@ class EtiquetaCreate(EtiquetaBase):
 
 
 class EtiquetaResponse(EtiquetaBase):
-    """Datos devueltos por la API al listar etiquetas."""
+    """Datos devueltos por la API al asociar una etiqueta a un video."""
     id_etiqueta: int
     id_video: UUID
 
@@ -108,6 +183,15 @@ class EtiquetaResponse(EtiquetaBase):
         from_attributes = True
 
 
+class EtiquetaConteoResponse(EtiquetaBase):
+    """Etiqueta del catálogo con el número de videos que la usan."""
+    id_etiqueta: int
+    total_videos: int
+
+    class Config:
+        from_attributes = True
+
+
 # =====================================================
 # ❤️ LIKE
 # =====================================================
@@ -120,6 +204,17 @@ class LikeResponse(BaseModel):
     like_id: Optional[UUID] = None
 
 
+class EstadoLikesRequest(BaseModel):
+    """Videos (p. ej. una página del feed) cuyo estado de like se consulta."""
+    id_usuario: int
+    ids: List[UUID] = Field(..., max_length=100)
+
+
+class EstadoLikeResponse(LikeResponse):
+    """Estado de 'like' de un video dentro de una consulta por lotes."""
+    id_video: UUID
+
+
 # =====================================================
 # 📊 INTERACCIÓN (Analítica de videos)
 # =====================================================
@@ -139,6 +234,52 @@ class InteraccionResponse(InteraccionBase):
         from_attributes = True
 
 
+class EventoInteraccion(BaseModel):
+    """
+    Un evento de reproducción enviado por lotes. `id_evento`, generado por
+    el cliente, permite descartar los eventos repetidos al reintentar.
+    """
+    id_evento: Optional[str] = Field(None, max_length=64)
+    id_video: UUID
+    tipo: Literal["vista", "progreso"]
+    segundos_vistos: float = Field(0, ge=0)
+    duracion_total: Optional[float] = None
+
+
+class LoteInteraccionesResponse(BaseModel):
+    """Resultado de aplicar un lote de eventos de reproducción."""
+    recibidos: int
+    duplicados: int
+    videos: int
+    # Videos del lote que no existen (sus eventos se descartan)
+    descartados: int
+
+
+class MetricaHorariaResponse(BaseModel):
+    """Métricas agregadas de un video en una hora (UTC)."""
+    hora: datetime
+    vistas: int
+    likes: int
+    progresos: int
+    segundos_vistos: float
+
+    class Config:
+        from_attributes = True
+
+
+class AnaliticasVideoResponse(BaseModel):
+    """
+    Retención y serie temporal de un video. `retencion[i]` es la fracción
+    de sesiones que vio al menos i/len(retencion) del video; `histograma`
+    trae los conteos por cubeta de los que se deriva.
+    """
+    id_video: UUID
+    sesiones: int
+    histograma: List[int]
+    retencion: List[float]
+    serie: List[MetricaHorariaResponse]
+
+
 # =====================================================
 # 🧩 RESPUESTAS AGRUPADAS / PAGINADAS
 # =====================================================
@@ -148,3 +289,38 @@ class PaginacionVideos(BaseModel):
     page: int
     has_more: bool
     videos: List[VideoResponse]
+    # Cursor opaco para pedir la siguiente página (paginación por cursor)
+    next_cursor: Optional[str] = None
+
+
+class PaginacionFeedPersonal(BaseModel):
+    """Modelo de respuesta para el feed personalizado de un usuario."""
+    has_more: bool
+    videos: List[VideoResponse]
+    next_cursor: Optional[str] = None
+
+
+class PaginacionBusqueda(BaseModel):
+    """Modelo de respuesta para los resultados de búsqueda, por relevancia."""
+    has_more: bool
+    videos: List[VideoResponse]
+    next_cursor: Optional[str] = None
+
+
+class ListaTendencias(BaseModel):
+    """Modelo de respuesta para los videos en tendencia, de mayor a menor puntuación."""
+    videos: List[VideoResponse]
+
+
+class ListaSimilares(BaseModel):
+    """Modelo de respuesta para los videos similares a uno dado, de más a menos parecido."""
+    videos: List[VideoResponse]
+
+
+class PaginacionAleatoria(BaseModel):
+    """Modelo de respuesta para el feed aleatorio paginado por sesión."""
+    has_more: bool
+    videos: List[VideoResponse]
+    # Semilla de la sesión: fija la permutación de videos entre páginas
+    seed: int
+    next_cursor: Optional[str] = None
@@ -0,0 +1,56 @@
+# =====================================================
+# ⏰ TAREAS PERIÓDICAS
+# =====================================================
+# Ejecuta trabajos de mantenimiento en hilos de fondo
+# mientras la API está en marcha (por ejemplo, la
+# reconciliación de contadores de likes).
+#
+# Las tareas se arrancan y detienen desde el ciclo de
+# vida de la aplicación en `main.py`.
+# =====================================================
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TareaPeriodica:
+    """
+    Ejecuta `funcion` cada `intervalo` segundos en un hilo de fondo.
+    Un intervalo menor o igual a 0 deshabilita la tarea.
+    """
+
+    def __init__(self, nombre: str, intervalo: float, funcion):
+        self.nombre = nombre
+        self.intervalo = intervalo
+        self.funcion = funcion
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        """Arranca el hilo de la tarea."""
+        if self.intervalo <= 0 or self._hilo is not None:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name=self.nombre, daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo y espera a que termine la ejecución en curso."""
+        if self._hilo is None:
+            return
+        self._detener.set()
+        self._hilo.join()
+        self._hilo = None
+
+    def ejecutar(self):
+        """Ejecuta la tarea una vez; los errores se registran sin detener el hilo."""
+        try:
+            self.funcion()
+        except Exception:
+            logger.exception("Error en la tarea periódica %s", self.nombre)
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.ejecutar()
@@ -0,0 +1,240 @@
+# =====================================================
+# 🔥 TENDENCIAS (ranking incremental)
+# =====================================================
+# Cada vista, progreso de reproducción y like suma a la
+# puntuación de su video un peso que decae a la mitad
+# cada `vida_media_horas`. En lugar de recalcular el
+# decaimiento de todos los videos, cada aporte se escala
+# por exp((t - EPOCA) / tau): el orden entre videos no
+# cambia con el paso del tiempo y una puntuación sólo se
+# toca cuando llega un evento de ese video. Para que los
+# valores no desborden se guardan como logaritmos.
+#
+# Los eventos se acumulan en memoria y un hilo de fondo
+# los suma a `puntuacion_tendencia` cada `intervalo`
+# segundos (bloqueando las filas, así varios procesos
+# suman sin pisarse) y recarga de ahí el top compartido.
+# `GET /videos/trending` lee el ranking ya ordenado.
+# =====================================================
+
+from datetime import datetime, timezone
+import heapq
+import logging
+import math
+import threading
+import time
+
+import crud
+from tareas import TareaPeriodica
+
+logger = logging.getLogger(__name__)
+
+# Origen fijo de la escala de puntuaciones
+EPOCA = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+# Pesos de cada evento
+PESO_VISTA = 1.0
+PESO_LIKE = 4.0
+# Peso máximo de un evento de progreso, proporcional a los segundos
+# vistos hasta `SEGUNDOS_REFERENCIA` (se suma al peso de la vista)
+PESO_PROGRESO = 3.0
+SEGUNDOS_REFERENCIA = 30.0
+
+# Puntuación mínima (relativa) de un video cuyos aportes se anularon
+_LOG_MINIMO = math.log(1e-9)
+
+
+def sumar_log(log_actual, valor: float, exponente: float) -> float:
+    """
+    Suma `valor * exp(exponente)` (con signo) a una puntuación guardada
+    como logaritmo. `log_actual` None equivale a una puntuación 0.
+    """
+    if valor == 0:
+        return log_actual if log_actual is not None else exponente + _LOG_MINIMO
+    log_valor = math.log(abs(valor)) + exponente
+    if valor > 0:
+        if log_actual is None:
+            return log_valor
+        mayor, menor = max(log_actual, log_valor), min(log_actual, log_valor)
+        return mayor + math.log1p(math.exp(menor - mayor))
+    if log_actual is None or log_valor >= log_actual:
+        return exponente + _LOG_MINIMO
+    return log_actual + math.log1p(-math.exp(log_valor - log_actual))
+
+
+def peso_incrementos(vistas: int, progresos: int, segundos: float) -> float:
+    """
+    Peso de un grupo de eventos de reproducción de un video; cada
+    progreso cuenta también como vista, igual que en `crud.registrar_progreso`.
+    """
+    peso = (vistas + progresos) * PESO_VISTA
+    if progresos:
+        peso += progresos * PESO_PROGRESO * min(segundos / progresos / SEGUNDOS_REFERENCIA, 1.0)
+    return peso
+
+
+class MotorTendencias:
+    """
+    Puntuaciones de tendencia con decaimiento exponencial, actualizadas
+    evento a evento, y el top-`top_k` listo para servir.
+    Con `intervalo` menor o igual a 0 el motor queda deshabilitado.
+    """
+
+    def __init__(self, fabrica_sesion, vida_media_horas: float, top_k: int, intervalo: float):
+        self.fabrica_sesion = fabrica_sesion
+        self.tau = vida_media_horas * 3600 / math.log(2)
+        self.top_k = top_k
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._lock_persistir = threading.Lock()
+        # id_video -> suma con signo de pesos * exp((t - referencia) / tau)
+        self._pendientes = {}
+        self._referencia = time.time()
+        # id_video -> log_puntuacion de los candidatos al top (persistidos + locales)
+        self._candidatos = {}
+        self._ranking = []
+        self._sucio = False
+        self._tarea = TareaPeriodica("tendencias", intervalo, self.persistir)
+
+    @property
+    def activo(self) -> bool:
+        return self.intervalo > 0
+
+    def exponente(self, instante: float) -> float:
+        return (instante - EPOCA) / self.tau
+
+    # -------------------------------------------------
+    # Registro de eventos
+    # -------------------------------------------------
+    def registrar_incrementos(self, incrementos: dict):
+        """Suma eventos de reproducción: id_video -> (vistas, progresos, segundos)."""
+        for id_video, (vistas, progresos, segundos) in incrementos.items():
+            self._sumar(id_video, peso_incrementos(vistas, progresos, segundos))
+
+    def registrar_like(self, id_video, activo: bool):
+        """Suma (o resta, al quitarlo) el peso de un like."""
+        self._sumar(id_video, PESO_LIKE if activo else -PESO_LIKE)
+
+    def _sumar(self, id_video, peso: float):
+        if not self.activo or peso == 0:
+            return
+        ahora = time.time()
+        with self._lock:
+            self._pendientes[id_video] = (
+                self._pendientes.get(id_video, 0.0) + peso * math.exp((ahora - self._referencia) / self.tau)
+            )
+            self._candidatos[id_video] = sumar_log(self._candidatos.get(id_video), peso, self.exponente(ahora))
+            self._sucio = True
+
+    def al_cambiar(self, evento: str, id_video):
+        """Oyente de `crud.notificar`: olvida los videos eliminados."""
+        if evento == "video_eliminado":
+            with self._lock:
+                self._pendientes.pop(id_video, None)
+                if self._candidatos.pop(id_video, None) is not None:
+                    self._sucio = True
+
+    # -------------------------------------------------
+    # Lectura
+    # -------------------------------------------------
+    def top(self, limite: int) -> list:
+        """Ids de los `limite` videos con mayor puntuación (hasta `top_k`)."""
+        with self._lock:
+            if self._sucio:
+                mejores = heapq.nlargest(self.top_k, self._candidatos.items(), key=lambda par: par[1])
+                self._ranking = [id_video for id_video, _ in mejores]
+                self._sucio = False
+            return self._ranking[:limite]
+
+    # -------------------------------------------------
+    # Persistencia
+    # -------------------------------------------------
+    def persistir(self):
+        """
+        Suma los eventos pendientes a las puntuaciones guardadas y recarga
+        los candidatos al top desde la base de datos (que incluye los
+        aportes de los demás procesos).
+        """
+        with self._lock_persistir:
+            with self._lock:
+                lote, self._pendientes = self._pendientes, {}
+                referencia, self._referencia = self._referencia, time.time()
+            db = self.fabrica_sesion()
+            try:
+                if lote:
+                    actuales = crud.bloquear_puntuaciones_tendencia(db, list(lote))
+                    exponente = self.exponente(referencia)
+                    crud.guardar_puntuaciones_tendencia(db, {
+                        id_video: sumar_log(actuales.get(id_video), valor, exponente)
+                        for id_video, valor in lote.items()
+                    })
+                # Margen sobre top_k para que los eventos locales puedan reordenar el top
+                persistidos = crud.get_top_tendencias(db, self.top_k * 4)
+            except Exception:
+                db.rollback()
+                self._reincorporar(lote, referencia)
+                raise
+            finally:
+                db.close()
+            with self._lock:
+                candidatos = dict(persistidos)
+                # Los eventos llegados durante la persistencia aún no están en la base
+                ahora = self.exponente(self._referencia)
+                for id_video, valor in self._pendientes.items():
+                    candidatos[id_video] = sumar_log(candidatos.get(id_video), valor, ahora)
+                self._candidatos = candidatos
+                self._sucio = True
+
+    def _reincorporar(self, lote: dict, referencia: float):
+        """Devuelve al acumulador un lote que no se pudo persistir."""
+        with self._lock:
+            factor = math.exp((referencia - self._referencia) / self.tau)
+            for id_video, valor in lote.items():
+                self._pendientes[id_video] = self._pendientes.get(id_video, 0.0) + valor * factor
+
+    def _sembrar(self, db):
+        """Puntuación inicial de cada video: sus contadores, fechados en su subida."""
+        lote = {}
+        for fila in crud.iterar_interacciones(db):
+            peso = peso_incrementos(
+                fila.total_vistas - fila.total_progresos, fila.total_progresos, fila.segundos_vistos_total
+            ) + fila.total_likes * PESO_LIKE
+            if peso <= 0 or fila.fecha_subida is None:
+                continue
+            subida = fila.fecha_subida.replace(tzinfo=timezone.utc).timestamp()
+            lote[fila.id_video] = sumar_log(None, peso, self.exponente(subida))
+            if len(lote) >= 1000:
+                crud.guardar_puntuaciones_tendencia(db, lote)
+                lote = {}
+        if lote:
+            crud.guardar_puntuaciones_tendencia(db, lote)
+        logger.info("Puntuaciones de tendencia sembradas")
+
+    # -------------------------------------------------
+    # Ciclo de vida
+    # -------------------------------------------------
+    def iniciar(self):
+        """
+        Siembra las puntuaciones si la tabla está vacía (antes de recibir
+        eventos, para no contarlos dos veces), carga el top y arranca la
+        persistencia periódica.
+        """
+        if not self.activo:
+            return
+        db = self.fabrica_sesion()
+        try:
+            if not crud.hay_puntuaciones_tendencia(db):
+                self._sembrar(db)
+        except Exception:
+            logger.exception("Error al sembrar las puntuaciones de tendencia")
+        finally:
+            db.close()
+        self._tarea.ejecutar()
+        self._tarea.iniciar()
+
+    def detener(self):
+        """Detiene la persistencia periódica y guarda los eventos pendientes."""
+        if not self.activo:
+            return
+        self._tarea.detener()
+        self._tarea.ejecutar()
@@ -0,0 +1,20 @@
+# =====================================================
+# 🧪 CONFIGURACIÓN DE LAS PRUEBAS
+# =====================================================
+# Las pruebas usan el modo local de database.py: una base
+# SQLite en un directorio temporal. Las que admiten
+# PostgreSQL se repiten contra TEST_DATABASE_URL si está
+# definida (p. ej. postgresql+pg8000://.../pruebas).
+# =====================================================
+
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+# main.py monta `static` y crea `media` relativos al directorio del proyecto
+os.chdir(RAIZ)
+
+DIRECTORIO_PRUEBAS = tempfile.mkdtemp(prefix="pruebas-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(DIRECTORIO_PRUEBAS, 'app.db')}")
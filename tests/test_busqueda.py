@@ -0,0 +1,76 @@
+# =====================================================
+# 🔎 BÚSQUEDA DE TEXTO
+# =====================================================
+# `crud.buscar_videos` resuelve la búsqueda con el índice
+# de texto (aquí la tabla FTS5 de SQLite) y no recorriendo
+# la tabla `video`, y sus páginas por cursor devuelven
+# cada resultado exactamente una vez.
+# =====================================================
+
+from datetime import timedelta
+import os
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from conftest import DIRECTORIO_PRUEBAS
+import crud
+import database
+import models
+
+VIDEOS = 60
+
+
+@pytest.fixture(scope="module")
+def fabrica_sesion():
+    motor = database.crear_motor(f"sqlite:///{os.path.join(DIRECTORIO_PRUEBAS, 'busqueda.db')}")
+    models.Base.metadata.drop_all(bind=motor)
+    models.Base.metadata.create_all(bind=motor)
+    fabrica = sessionmaker(autocommit=False, autoflush=False, bind=motor)
+    with fabrica() as db:
+        usuario = crud.crear_usuario(db, "busqueda", "busqueda@ejemplo.com", "x")
+        for numero in range(VIDEOS):
+            tema = "python" if numero % 3 == 0 else "cocina"
+            crud.crear_video(db, models.Video(
+                titulo=f"Curso de {tema} {numero}",
+                descripcion=f"Lección {numero} de {tema}" + " con python" * (numero % 4),
+                duracion=timedelta(seconds=60), id_usuario=usuario.id_usuario,
+                ruta=f"media/{numero}.mp4",
+            ))
+    yield fabrica
+    motor.dispose()
+
+
+def test_busqueda_usa_el_indice_de_texto(fabrica_sesion):
+    sentencias = []
+
+    def registrar(conexion, cursor, sentencia, parametros, contexto, varias):
+        sentencias.append((sentencia, parametros))
+
+    with fabrica_sesion() as db:
+        motor = db.get_bind()
+        event.listen(motor, "before_cursor_execute", registrar)
+        try:
+            assert crud.buscar_videos(db, "python", limit=5)[0]
+        finally:
+            event.remove(motor, "before_cursor_execute", registrar)
+        (sentencia, parametros), = sentencias
+        plan = [fila[-1] for fila in db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sentencia}", parametros)]
+    # FTS5 marca con "M" las restricciones MATCH que resuelve con su índice
+    assert any("VIRTUAL TABLE INDEX" in paso and ":M" in paso for paso in plan), plan
+    assert not any(paso.startswith("SCAN video ") or paso == "SCAN video" for paso in plan), plan
+
+
+def test_paginas_de_busqueda_no_repiten_ni_saltan_resultados(fabrica_sesion):
+    with fabrica_sesion() as db:
+        todos, _, _ = crud.buscar_videos(db, "python", limit=VIDEOS)
+        vistos, cursor = [], None
+        while True:
+            ids, has_more, cursor = crud.buscar_videos(db, "python", limit=7, cursor=cursor)
+            vistos += ids
+            if not has_more:
+                break
+    # Los videos de python más los de cocina que la mencionan en la descripción
+    assert len(todos) == sum(1 for numero in range(VIDEOS) if numero % 3 == 0 or numero % 4)
+    assert vistos == todos
@@ -0,0 +1,113 @@
+# =====================================================
+# 📰 CONSULTAS POR PÁGINA DEL FEED
+# =====================================================
+# Una página de `GET /videos` se hidrata con un número
+# fijo de consultas (sin N+1): contar las sentencias SQL
+# de cada petición y comprobar que no crecen con el
+# tamaño de la página. Además, los endpoints de lectura
+# nunca consultan con el motor síncrono desde el hilo del
+# bucle de eventos (lo bloquearían).
+# =====================================================
+
+from contextlib import contextmanager
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import database
+import main
+
+VIDEOS = 12
+
+
+@pytest.fixture(scope="module")
+def cliente():
+    main.COLA_MEDIA.trabajadores = 0
+    with TestClient(main.app) as cliente:
+        id_usuario = cliente.post(
+            "/usuarios", json={"nombre": "feed", "correo": "feed@ejemplo.com", "contrasena": "x"}
+        ).json()["id_usuario"]
+        for numero in range(VIDEOS):
+            id_video = cliente.post(
+                "/upload_video",
+                data={"titulo": f"video {numero}", "id_usuario": id_usuario, "etiqueta": f"tema {numero % 3}"},
+                files={"file": ("video.mp4", bytes([numero]) * 1000)},
+            ).json()["id_video"]
+            if numero % 2:
+                cliente.post(f"/videos/{id_video}/like?id_usuario={id_usuario}")
+        cliente.id_usuario = id_usuario
+        yield cliente
+
+
+@contextmanager
+def contar_sentencias():
+    """Cuenta las sentencias ejecutadas en los motores de la API mientras dura el bloque."""
+    contador = {"sentencias": 0}
+
+    def al_ejecutar(*args):
+        contador["sentencias"] += 1
+
+    motores = [database.engine, database.async_engine.sync_engine]
+    motores += [motor.sync_engine for motor in database.replica_engines]
+    for motor in motores:
+        event.listen(motor, "before_cursor_execute", al_ejecutar)
+    try:
+        yield contador
+    finally:
+        for motor in motores:
+            event.remove(motor, "before_cursor_execute", al_ejecutar)
+
+
+@pytest.mark.parametrize("con_usuario", [False, True], ids=["anonimo", "con_usuario"])
+def test_consultas_por_pagina_no_crecen_con_su_tamano(cliente, monkeypatch, con_usuario):
+    # Sin caché de páginas: cada petición hidrata la página desde la base de datos
+    monkeypatch.setattr(main, "FEED_CACHE_PAGINAS", 0)
+    consulta = f"&id_usuario={cliente.id_usuario}" if con_usuario else ""
+    sentencias = {}
+    for tamano in (1, 4, VIDEOS):
+        with contar_sentencias() as contador:
+            respuesta = cliente.get(f"/videos?page_size={tamano}{consulta}")
+        assert respuesta.status_code == 200
+        assert len(respuesta.json()["videos"]) == tamano
+        sentencias[tamano] = contador["sentencias"]
+    assert len(set(sentencias.values())) == 1, sentencias
+
+
+def test_lecturas_no_usan_el_motor_sincrono_en_el_bucle(cliente, monkeypatch):
+    # Sin caché: cada petición consulta la base de datos
+    async def sin_tarjetas(ids):
+        return {}
+
+    monkeypatch.setattr(main, "FEED_CACHE_PAGINAS", 0)
+    monkeypatch.setattr(main.CACHE_FEED, "get_tarjetas", sin_tarjetas)
+    primero = cliente.get("/videos?page_size=1").json()["videos"][0]["id_video"]
+    rutas = [
+        "/videos?page_size=5",
+        f"/videos/random?id_usuario={cliente.id_usuario}",
+        "/videos/buscar?q=video",
+        "/videos/trending",
+        f"/videos/{primero}/similar",
+        f"/feed_videos/{cliente.id_usuario}",
+    ]
+    # Hilos en los que corre cada motor: el asíncrono sólo en el del bucle
+    hilos = {"asincrono": set(), "sincrono": set()}
+
+    def registrar(tipo):
+        return lambda *args: hilos[tipo].add(threading.get_ident())
+
+    oyentes = [
+        (database.async_engine.sync_engine, registrar("asincrono")),
+        (database.engine, registrar("sincrono")),
+    ]
+    for motor, oyente in oyentes:
+        event.listen(motor, "before_cursor_execute", oyente)
+    try:
+        for ruta in rutas:
+            assert cliente.get(ruta).status_code == 200, ruta
+    finally:
+        for motor, oyente in oyentes:
+            event.remove(motor, "before_cursor_execute", oyente)
+    assert hilos["asincrono"]
+    assert not hilos["sincrono"] & hilos["asincrono"]
@@ -0,0 +1,122 @@
+# =====================================================
+# 👀 CONTADORES DE VISTAS Y PROGRESO BAJO CONCURRENCIA
+# =====================================================
+# Varios hilos, cada uno con su sesión, llaman a la vez a
+# `crud.registrar_vista` y `crud.registrar_progreso` sobre
+# el mismo video: los UPSERT atómicos no deben perder
+# ningún incremento. Tampoco el buffer de interacciones
+# al releer el total de un video con un lote en vuelo.
+# =====================================================
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import os
+import threading
+import time
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from buffer_interacciones import BufferInteracciones
+from conftest import DIRECTORIO_PRUEBAS
+import crud
+import database
+import models
+
+HILOS = 8
+EVENTOS_POR_HILO = 25
+SEGUNDOS_POR_PROGRESO = 1.5
+
+
+def _urls():
+    urls = [pytest.param(f"sqlite:///{os.path.join(DIRECTORIO_PRUEBAS, 'interacciones.db')}", id="sqlite")]
+    if os.getenv("TEST_DATABASE_URL"):
+        urls.append(pytest.param(os.environ["TEST_DATABASE_URL"], id="postgresql"))
+    return urls
+
+
+@pytest.fixture(params=_urls())
+def fabrica_sesion(request):
+    motor = database.crear_motor(request.param)
+    models.Base.metadata.drop_all(bind=motor)
+    models.Base.metadata.create_all(bind=motor)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=motor)
+    models.Base.metadata.drop_all(bind=motor)
+    motor.dispose()
+
+
+@pytest.fixture
+def id_video(fabrica_sesion):
+    with fabrica_sesion() as db:
+        usuario = crud.crear_usuario(db, "prueba", "prueba@ejemplo.com", "x")
+        video = models.Video(
+            titulo="video", descripcion="", duracion=timedelta(seconds=60),
+            id_usuario=usuario.id_usuario, ruta="media/video.mp4",
+        )
+        crud.crear_video(db, video)
+        return video.id_video
+
+
+def test_vistas_y_progreso_concurrentes_no_pierden_incrementos(fabrica_sesion, id_video):
+    inicio = threading.Barrier(HILOS)
+
+    def trabajador(indice):
+        inicio.wait()
+        with fabrica_sesion() as db:
+            for evento in range(EVENTOS_POR_HILO):
+                if (indice + evento) % 2:
+                    crud.registrar_vista(db, id_video)
+                else:
+                    crud.registrar_progreso(db, id_video, SEGUNDOS_POR_PROGRESO, 60)
+
+    with ThreadPoolExecutor(HILOS) as ejecutor:
+        list(ejecutor.map(trabajador, range(HILOS)))
+
+    progresos = sum(
+        1 for indice in range(HILOS) for evento in range(EVENTOS_POR_HILO) if not (indice + evento) % 2
+    )
+    with fabrica_sesion() as db:
+        interaccion = crud.get_interaccion_por_video(db, id_video)
+        # Cada evento de progreso cuenta también como vista
+        assert interaccion.total_vistas == HILOS * EVENTOS_POR_HILO
+        assert interaccion.total_progresos == progresos
+        assert interaccion.segundos_vistos_total == progresos * SEGUNDOS_POR_PROGRESO
+
+
+def test_buffer_ignora_relecturas_durante_un_lote_en_vuelo(fabrica_sesion, id_video, monkeypatch):
+    buffer = BufferInteracciones(fabrica_sesion, intervalo=60, retraso_maximo=60)
+    with fabrica_sesion() as db:
+        buffer.sembrar(crud.get_interaccion_por_video(db, id_video), time.monotonic())
+    for _ in range(3):
+        buffer.registrar_vista(id_video)
+
+    en_vuelo, continuar = threading.Event(), threading.Event()
+    aplicar = crud.aplicar_incrementos_interaccion
+
+    def aplicar_retenido(db, lote):
+        en_vuelo.set()
+        continuar.wait(5)
+        return aplicar(db, lote)
+
+    monkeypatch.setattr(crud, "aplicar_incrementos_interaccion", aplicar_retenido)
+    hilo = threading.Thread(target=buffer.flush)
+    hilo.start()
+    assert en_vuelo.wait(5)
+
+    # Con el lote en vuelo no hace falta releer; una lectura que no lo
+    # incluye se ignora tanto antes como después de que termine
+    assert buffer.conoce(id_video)
+    leido_desde = time.monotonic()
+    with fabrica_sesion() as db:
+        vieja = crud.get_interaccion_por_video(db, id_video)
+    assert vieja.total_vistas == 0
+    buffer.sembrar(vieja, leido_desde)
+    assert buffer.registrar_vista(id_video) == 4
+    continuar.set()
+    hilo.join()
+    buffer.sembrar(vieja, leido_desde)
+    assert buffer.registrar_vista(id_video) == 5
+
+    buffer.flush()
+    with fabrica_sesion() as db:
+        assert crud.get_interaccion_por_video(db, id_video).total_vistas == 5
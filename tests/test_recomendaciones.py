@@ -0,0 +1,51 @@
+# =====================================================
+# 🧭 VECINOS POR SIMILITUD COSENO
+# =====================================================
+# `recomendaciones.vecinos_coseno` calcula X · Xᵀ por
+# bloques de filas para acotar la memoria: con cualquier
+# tamaño de bloque debe dar los mismos vecinos que la
+# matriz de similitud completa calculada en denso.
+# =====================================================
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from recomendaciones import vecinos_coseno
+
+VIDEOS = 40
+USUARIOS = 30
+TOP_N = 5
+
+
+def _referencia(matriz):
+    """Similitud coseno densa entre filas, sin la diagonal."""
+    densa = matriz.toarray().astype(np.float64)
+    normas = np.linalg.norm(densa, axis=1)
+    normas[normas == 0] = 1
+    normalizada = densa / normas[:, None]
+    similitud = normalizada @ normalizada.T
+    np.fill_diagonal(similitud, 0)
+    return similitud
+
+
+@pytest.mark.parametrize("filas_por_lote", [1, 7, VIDEOS])
+def test_vecinos_por_bloques_coinciden_con_la_similitud_completa(filas_por_lote):
+    generador = np.random.default_rng(0)
+    likes = (generador.random((VIDEOS, USUARIOS)) < 0.15).astype(np.float32)
+    # Un video sin likes no tiene vecinos
+    likes[3] = 0
+    matriz = sparse.csr_matrix(likes)
+    similitud = _referencia(matriz)
+
+    resultado = {fila: (indices, valores) for fila, indices, valores in vecinos_coseno(matriz, TOP_N, filas_por_lote)}
+
+    esperadas = [fila for fila in range(VIDEOS) if similitud[fila].any()]
+    assert sorted(resultado) == esperadas
+    for fila, (indices, valores) in resultado.items():
+        mejores = np.sort(similitud[fila][similitud[fila] > 0])[::-1][:TOP_N]
+        # Mismas puntuaciones (los empates pueden elegir vecinos distintos)...
+        np.testing.assert_allclose(valores, mejores, rtol=1e-5)
+        # ...y cada vecino tiene de verdad esa similitud con la fila
+        np.testing.assert_allclose(similitud[fila][indices], valores, rtol=1e-5)
+        assert fila not in indices
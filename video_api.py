@@ -1,8 +1,10 @@
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from hashids import Hashids
 
+from medios import RespuestaArchivo
+
 # Crear app FastAPI
 app = FastAPI()
 
@@ -183,7 +185,7 @@ def pagina_principal():
 # --- Endpoints de la API ---
 
 @app.get("/videos/{hash_id}/archivo")
-def servir_video(hash_id: str):
+def servir_video(hash_id: str, request: Request):
     decoded = hashids.decode(hash_id)
     if not decoded:
         return JSONResponse({"error": "ID inválido"}, status_code=400)
@@ -192,7 +194,8 @@ def servir_video(hash_id: str):
     video = VIDEOS.get(video_id)
     if not video:
         return JSONResponse({"error": "Video no encontrado"}, status_code=404)
-    return FileResponse(video["archivo"], media_type="video/mp4")
+    # Admite Range y peticiones condicionales para poder adelantar el video
+    return RespuestaArchivo(video["archivo"], request.headers, metodo=request.method, media_type="video/mp4")
 
 
 @app.put("/videos/{hash_id}/vistas")